@@ -0,0 +1,546 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import run
+import run_async
+
+
+class FakeSlackServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections when a benchmark
+    # opens dozens at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeSlack:
+    # Local stand-in for the Slack endpoints run.py talks to. Messages posted
+    # through the webhook only show up in conversations.history after
+    # `visibility_delay` seconds, like on a busy workspace. `channel_latency`
+    # adds a delay to posts in the channels it names
+    def __init__(self, latency=0.0, visibility_delay=0.0, page_limit=100, rate_limit_every=0, retry_after=0, channel_latency=None):
+        self.latency = latency
+        self.channel_latency = channel_latency or {}
+        self.visibility_delay = visibility_delay
+        self.page_limit = page_limit
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.messages = []
+        self.channels = []
+        self.users = []
+        self.uploads = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.server = FakeSlackServer(("127.0.0.1", 0), self.handler())
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def next_ts(self):
+        with self.lock:
+            self.counter += 1
+            return f"{time.time():.0f}.{self.counter:06d}"
+
+    def post(self, channel, username, visible_at=None, thread_ts=None, metadata=None, text=None):
+        message = {
+            "ts": self.next_ts(),
+            "posted_at": time.time(),
+            "channel": channel,
+            "username": username,
+            "visible_at": visible_at or time.time(),
+            "thread_ts": thread_ts,
+            "metadata": metadata,
+            "text": text
+        }
+        with self.lock:
+            self.messages.append(message)
+        return message
+
+    def seed(self, channel, count, username="Someone Else"):
+        for _ in range(count):
+            self.post(channel, username)
+
+    def history(self, params):
+        channel = params.get("channel")
+        oldest = float(params.get("oldest", 0))
+        limit = min(int(params.get("limit", 100)), self.page_limit)
+        offset = int(params.get("cursor") or 0)
+        now = time.time()
+        with self.lock:
+            visible = [
+                m for m in reversed(self.messages)
+                if m["channel"] == channel and not m["thread_ts"] and m["visible_at"] <= now and float(m["ts"]) >= oldest
+            ]
+        page = visible[offset:offset + limit]
+        body = {"ok": True, "messages": [{k: m[k] for k in ("ts", "username", "metadata") if m[k]} for m in page]}
+        if offset + limit < len(visible):
+            body["response_metadata"] = {"next_cursor": str(offset + limit)}
+        return body
+
+    def replies(self, params):
+        oldest = float(params.get("oldest", 0))
+        with self.lock:
+            thread = [
+                m for m in self.messages
+                if m["channel"] == params.get("channel") and m["thread_ts"] == params.get("ts") and float(m["ts"]) > oldest
+            ]
+        return {"ok": True, "messages": [{k: m[k] for k in ("ts", "username", "metadata") if m[k]} for m in thread]}
+
+    def listing(self, field, items, params):
+        limit = min(int(params.get("limit", 100)), self.page_limit)
+        offset = int(params.get("cursor") or 0)
+        body = {"ok": True, field: items[offset:offset + limit]}
+        if offset + limit < len(items):
+            body["response_metadata"] = {"next_cursor": str(offset + limit)}
+        return body
+
+    def lookup_by_email(self, params):
+        for user in self.users:
+            if user["profile"].get("email") == params.get("email"):
+                return {"ok": True, "user": user}
+        return {"ok": False, "error": "users_not_found"}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, body, headers=None):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    return {k: v[0] for k, v in urllib.parse.parse_qs(raw.decode()).items()}
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    return json.loads(raw or b"{}")
+                return raw
+
+            def throttled(self, name):
+                with fake.lock:
+                    fake.requests[name] = fake.requests.get(name, 0) + 1
+                    count = fake.requests[name]
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.rate_limit_every and count % fake.rate_limit_every == 0:
+                    self.reply(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": str(fake.retry_after)})
+                    return True
+                return False
+
+            def do_GET(self):
+                parts = urllib.parse.urlsplit(self.path)
+                name = parts.path.rsplit("/", 1)[-1]
+                if self.throttled(name):
+                    return
+                params = {k: v[0] for k, v in urllib.parse.parse_qs(parts.query).items()}
+                if name == "conversations.history":
+                    return self.reply(200, fake.history(params))
+                if name == "conversations.replies":
+                    return self.reply(200, fake.replies(params))
+                if name == "conversations.list":
+                    return self.reply(200, fake.listing("channels", fake.channels, params))
+                if name == "users.list":
+                    return self.reply(200, fake.listing("members", fake.users, params))
+                if name == "users.lookupByEmail":
+                    return self.reply(200, fake.lookup_by_email(params))
+                self.reply(404, {"ok": False, "error": "unknown_method"})
+
+            def do_POST(self):
+                parts = urllib.parse.urlsplit(self.path)
+                if parts.path.startswith("/upload/"):
+                    if self.throttled("upload"):
+                        return
+                    remaining = received = int(self.headers.get("Content-Length", 0))
+                    while remaining:
+                        remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+                    fake.uploads[parts.path.rsplit("/", 1)[-1]] = received
+                    return self.reply(200, b"OK")
+
+                body = self.read_body()
+                if parts.path.startswith("/services/"):
+                    if self.throttled("webhook"):
+                        return
+                    time.sleep(fake.channel_latency.get(body.get("channel"), 0))
+                    fake.post(body.get("channel"), body.get("username"), time.time() + fake.visibility_delay, body.get("thread_ts"), body.get("metadata"))
+                    return self.reply(200, b"ok")
+                name = parts.path.rsplit("/", 1)[-1]
+                if self.throttled(name):
+                    return
+                if name == "chat.postMessage":
+                    time.sleep(fake.channel_latency.get(body.get("channel"), 0))
+                    text = body.get("text") or (body.get("attachments") or [{}])[0].get("fallback")
+                    message = fake.post(body.get("channel"), body.get("username"), thread_ts=body.get("thread_ts"), metadata=body.get("metadata"), text=text)
+                    return self.reply(200, {"ok": True, "channel": message["channel"], "ts": message["ts"]})
+                if name == "chat.update":
+                    with fake.lock:
+                        for message in fake.messages:
+                            if message["ts"] == body.get("ts") and body.get("text"):
+                                message["text"] = body["text"]
+                    return self.reply(200, {"ok": True, "channel": body.get("channel"), "ts": body.get("ts")})
+                if name == "files.getUploadURLExternal":
+                    file_id = f"F{fake.next_ts().replace('.', '')}"
+                    return self.reply(200, {"ok": True, "upload_url": f"{fake.url}/upload/{file_id}", "file_id": file_id})
+                if name == "files.completeUploadExternal":
+                    return self.reply(200, {"ok": True, "files": json.loads(body.get("files", "[]"))})
+                self.reply(404, {"ok": False, "error": "unknown_method"})
+
+        return Handler
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3)
+    }
+
+
+def send_kwargs(webhook_url, channel, message="Benchmark notification"):
+    return dict(
+        webhook_url=webhook_url, status="success", author_name="Benchmark", author_link="", author_icon="",
+        title="Benchmark", title_link="", message=message, color="good", slack_token="xoxb-bench",
+        channel_id=channel, write_env=False
+    )
+
+
+def bench_send(iterations, mode, **fake_options):
+    samples = []
+    with FakeSlack(**fake_options) as fake:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        template = run.PayloadTemplate.from_env()
+        for i in range(iterations):
+            channel = f"C{i:08d}"
+            url = f"{fake.url}/services/T000/B000/XXXX" if mode == "webhook" else run.slack_api("chat.postMessage")
+            start = time.perf_counter()
+            result = run.send_slack_message(template=template, **send_kwargs(url, channel))
+            samples.append(time.perf_counter() - start)
+            assert result.startswith("SLACK_THREAD_TS="), result
+        return dict(timings(samples), requests=dict(fake.requests))
+
+
+def bench_fan_out(latencies, iterations):
+    # One channel per latency. Each destination is timed until its message
+    # lands, which should track its own latency rather than the slowest one's
+    channels = [f"C{i:08d}" for i in range(len(latencies))]
+    with FakeSlack(channel_latency=dict(zip(channels, latencies))) as fake:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        destinations = [run.Destination("", "xoxb-bench", channel, "") for channel in channels]
+        message_kwargs = {
+            "status": "success", "author_name": "Benchmark", "author_link": "", "author_icon": "", "title": "Benchmark",
+            "title_link": "", "message": "Benchmark notification", "color": "good"
+        }
+        template = run.PayloadTemplate.from_env()
+        totals, delivered = [], {channel: [] for channel in channels}
+        for _ in range(iterations):
+            start = time.perf_counter()
+            wall_start = time.time()
+            results = run.send_fan_out(destinations, message_kwargs, template)
+            totals.append(time.perf_counter() - start)
+            assert all(result.startswith("SLACK_THREAD_TS=") for result in results), results
+            for message in fake.messages[-len(channels):]:
+                delivered[message["channel"]].append(message["posted_at"] - wall_start)
+        fastest = channels[latencies.index(min(latencies))]
+        assert max(delivered[fastest]) < max(latencies), "the slowest destination held up the others"
+        return {
+            "destinations": len(channels), "total": timings(totals),
+            "delivered": {f"{latency * 1000:g}ms": timings(delivered[channel]) for channel, latency in zip(channels, latencies)},
+            "requests": dict(fake.requests)
+        }
+
+
+def bench_daemon(iterations):
+    # Round trip through a running notifier daemon, as a later step would see it
+    samples = []
+    with FakeSlack() as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ.update({
+            "SLACK_API_URL": f"{fake.url}/api", "SLACK_TOKEN": "xoxb-bench", "CHANNEL_ID": "C00000000",
+            "SLACK_WEBHOOK": f"{fake.url}/services/T000/B000/XXXX", "GOOD_COMMS_STATE_DIR": tmp_dir
+        })
+        socket_path = os.path.join(tmp_dir, "bench.sock")
+        daemon = run.NotifierDaemon()
+        server = threading.Thread(target=daemon.serve, args=(socket_path,), daemon=True)
+        server.start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        for i in range(iterations):
+            start = time.perf_counter()
+            response = run.daemon_request({"op": "send", "spec": {"message": "Benchmark notification", "channel_id": f"C{i:08d}"}}, socket_path=socket_path)
+            samples.append(time.perf_counter() - start)
+            assert response["ok"], response
+        daemon.stopping.set()
+        server.join()
+        return dict(timings(samples), requests=dict(fake.requests))
+
+
+def bench_lookup(depths, iterations):
+    results = {}
+    with FakeSlack() as fake:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        for depth in depths:
+            samples = []
+            fake.requests.clear()
+            for i in range(iterations):
+                channel = f"D{depth:05d}{i:04d}"
+                fake.post(channel, "Benchmark")
+                fake.seed(channel, depth)
+                start = time.perf_counter()
+                run.get_message_ts("xoxb-bench", channel, "", "Benchmark", oldest="0", max_pages=depth // run.HISTORY_PAGE_LIMIT + 1)
+                samples.append(time.perf_counter() - start)
+            results[str(depth)] = dict(timings(samples), pages_per_lookup=fake.requests.get("conversations.history", 0) / iterations)
+    return results
+
+
+def bench_batch(items, concurrency, channels):
+    with FakeSlack() as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        os.environ["SLACK_WEBHOOK"] = run.slack_api("chat.postMessage")
+        spool = os.path.join(tmp_dir, "spool.jsonl")
+        with open(spool, "w") as spool_file:
+            for i in range(items):
+                spool_file.write(json.dumps({"message": f"item {i}", "channel_id": f"C{i % channels:08d}"}) + "\n")
+        start = time.perf_counter()
+        exit_code = run.run_batch(spool, concurrency, os.path.join(tmp_dir, "results.jsonl"))
+        elapsed = time.perf_counter() - start
+        os.environ.pop("SLACK_WEBHOOK")
+        return {"items": items, "concurrency": concurrency, "seconds": round(elapsed, 3), "per_second": round(items / elapsed, 1), "ok": exit_code == 0}
+
+
+def bench_replies(items, latency):
+    # Ordered replies under one parent, each recorded in the progress log
+    with FakeSlack(latency=latency) as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        parent = fake.post("C00000000", "Benchmark")["ts"]
+        lines = [json.dumps({"message": f"test_{i} failed", "status": "failure"}) for i in range(items)]
+        start = time.perf_counter()
+        result = run.post_replies(run.read_reply_items(lines), "xoxb-bench", "C00000000", parent, os.path.join(tmp_dir, "progress.jsonl"))
+        elapsed = time.perf_counter() - start
+        texts = [m["text"] for m in fake.messages if m["thread_ts"] == parent]
+        return {
+            "items": items, "latency_ms": latency * 1000, "seconds": round(elapsed, 3), "per_second": round(items / elapsed, 1),
+            "posted": result["posted"], "in_order": texts == [f"test_{i} failed" for i in range(items)]
+        }
+
+
+def bench_directory(users, iterations):
+    # One bulk warm-up against a paged users.list, then cached lookups as
+    # every later step of the job would do them
+    with FakeSlack(page_limit=200) as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ.update({"SLACK_API_URL": f"{fake.url}/api", "DIRECTORY_CACHE_DIR": tmp_dir})
+        fake.users = [{"id": f"U{i:08d}", "name": f"user{i}", "profile": {"real_name": f"User {i}", "email": f"user{i}@example.com"}} for i in range(users)]
+        fake.channels = [{"id": f"C{i:08d}", "name": f"channel-{i}"} for i in range(users // 10)]
+        directory = run.SlackDirectory.from_env("xoxb-bench")
+        start = time.perf_counter()
+        directory.warm_users()
+        directory.warm_channels()
+        warm_elapsed = time.perf_counter() - start
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            assert run.SlackDirectory.from_env("xoxb-bench").user_id(f"user{i % users}") == f"U{i % users:08d}"
+            samples.append(time.perf_counter() - start)
+        return dict(
+            timings(samples), users=users, warm_seconds=round(warm_elapsed, 3),
+            cache_kb=round(os.path.getsize(directory.store.path) / 1024, 1), requests=dict(fake.requests)
+        )
+
+
+def bench_async(sends, connections, latency):
+    # Many concurrent sends on one event loop, sharing a small connection pool
+    async def send_all(fake):
+        transport = run_async.AsyncTransport(max_connections=connections)
+        async with run_async.AsyncSlackClient("xoxb-bench", api_url=f"{fake.url}/api", transport=transport) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(client.send(f"C{i:08d}", "Benchmark notification") for i in range(sends)))
+            return time.perf_counter() - start, transport.connections
+
+    with FakeSlack(latency=latency) as fake:
+        elapsed, opened = asyncio.run(send_all(fake))
+        return {
+            "sends": sends, "connections": connections, "latency_ms": latency * 1000, "seconds": round(elapsed, 3),
+            "per_second": round(sends / elapsed, 1), "sockets_opened": opened
+        }
+
+
+def bench_upload(files, size_mb):
+    with FakeSlack() as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["SLACK_API_URL"] = f"{fake.url}/api"
+        paths = []
+        for i in range(files):
+            paths.append(os.path.join(tmp_dir, f"artifact-{i}.bin"))
+            with open(paths[-1], "wb") as artifact:
+                artifact.truncate(size_mb * 1024 * 1024)
+        tracemalloc.start()
+        start = time.perf_counter()
+        run.send_files(paths, "xoxb-bench", "C00000000", thread_ts="1.000001")
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {
+            "files": files, "size_mb": size_mb, "seconds": round(elapsed, 3),
+            "mb_per_second": round(files * size_mb / elapsed, 1), "peak_memory_kb": round(peak / 1024, 1)
+        }
+
+
+def bench_spool(entries):
+    # Replay throughput after an outage: every entry is due and goes out
+    # through the webhook, one fsync'd log record per entry
+    with FakeSlack() as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ.update({"SLACK_API_URL": f"{fake.url}/api", "SLACK_WEBHOOK": f"{fake.url}/services/T000/B000/XXXX"})
+        os.environ.pop("SLACK_TOKEN", None)
+        spool = run.RetrySpool(os.path.join(tmp_dir, "spool.jsonl"))
+        template = run.PayloadTemplate.from_env()
+        start = time.perf_counter()
+        for i in range(entries):
+            payload = template.render("failure", "Benchmark", "", "Benchmark", "", f"item {i}", "danger", f"C{i % 20:08d}", nonce=f"{i:032x}")
+            spool.add(f"{i:032x}", "webhook", payload["channel"], payload, "503", ambiguous=False)
+        add_elapsed = time.perf_counter() - start
+        log_bytes = os.path.getsize(spool.path)
+        start = time.perf_counter()
+        counts = spool.replay(run.replay_entry, force=True)
+        replay_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        spool.compact()
+        compact_elapsed = time.perf_counter() - start
+        return {
+            "entries": entries, "add_per_second": round(entries / add_elapsed, 1),
+            "replay_seconds": round(replay_elapsed, 3), "replay_per_second": round(entries / replay_elapsed, 1),
+            "sent": counts["sent"], "log_kb": round(log_bytes / 1024, 1),
+            "compacted_kb": round(os.path.getsize(spool.path) / 1024, 1), "compact_ms": round(compact_elapsed * 1000, 3)
+        }
+
+
+def bench_dedup(entries, iterations):
+    # Hash and check a repeated notification against a full store, which is
+    # what a suppressed re-run costs instead of a post and a history lookup
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = run.JsonStore(os.path.join(tmp_dir, "dedup.json"), 3600, entries)
+        store.update({f"{i:032x}": {"output": "SLACK_THREAD_TS=1.2\n", "sent_at": time.time(), "count": 0} for i in range(entries + 1)})
+        deduplicator = run.Deduplicator(store, 3600)
+        context = run.GitHubContext("https://github.com", "octo/repo", "abc123", "CI", "refs/heads/main", "push", "octocat", "42", "1")
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            digest = run.content_hash("failure", context, f"Tests failed after {i}.5s")
+            deduplicator.seen(run.Deduplicator.key(["C12345678"], "Benchmark", digest))
+            samples.append(time.perf_counter() - start)
+        return dict(timings(samples), entries=len(store._read()), store_kb=round(os.path.getsize(store.path) / 1024, 1))
+
+
+def bench_log_tail(size_mb, iterations):
+    # The log is a sparse hole with real lines at the end, so a full read
+    # would show up as seconds and megabytes
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "build.log")
+        with open(path, "wb") as log_file:
+            log_file.truncate(size_mb * 1024 * 1024)
+            log_file.seek(0, os.SEEK_END)
+            log_file.write(b"".join(b"step %d: \x1b[32mok\x1b[0m\n" % i for i in range(10000)))
+        samples = []
+        tracemalloc.start()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            tail = run.format_code_block(run.read_log_tail(path))
+            chunks = run.split_message(f"Build failed\n{tail}")
+            samples.append(time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return dict(timings(samples), log_mb=size_mb, parts=len(chunks), peak_memory_kb=round(peak / 1024, 1))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmarks(quick=False):
+    iterations = 5 if quick else 50
+    saved_env = dict(os.environ)
+    for name in ("GITHUB_ENV", "SLACK_THREAD_TS", "THREAD_REGISTRY"):
+        os.environ.pop(name, None)
+    # Throughput numbers measure run.py, not the scheduler's deliberate pacing
+    run.rate_limiter.enabled = False
+    try:
+        results = {
+            "send_webhook": bench_send(iterations, "webhook"),
+            "send_webhook_visibility_delay": bench_send(max(2, iterations // 10), "webhook", visibility_delay=0.3),
+            "send_token": bench_send(iterations, "token"),
+            "send_token_latency_20ms": bench_send(iterations, "token", latency=0.02),
+            "send_daemon": bench_daemon(iterations),
+            "send_fan_out": bench_fan_out([0.01, 0.05, 0.2, 1.0], 3 if quick else 10),
+            "send_async": bench_async(200 if quick else 2000, 32, 0.02),
+            "send_token_rate_limited": bench_send(iterations, "token", rate_limit_every=3, retry_after=0),
+            "lookup_by_channel_size": bench_lookup([0, 50, 250] if quick else [0, 50, 250, 450], iterations),
+            "batch": bench_batch(20 if quick else 200, 8, 20),
+            "replies": bench_replies(20 if quick else 200, 0.005),
+            "directory": bench_directory(500 if quick else 5000, iterations),
+            "spool_replay": bench_spool(50 if quick else 500),
+            "dedup": bench_dedup(run.DEDUP_MAX_ENTRIES, iterations),
+            "log_tail": bench_log_tail(64 if quick else 4096, iterations),
+            "upload": bench_upload(2 if quick else 4, 1 if quick else 32)
+        }
+    finally:
+        run.rate_limiter.enabled = True
+        os.environ.clear()
+        os.environ.update(saved_env)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "backend": run.http_backend(),
+        "timestamp": time.time(),
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark run.py against a local Slack stand-in.")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON results")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for smoke runs")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.quick)
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    for name, result in report["results"].items():
+        print(name, json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
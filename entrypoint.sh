@@ -11,7 +11,34 @@ export SLACK_MESSAGE="${INPUT_MESSAGE:-"Notification from GitHub Action"}"
 export COLOR="${INPUT_COLOR:-"#36a64f"}"
 export SLACK_TOKEN="${INPUT_SLACK_TOKEN}"
 export CHANNEL_ID="${INPUT_CHANNEL_ID}"
-export MSG_MODE="${INPUT_MSG_MODE:-"WEBHOOK"}"
+export MSG_MODE="${INPUT_MSG_MODE:-"AUTO"}"
+export STATUS_MESSAGE="${INPUT_STATUS_MESSAGE:-"false"}"
+export DIGEST_MODE="${INPUT_DIGEST_MODE:-""}"
+export DIGEST_LEG="${INPUT_DIGEST_LEG:-""}"
+export DIGEST_DIR="${INPUT_DIGEST_DIR:-""}"
+export DIGEST_FAILURE_DETAILS="${INPUT_DIGEST_FAILURE_DETAILS:-"false"}"
+export MSG_STYLE="${INPUT_MSG_STYLE:-"attachment"}"
+export HTTP_BACKEND="${INPUT_HTTP_BACKEND:-"auto"}"
+export SLACK_FILE_UPLOAD="${INPUT_SLACK_FILE_UPLOAD:-""}"
+export THREAD_REGISTRY="${INPUT_THREAD_REGISTRY:-"false"}"
+export THREAD_REGISTRY_SCOPE="${INPUT_THREAD_REGISTRY_SCOPE:-"run"}"
+export FANOUT_CONCURRENCY="${INPUT_FANOUT_CONCURRENCY:-"4"}"
+export MENTION_ACTOR="${INPUT_MENTION_ACTOR:-"false"}"
+export SLACK_USER_MAP="${INPUT_SLACK_USER_MAP:-""}"
+export DIRECTORY_CACHE_DIR="${INPUT_DIRECTORY_CACHE_DIR:-""}"
+export REPLIES_FILE="${INPUT_REPLIES_FILE:-""}"
+export REPLIES_PROGRESS="${INPUT_REPLIES_PROGRESS:-""}"
+export LOG_TAIL_FILE="${INPUT_LOG_TAIL_FILE:-""}"
+export LOG_TAIL_LINES="${INPUT_LOG_TAIL_LINES:-"50"}"
+export LOG_TAIL_KB="${INPUT_LOG_TAIL_KB:-"16"}"
+export FAIL_ON_ERROR="${INPUT_FAIL_ON_ERROR:-"false"}"
+export RETRY_SPOOL="${INPUT_RETRY_SPOOL:-"false"}"
+export DEDUP_WINDOW="${INPUT_DEDUP_WINDOW:-""}"
+export DEDUP_MODE="${INPUT_DEDUP_MODE:-"count"}"
+export DEADLINE_SECONDS="${INPUT_DEADLINE_SECONDS:-""}"
+export HISTORY_HEDGE_DELAY="${INPUT_HISTORY_HEDGE_DELAY:-""}"
+export TIMINGS_FILE="${INPUT_TIMINGS_FILE:-""}"
+export GOOD_COMMS_PROFILE="${INPUT_PROFILE:-""}"
 
 
 if [ -z "$SLACK_WEBHOOK" ]; then
@@ -43,10 +70,29 @@ if [ -n "$INPUT_SLACK_THREAD_TS" ]; then
   export SLACK_THREAD_TS="${INPUT_SLACK_THREAD_TS}"
 fi
 
-output=$(python3 /usr/src/app/run.py)
+# A notification that could not be sent does not block the build unless asked to
+finish() {
+  if [ "$1" -ne 0 ] && [ "$FAIL_ON_ERROR" != "true" ]; then
+    echo "::warning::The Slack notification could not be sent (exit code $1)"
+    exit 0
+  fi
+  exit "$1"
+}
+
+if [ -n "$INPUT_BATCH_FILE" ]; then
+  python3 -P -m run batch "$INPUT_BATCH_FILE" \
+    --concurrency "${INPUT_BATCH_CONCURRENCY:-4}" \
+    --output "${INPUT_BATCH_RESULTS:-"$INPUT_BATCH_FILE.results.jsonl"}"
+  finish $?
+fi
+
+output=$(python3 -P -m run)
+status=$?
 
 echo "::add-mask::$output"
 
 env_vars=$(echo "$output" | grep -E 'SLACK_THREAD_TS|SLACK_CHANNEL|SLACK_MESSAGE_ID')
 
-echo "$env_vars" >> $GITHUB_ENV
\ No newline at end of file
+echo "$env_vars" >> $GITHUB_ENV
+
+finish $status
\ No newline at end of file
@@ -1,19 +1,28 @@
 import os
-import requests
+import argparse
+import http.client
 import json
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+import ssl
+import urllib.parse
+from collections import namedtuple
 import time
 import sys
 import logging
+import fcntl
+import hashlib
+import queue
+import random
+import re
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
+logger = logging.getLogger("good_comms")
 
 # Constants
 ENV_VARS = [
@@ -25,9 +34,171 @@ ENV_VARS = [
     "SLACK_FILE_UPLOAD", "MSG_MODE"
 ]
 
+SLACK_API_URL = "https://slack.com/api"
+
+# Message modes. AUTO posts with the token when one is available and keeps
+# the webhook as a fallback for these chat.postMessage errors
+MSG_MODES = ("AUTO", "WEBHOOK", "TOKEN")
+TOKEN_FALLBACK_ERRORS = {
+    "not_in_channel", "channel_not_found", "missing_scope", "not_allowed_token_type",
+    "invalid_auth", "not_authed", "account_inactive", "token_revoked", "restricted_action"
+}
+METADATA_EVENT_TYPE = "good_comms_notification"
+
+# conversations.history lookup
+HISTORY_PAGE_LIMIT = 100
+HISTORY_MAX_PAGES = 5
+HISTORY_MAX_POLLS = 4
+HISTORY_POLL_BACKOFF = 0.25
+HISTORY_POLL_BACKOFF_MAX = 2.0
+HISTORY_WINDOW_SKEW = 30
+
+# Telemetry
+OTLP_TIMEOUT = 2.0
+TELEMETRY_MAX_SPANS = 1000
+
+# HTTP transport
+HTTP_POOL_SIZE = 10
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF = 0.5
+HTTP_BACKOFF_MAX = 30.0
+HTTP_RETRY_STATUSES = {500, 502, 503, 504}
+HTTP_POST_MAX_RETRIES = 2
+POST_RECOVERY_DELAY = 1.0
+HTTP_BACKENDS = ("auto", "stdlib", "requests")
+HTTP_BLOCKSIZE = 64 * 1024
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 20.0
+
+# Deadline budget. The lookup gives up while DEADLINE_RESERVE seconds are
+# left for the work after it; the watchdog fires DEADLINE_GRACE after the
+# deadline and again after twice that
+DEADLINE_RESERVE = 2.0
+DEADLINE_GRACE = 5.0
+DEADLINE_EXIT_CODE = 124
+
+# Slack rate limits: requests per minute for each Web API tier, and the
+# per-channel posting limit shared by chat.postMessage and incoming webhooks
+RATE_TIERS = {1: (1, 1), 2: (20, 3), 3: (50, 5), 4: (100, 10)}
+METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "conversations.list": 2,
+    "users.list": 2,
+    "users.lookupByEmail": 3,
+    "chat.update": 3,
+    "files.upload": 2,
+    "files.getUploadURLExternal": 4,
+    "files.completeUploadExternal": 4
+}
+CHANNEL_POSTS_PER_SECOND = 1.0
+CHANNEL_POST_BURST = 3
+
+# Batch mode
+BATCH_CONCURRENCY = 4
+FANOUT_CONCURRENCY = 4
+DESTINATION_VARS = ("SLACK_WEBHOOK", "SLACK_TOKEN", "CHANNEL_ID", "SLACK_THREAD_TS")
+RESULT_KEYS = ("SLACK_THREAD_TS", "SLACK_CHANNEL", "SLACK_MESSAGE_ID")
+SEND_FIELDS = (
+    "webhook_url", "status", "author_name", "author_link", "author_icon", "title",
+    "title_link", "message", "color", "slack_token", "channel_id", "thread_ts", "idempotency_key"
+)
+STATUS_COLORS = {
+    "success": "good",
+    "cancelled": "#808080",
+    "failure": "danger"
+}
+
+# Threaded replies
+REPLY_QUEUE_SIZE = 32
+REPLY_PROGRESS_EVERY = 50
+
+# File uploads
+UPLOAD_CONCURRENCY = 4
+
+# Channel and user directory
+DIRECTORY_CACHE_TTL = 24 * 60 * 60
+DIRECTORY_NEGATIVE_TTL = 60 * 60
+DIRECTORY_PAGE_LIMIT = 500
+DIRECTORY_MAX_PAGES = 50
+SLACK_ID = re.compile(r"^[CGDUW][A-Z0-9]{8,}$")
+GITHUB_NOREPLY_DOMAIN = "users.noreply.github.com"
+
+# Payload templates
+MSG_STYLES = ("attachment", "blocks")
+# A section block takes at most ten fields and a message at most 50 blocks.
+# A digest of GitHub's largest matrix (256 jobs) still fits in full
+BLOCK_SECTION_FIELDS = 10
+BLOCK_MAX_FIELD_SECTIONS = 45
+GITHUB_CONTEXT_VARS = (
+    "GITHUB_SERVER_URL", "GITHUB_REPOSITORY", "GITHUB_SHA", "GITHUB_WORKFLOW", "GITHUB_REF",
+    "GITHUB_EVENT_NAME", "GITHUB_ACTOR", "GITHUB_RUN_ID", "GITHUB_RUN_ATTEMPT"
+)
+
+# Matrix digests
+DIGEST_STATUSES = {
+    "success": "success", "succeeded": "success", "passed": "success",
+    "failure": "failure", "failed": "failure",
+    "cancelled": "cancelled", "canceled": "cancelled"
+}
+DIGEST_ICONS = {"success": ":white_check_mark:", "failure": ":x:", "cancelled": ":heavy_minus_sign:"}
+
+# Thread registry
+THREAD_REGISTRY_FILE = ".good-comms-threads.json"
+THREAD_REGISTRY_TTL = 24 * 60 * 60
+
+# Live status message
+STATUS_MESSAGE_FILE = ".good-comms-status.json"
+STATUS_COALESCE_WINDOW = 2.0
+
+# Deduplication across runs. Timestamps and durations differ between re-runs
+# of the same failure, so they are masked before hashing
+DEDUP_FILE = ".good-comms-dedup.json"
+DEDUP_MODES = ("count", "suppress")
+DEDUP_MAX_ENTRIES = 1000
+VOLATILE_TEXT = re.compile(
+    r"\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(z|[+-]\d{2}:?\d{2})?"
+    r"|\b\d+(\.\d+)?\s?(ms|s|sec|secs|seconds|m|min|mins|minutes)\b"
+)
+
+# Message splitting and log tails. The first part leaves room for the
+# title, since a Block Kit section takes at most 3000 characters
+MESSAGE_FIRST_CHUNK_CHARS = 2800
+MESSAGE_CHUNK_CHARS = 3900
+MESSAGE_MAX_CHUNKS = 10
+LOG_TAIL_LINES = 50
+LOG_TAIL_KB = 16
+LOG_TAIL_BLOCKSIZE = 64 * 1024
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[ -/]*[@-~]")
+
+# Retry spool
+SPOOL_FILE = ".good-comms-spool.jsonl"
+SPOOL_MAX_ATTEMPTS = 8
+SPOOL_BACKOFF = 15.0
+SPOOL_BACKOFF_MAX = 30 * 60
+SPOOL_TTL = 24 * 60 * 60
+SPOOL_COMPACT_BYTES = 256 * 1024
+SPOOL_REPLAY_INTERVAL = 30.0
+IDEMPOTENCY_CONTEXT_VARS = ("GITHUB_REPOSITORY", "GITHUB_RUN_ID", "GITHUB_RUN_ATTEMPT", "GITHUB_JOB", "GITHUB_ACTION")
+
+# Notifier daemon
+DAEMON_SOCKET_FILE = "good-comms.sock"
+DAEMON_LOG_FILE = "good-comms-daemon.log"
+DAEMON_IDLE_TIMEOUT = 60 * 60
+DAEMON_REQUEST_TIMEOUT = 60.0
+DAEMON_START_TIMEOUT = 5.0
+DAEMON_MAX_REQUEST = 1024 * 1024
+CLIENT_ENV_FIELDS = {
+    "SLACK_MESSAGE": "message", "STATUS": "status", "TITLE": "title", "TITLE_LINK": "title_link",
+    "AUTHOR_NAME": "author_name", "AUTHOR_LINK": "author_link", "AUTHOR_ICON": "author_icon",
+    "COLOR": "color", "CHANNEL_ID": "channel_id", "SLACK_THREAD_TS": "thread_ts"
+}
+
 
 class Webhook:
-    def __init__(self, text="", username="", icon_url="", icon_emoji="", channel="", link_names="", unfurl_links=False, attachments=None, thread_ts=""):
+    __slots__ = ("text", "username", "icon_url", "icon_emoji", "channel", "link_names", "unfurl_links", "attachments", "thread_ts", "metadata")
+
+    def __init__(self, text="", username="", icon_url="", icon_emoji="", channel="", link_names="", unfurl_links=False, attachments=None, thread_ts="", metadata=None):
         self.text = text
         self.username = username
         self.icon_url = icon_url
@@ -37,95 +208,1561 @@ class Webhook:
         self.unfurl_links = unfurl_links
         self.attachments = attachments or []
         self.thread_ts = thread_ts
+        self.metadata = metadata
+
+    def to_dict(self):
+        payload = {
+            "username": self.username,
+            "icon_url": self.icon_url,
+            "icon_emoji": self.icon_emoji,
+            "channel": self.channel,
+            "attachments": [attachment.to_dict() for attachment in self.attachments]
+        }
+        if self.text:
+            payload["text"] = self.text
+        if self.link_names:
+            payload["link_names"] = self.link_names
+        if self.unfurl_links:
+            payload["unfurl_links"] = True
+        if self.thread_ts:
+            payload["thread_ts"] = self.thread_ts
+        if self.metadata:
+            payload["metadata"] = self.metadata
+        return payload
 
 
 class Attachment:
-    def __init__(self, fallback, pretext="", color="", author_name="", author_link="", author_icon="", footer="", fields=None):
+    __slots__ = ("fallback", "pretext", "color", "author_name", "author_link", "author_icon", "title", "title_link", "footer", "fields", "blocks")
+
+    def __init__(self, fallback, pretext="", color="", author_name="", author_link="", author_icon="", footer="", fields=None, title="", title_link="", blocks=None):
         self.fallback = fallback
         self.pretext = pretext
         self.color = color
         self.author_name = author_name
         self.author_link = author_link
         self.author_icon = author_icon
+        self.title = title
+        self.title_link = title_link
         self.footer = footer
         self.fields = fields or []
+        self.blocks = blocks
+
+    def to_dict(self):
+        attachment = {"fallback": self.fallback, "color": self.color}
+        if self.blocks:
+            attachment["blocks"] = self.blocks
+        else:
+            attachment.update({
+                "author_name": self.author_name,
+                "author_link": self.author_link,
+                "author_icon": self.author_icon,
+                "title": self.title,
+                "title_link": self.title_link,
+                "fields": [field if isinstance(field, dict) else field.to_dict() for field in self.fields]
+            })
+        if self.pretext:
+            attachment["pretext"] = self.pretext
+        if self.footer:
+            attachment["footer"] = self.footer
+        return attachment
 
 
 class Field:
+    __slots__ = ("title", "value", "short")
+
     def __init__(self, title="", value="", short=False):
         self.title = title
         self.value = value
         self.short = short
 
+    def to_dict(self):
+        return {"title": self.title, "value": self.value, "short": self.short}
+
 
 def get_env(name, default=""):
     return os.getenv(name, default).strip()
 
 
-def send_file(filename, message, channel, thread_ts):
+def slack_api(method):
+    return f"{get_env('SLACK_API_URL', SLACK_API_URL).rstrip('/')}/{method}"
+
+
+class Telemetry:
+    # Collects timed spans for the hot path. Spans nest per thread, so batch
+    # and fan-out sends keep their own parent/child chains
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.started = time.time()
+        self.spans = []
+        self.phases = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = {
+            "name": name,
+            "span_id": os.urandom(8).hex(),
+            "parent_id": stack[-1]["span_id"] if stack else None,
+            "start": time.time(),
+            "attributes": attributes
+        }
+        stack.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as err:
+            record["error"] = str(err) or type(err).__name__
+            raise
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            stack.pop()
+            with self.lock:
+                # Long batch runs keep the per-phase totals but stop keeping
+                # individual spans once the cap is reached
+                phase = self.phases.setdefault(name, {"count": 0, "total_ms": 0.0})
+                phase["count"] += 1
+                phase["total_ms"] = round(phase["total_ms"] + record["duration_ms"], 3)
+                if len(self.spans) < TELEMETRY_MAX_SPANS:
+                    self.spans.append(record)
+                else:
+                    self.dropped += 1
+
+    def summary(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda record: record["start"])
+            phases = {name: dict(phase) for name, phase in self.phases.items()}
+        return {
+            "total_ms": round((time.time() - self.started) * 1000, 3),
+            "phases": phases,
+            "dropped_spans": self.dropped,
+            "spans": [
+                dict({"name": r["name"], "ms": r["duration_ms"]}, **r["attributes"], **({"error": r["error"]} if "error" in r else {}))
+                for r in spans
+            ]
+        }
+
+    def otlp(self):
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        with self.lock:
+            spans = list(self.spans)
+        otlp_spans = []
+        for record in spans:
+            start = int(record["start"] * 1e9)
+            span = {
+                "traceId": self.trace_id,
+                "spanId": record["span_id"],
+                "name": record["name"],
+                "kind": 3 if record["name"] == "http" else 1,
+                "startTimeUnixNano": str(start),
+                "endTimeUnixNano": str(start + int(record["duration_ms"] * 1e6)),
+                "attributes": [attribute(k, v) for k, v in record["attributes"].items()],
+                "status": {"code": 2, "message": record["error"]} if "error" in record else {"code": 1}
+            }
+            if record["parent_id"]:
+                span["parentSpanId"] = record["parent_id"]
+            otlp_spans.append(span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", get_env("OTEL_SERVICE_NAME", "good-comms"))]},
+            "scopeSpans": [{"scope": {"name": "good-comms"}, "spans": otlp_spans}]
+        }]}
+
+
+telemetry = Telemetry()
+
+
+def timed_create_connection(address, timeout=None, source_address=None):
+    host, port = address
+    with telemetry.span("dns", host=host):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    with telemetry.span("tcp_connect", host=host):
+        error = None
+        for family, _, _, _, sockaddr in addresses:
+            try:
+                return socket.create_connection(sockaddr[:2], timeout, source_address)
+            except OSError as err:
+                error = err
+        raise error or OSError(f"No addresses found for {host}")
+
+
+def emit_telemetry():
+    summary = telemetry.summary()
+    serialized = json.dumps(summary, separators=(",", ":"))
+    github_output_path = os.getenv("GITHUB_OUTPUT")
+    if github_output_path:
+        with open(github_output_path, "a") as output_file:
+            output_file.write(f"TIMINGS={serialized}\n")
+    timings_file = get_env("TIMINGS_FILE")
+    if timings_file:
+        with open(timings_file, "w") as output_file:
+            json.dump(summary, output_file, indent=2)
+    otlp_endpoint = get_env("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if otlp_endpoint:
+        # Straight to the transport: exporting spans must not create spans,
+        # share Slack's rate limits or retry against a missing collector
+        try:
+            response = get_transport().request(
+                "POST", f"{otlp_endpoint.rstrip('/')}/v1/traces", json=telemetry.otlp(),
+                headers={"Content-Type": "application/json"}, timeout=OTLP_TIMEOUT
+            )
+            logger.info(f"Exported {len(telemetry.spans)} spans to {otlp_endpoint}: {response.status_code}")
+        except TransportError as err:
+            logger.warning(f"Unable to export spans to {otlp_endpoint}: {err}")
+    logger.info(f"Timings: {json.dumps(summary['phases'])}")
+    return summary
+
+
+def profiled(func):
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profile_setting = get_env("GOOD_COMMS_PROFILE")
+    profiler = cProfile.Profile()
+    tracemalloc.start()
     try:
-        with open(filename, 'rb') as file:
-            m = MultipartEncoder(fields={'file': (filename, file, 'application/octet-stream'), 'initial_comment': message, 'channels': channel, 'thread_ts': thread_ts})
-            headers = {"Content-Type": m.content_type, "Authorization": f"Bearer {get_env('SLACK_TOKEN')}"}
-            response = requests.post("https://slack.com/api/files.upload", data=m, headers=headers)
-            if response.status_code >= 299:
-                return f"Error on message: {response.status_code}"
-            logging.info(f"File upload response status code: {response.status_code}")
-    except Exception as err:
-        logging.error(f"Error in send_file: {err}")
-        return err
+        return profiler.runcall(func)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if profile_setting.lower() not in ("1", "true"):
+            profiler.dump_stats(profile_setting)
+            logger.info(f"Wrote cProfile stats to {profile_setting}")
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+        sys.stderr.write(f"tracemalloc: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+        for stat in snapshot.statistics("lineno")[:15]:
+            sys.stderr.write(f"  {stat}\n")
+
+
+class TransportError(Exception):
+    def __init__(self, message, sent=True):
+        super().__init__(message)
+        # False when the request never reached Slack, so retrying is always safe
+        self.sent = sent
+
+
+class Response:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def encode_body(kwargs, headers):
+    if kwargs.get("json") is not None:
+        headers.setdefault("Content-Type", "application/json")
+        return json.dumps(kwargs["json"], separators=(",", ":")).encode()
+    data = kwargs.get("data")
+    if isinstance(data, dict):
+        headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        return urllib.parse.urlencode(data).encode()
+    if isinstance(data, str):
+        return data.encode()
+    if hasattr(data, "fileno"):
+        headers.setdefault("Content-Length", str(os.fstat(data.fileno()).st_size - data.tell()))
+    return data
+
+
+def split_timeout(timeout):
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+class StdlibTransport:
+    # Keep-alive connections from http.client, pooled per host. Importing this
+    # costs a few milliseconds, against a few hundred for requests
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.ssl_context = None
+
+    def _connect(self, scheme, host, connect_timeout):
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, timeout=connect_timeout, context=self.ssl_context, blocksize=HTTP_BLOCKSIZE)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=connect_timeout, blocksize=HTTP_BLOCKSIZE)
+        conn._create_connection = timed_create_connection
+        try:
+            with telemetry.span("connect", host=host, tls=scheme == "https"):
+                conn.connect()
+        except OSError as err:
+            conn.close()
+            raise TransportError(f"Unable to connect to {host}: {err}", sent=False) from err
+        return conn
+
+    def _checkout(self, scheme, host, connect_timeout):
+        with self.lock:
+            idle = self.idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        return self._connect(scheme, host, connect_timeout), False
+
+    def _checkin(self, scheme, host, conn):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, host), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, params=None, headers=None, timeout=None, **kwargs):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        query = "&".join(q for q in (parts.query, urllib.parse.urlencode(params or {})) if q)
+        if query:
+            path = f"{path}?{query}"
+        headers = dict(headers or {})
+        body = encode_body(kwargs, headers)
+        start = body.tell() if hasattr(body, "tell") else None
+        connect_timeout, read_timeout = split_timeout(timeout)
+
+        conn, reused = self._checkout(parts.scheme, parts.netloc, connect_timeout)
+        while True:
+            if conn.sock is None:
+                conn, reused = self._connect(parts.scheme, parts.netloc, connect_timeout), False
+            try:
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as err:
+                conn.close()
+                if not reused:
+                    raise TransportError(f"{method} {parts.netloc} failed: {err}") from err
+                # The server dropped an idle keep-alive connection; resend on a fresh one
+                if start is not None:
+                    body.seek(start)
+                conn, reused = self._connect(parts.scheme, parts.netloc, connect_timeout), False
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                raise TransportError(f"{method} {parts.netloc} failed: {err}") from err
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(parts.scheme, parts.netloc, conn)
+        return Response(response.status, response.headers, content)
+
+
+def redact_url(err):
+    # requests quotes the request path, which for webhooks is the secret
+    return re.sub(r"url: \S+", "url: <redacted>", str(err))
+
+
+class RequestsTransport:
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        # Imported here so runs on the stdlib backend never pay for it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.requests = requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        exceptions = self.requests.exceptions
+        host = urllib.parse.urlsplit(url).netloc
+        try:
+            return self.session.request(method, url, **kwargs)
+        except exceptions.ConnectTimeout as err:
+            raise TransportError(f"{method} {host} failed: {redact_url(err)}", sent=False) from err
+        except exceptions.ConnectionError as err:
+            reason = getattr(err.args[0], "reason", None) if err.args else None
+            sent = type(reason).__name__ not in ("NewConnectionError", "NameResolutionError")
+            raise TransportError(f"{method} {host} failed: {redact_url(err)}", sent=sent) from err
+        except exceptions.RequestException as err:
+            raise TransportError(f"{method} {host} failed: {redact_url(err)}") from err
+
+
+def http_backend():
+    backend = get_env("HTTP_BACKEND", "auto").lower()
+    if backend not in HTTP_BACKENDS:
+        logger.warning(f"Unknown HTTP_BACKEND {backend}, using auto")
+        backend = "auto"
+    if backend == "auto":
+        # http.client ignores proxy settings, so proxied runners keep requests
+        proxied = any(os.getenv(name) for name in ("HTTPS_PROXY", "https_proxy", "HTTP_PROXY", "http_proxy"))
+        backend = "requests" if proxied else "stdlib"
+    return backend
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            backend = http_backend()
+            _transport = RequestsTransport() if backend == "requests" else StdlibTransport()
+            logger.info(f"Using {backend} HTTP backend")
+        return _transport
+
+
+def retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    # Full jitter keeps concurrent retries from hitting Slack in lockstep
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt))
+
+
+class TokenBucket:
+    # Reservation-based bucket: callers reserve the next free slot under the
+    # lock and sleep outside it, so waiting requests are served in FIFO order
+    def __init__(self, rate, capacity):
+        self.interval = 1.0 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.next_slot = 0.0
+
+    def reserve(self, now):
+        slot = max(self.next_slot, now)
+        wait = max(0.0, slot - self.tolerance - now)
+        self.next_slot = slot + self.interval
+        return wait
+
+    def pause_until(self, until):
+        self.next_slot = max(self.next_slot, until + self.tolerance)
+
+
+class RateLimiter:
+    def __init__(self, clock=time.monotonic, enabled=True):
+        self.clock = clock
+        self.enabled = enabled
+        self.buckets = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def keys_for(method, channel):
+        if method in ("chat.postMessage", "webhook"):
+            return [f"chat.postMessage:{channel}"]
+        if method in METHOD_TIERS:
+            return [method]
+        return []
+
+    def _bucket(self, key):
+        if key not in self.buckets:
+            if key.startswith("chat.postMessage:"):
+                self.buckets[key] = TokenBucket(CHANNEL_POSTS_PER_SECOND, CHANNEL_POST_BURST)
+            else:
+                per_minute, burst = RATE_TIERS[METHOD_TIERS[key]]
+                self.buckets[key] = TokenBucket(per_minute / 60.0, burst)
+            self.stats[key] = {"requests": 0, "waited": 0.0, "max_wait": 0.0, "throttled": 0}
+        return self.buckets[key]
+
+    def reserve(self, keys):
+        # Books a slot in every bucket and returns how long to wait for it,
+        # leaving the waiting to the caller (asyncio callers do not block)
+        if not self.enabled:
+            return 0.0
+        wait = 0.0
+        with self.lock:
+            now = self.clock()
+            for key in keys:
+                key_wait = self._bucket(key).reserve(now)
+                stats = self.stats[key]
+                stats["requests"] += 1
+                stats["waited"] += key_wait
+                stats["max_wait"] = max(stats["max_wait"], key_wait)
+                wait = max(wait, key_wait)
+        return wait
+
+    def acquire(self, keys, budget=None):
+        # With a budget, a wait that would outlast it fails instead of sleeping
+        wait = self.reserve(keys)
+        if budget is not None and wait >= budget:
+            raise TransportError(f"Deadline reached before a rate limit slot ({wait:.2f}s away)", sent=False)
+        if wait > 0:
+            logger.info(f"Rate limiter queued request for {wait:.2f}s ({', '.join(keys)})")
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, keys, retry_after):
+        with self.lock:
+            until = self.clock() + retry_after
+            for key in keys:
+                self._bucket(key).pause_until(until)
+                self.stats[key]["throttled"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(stats) for key, stats in self.stats.items()}
+
+
+rate_limiter = RateLimiter()
+
+
+class Deadline:
+    # Wall-clock budget for one run. Every HTTP call gets the smaller of its
+    # own timeouts and the time left, so the run ends close to the deadline;
+    # the watchdog is the backstop for anything that still does not
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.expires = None
+        self.fired = False
+
+    def start(self, seconds, grace=DEADLINE_GRACE):
+        if not seconds or seconds <= 0:
+            return
+        self.expires = self.clock() + seconds
+        if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGALRM, self._watchdog)
+            signal.setitimer(signal.ITIMER_REAL, seconds + grace, grace)
+
+    def _watchdog(self, signum, frame):
+        if self.fired:
+            # The clean exit is stuck too, most likely joining a worker thread
+            os._exit(DEADLINE_EXIT_CODE)
+        self.fired = True
+        logger.error("Deadline exceeded, stopping")
+        raise SystemExit(DEADLINE_EXIT_CODE)
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - self.clock())
+
+    def timeout(self, connect=HTTP_CONNECT_TIMEOUT, read=HTTP_READ_TIMEOUT):
+        remaining = self.remaining()
+        if remaining is None:
+            return connect, read
+        if remaining <= 0:
+            raise TransportError("Deadline exceeded", sent=False)
+        return min(connect, remaining), min(read, remaining)
+
+
+deadline = Deadline()
+
+
+def slack_method(url):
+    if "/api/" in url:
+        return url.rsplit("/api/", 1)[1].split("?", 1)[0].strip("/")
+    if "hooks.slack.com" in url or "/services/" in url:
+        return "webhook"
+    return ""
+
+
+def request_channel(url, kwargs):
+    for source in (kwargs.get("json"), kwargs.get("params"), kwargs.get("data")):
+        if isinstance(source, dict):
+            channel = source.get("channel") or source.get("channel_id")
+            if channel:
+                return channel
+    # Without a channel in the body the bucket is per endpoint. A webhook URL
+    # is a secret and bucket keys end up in the log, so only a hash is used
+    return f"endpoint-{hashlib.sha256(url.encode()).hexdigest()[:12]}"
+
+
+def deadline_allows(delay):
+    remaining = deadline.remaining()
+    return remaining is None or delay < remaining
+
+
+def http_request(method, url, idempotent=None, max_retries=HTTP_MAX_RETRIES, channel=None, **kwargs):
+    # POSTs such as chat.postMessage are only retried when Slack cannot have
+    # processed them (429 or no connection), so a retry never double-posts
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD")
+    body = kwargs.get("data")
+    rate_keys = RateLimiter.keys_for(slack_method(url), channel or request_channel(url, kwargs))
+    timeouts = split_timeout(kwargs.pop("timeout", None) or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+    api_method = slack_method(url) or urllib.parse.urlsplit(url).netloc
+    for attempt in range(max_retries + 1):
+        if attempt and hasattr(body, "seek"):
+            body.seek(0)
+        # The URL itself is never recorded: webhook URLs are secrets
+        response = None
+        with telemetry.span("http", method=method, api=api_method, attempt=attempt + 1) as span:
+            span["attributes"]["rate_limit_wait_ms"] = round(rate_limiter.acquire(rate_keys, deadline.remaining()) * 1000, 3)
+            try:
+                response = get_transport().request(method, url, timeout=deadline.timeout(*timeouts), **kwargs)
+                span["attributes"]["status"] = response.status_code
+            except TransportError as err:
+                if (err.sent and not idempotent) or attempt == max_retries:
+                    raise
+                span["error"] = str(err)
+                delay = retry_delay(None, attempt)
+                if not deadline_allows(delay):
+                    raise
+                logger.warning(f"{method} {api_method} failed ({err}), retrying in {delay:.2f}s")
+        if response is None:
+            time.sleep(delay)
+            continue
+
+        retryable = response.status_code == 429 or (idempotent and response.status_code in HTTP_RETRY_STATUSES)
+        if not retryable or attempt == max_retries:
+            return response
+        delay = retry_delay(response, attempt)
+        if not deadline_allows(delay):
+            logger.warning(f"{method} {api_method} returned {response.status_code}, no time left to retry")
+            return response
+        logger.warning(f"{method} {api_method} returned {response.status_code}, retrying in {delay:.2f}s")
+        if response.status_code == 429 and rate_keys:
+            # Park the whole bucket so concurrent requests queue behind the retry
+            # instead of earning their own 429s; acquire() does the waiting
+            rate_limiter.penalize(rate_keys, delay)
+        else:
+            time.sleep(delay)
+
+
+def state_dir():
+    configured = get_env("GOOD_COMMS_STATE_DIR")
+    if configured:
+        os.makedirs(configured, exist_ok=True)
+        return configured
+    runner_temp = get_env("RUNNER_TEMP")
+    if runner_temp and os.path.isdir(runner_temp):
+        return runner_temp
+    # Docker actions get a HOME that is shared by every step of the job
+    if get_env("GITHUB_ACTIONS") == "true" and os.path.isdir(get_env("HOME")):
+        return get_env("HOME")
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    # Yields False instead of waiting when `blocking` is off and the lock is held
+    with open(f"{path}.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data):
+    atomic_write_text(path, json.dumps(data, separators=(",", ":")))
+
+
+def atomic_write_text(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".good-comms-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(text)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class JsonStore:
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _locked(self):
+        return file_lock(self.path)
+
+    def _read(self):
+        try:
+            with open(self.path) as store_file:
+                entries = json.load(store_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        if self.ttl:
+            cutoff = time.time() - self.ttl
+            entries = {key: entry for key, entry in entries.items() if entry.get("at", 0) >= cutoff}
+        return entries
+
+    def _write(self, entries):
+        atomic_write_json(self.path, entries)
+
+    def get(self, key):
+        with self._locked():
+            return self._read().get(key)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        # Many entries in one locked read-modify-write
+        now = time.time()
+        with self._locked():
+            entries = self._read()
+            entries.update((key, dict(value, at=now)) for key, value in values.items())
+            if self.max_entries and len(entries) > self.max_entries:
+                # Every write refreshes "at", so this drops the least recently used
+                newest = sorted(entries.items(), key=lambda item: item[1].get("at", 0), reverse=True)
+                entries = dict(newest[:self.max_entries])
+            self._write(entries)
+
+
+def thread_key(channel_id, author_name, scope="run"):
+    if scope == "sha":
+        scope_id = get_env("GITHUB_SHA")
+    else:
+        scope_id = f"{get_env('GITHUB_RUN_ID')}.{get_env('GITHUB_RUN_ATTEMPT', '1')}"
+    return "|".join([channel_id, get_env("GITHUB_REPOSITORY"), scope_id, normalize_text(author_name)])
+
+
+class MemoryStore:
+    # Keeps entries in memory for a long-lived process and writes them
+    # through to `backing`, so one-shot steps still see them
+    def __init__(self, backing=None, ttl=None):
+        self.backing = backing
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and self.ttl and entry.get("at", 0) < time.time() - self.ttl:
+            entry = None
+        if entry is None and self.backing:
+            entry = self.backing.get(key)
+            if entry:
+                with self.lock:
+                    self.entries[key] = entry
+        return entry
+
+    def set(self, key, value):
+        entry = dict(value, at=time.time())
+        with self.lock:
+            self.entries[key] = entry
+        if self.backing:
+            self.backing.set(key, value)
+
+
+class ThreadRegistry:
+    def __init__(self, path, ttl=THREAD_REGISTRY_TTL, scope="run", store=None):
+        self.store = store or JsonStore(path, ttl)
+        self.scope = scope
+
+    @classmethod
+    def from_env(cls):
+        path = get_env("THREAD_REGISTRY_PATH") or os.path.join(state_dir(), THREAD_REGISTRY_FILE)
+        ttl = int(get_env("THREAD_REGISTRY_TTL", str(THREAD_REGISTRY_TTL)))
+        return cls(path, ttl, get_env("THREAD_REGISTRY_SCOPE", "run").lower())
+
+    def key(self, channel_id, author_name):
+        return thread_key(channel_id, author_name, self.scope)
+
+    def lookup(self, channel_id, author_name):
+        try:
+            entry = self.store.get(self.key(channel_id, author_name))
+        except OSError as err:
+            logger.warning(f"Thread registry unavailable: {err}")
+            return None
+        return entry.get("ts") if entry else None
+
+    def record(self, channel_id, author_name, thread_ts, channel):
+        try:
+            self.store.set(self.key(channel_id, author_name), {"ts": thread_ts, "channel": channel})
+        except OSError as err:
+            logger.warning(f"Unable to update thread registry: {err}")
+
+
+class RetrySpool:
+    # Append-only log of notifications Slack did not accept. Every line is one
+    # event for an idempotency key (add, attempt, done, drop); compaction
+    # rewrites the log as a checkpoint of the live entries and recent
+    # tombstones, which is what keeps replayed duplicates out
+    def __init__(self, path, max_attempts=SPOOL_MAX_ATTEMPTS, backoff=SPOOL_BACKOFF, backoff_max=SPOOL_BACKOFF_MAX, ttl=SPOOL_TTL, compact_bytes=SPOOL_COMPACT_BYTES):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.ttl = ttl
+        self.compact_bytes = compact_bytes
+
+    @classmethod
+    def from_env(cls):
+        path = get_env("RETRY_SPOOL_PATH") or os.path.join(state_dir(), SPOOL_FILE)
+        return cls(path, int(get_env("RETRY_SPOOL_MAX_ATTEMPTS", str(SPOOL_MAX_ATTEMPTS))))
+
+    def delay(self, attempts):
+        return random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff * 2 ** (attempts - 1))
+
+    def _append(self, *records):
+        with open(self.path, "a") as spool_file:
+            spool_file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+
+    def _load(self):
+        entries, done = {}, {}
+        try:
+            with open(self.path) as spool_file:
+                lines = spool_file.readlines()
+        except FileNotFoundError:
+            return entries, done
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn tail of a write interrupted by a crash
+                continue
+            key, op = record.get("key"), record.get("op")
+            if op == "add" and key not in entries and key not in done:
+                entries[key] = record
+            elif op == "attempt" and key in entries:
+                entries[key].update((field, record[field]) for field in ("attempts", "next_at", "error", "ambiguous") if field in record)
+            elif op in ("done", "drop"):
+                entries.pop(key, None)
+                done[key] = record.get("at", 0)
+        cutoff = time.time() - self.ttl
+        for key in [key for key, entry in entries.items() if entry.get("at", 0) < cutoff]:
+            logger.warning(f"Dropping spooled notification {key}: older than {self.ttl}s")
+            done[key] = entries.pop(key)["at"]
+        return entries, {key: at for key, at in done.items() if at >= cutoff}
+
+    def add(self, key, target, channel, payload, error, ambiguous=False, destination=None):
+        with file_lock(self.path):
+            entries, done = self._load()
+            if key in entries or key in done:
+                logger.info(f"Notification {key} is already spooled")
+                return False
+            now = time.time()
+            self._append({
+                "op": "add", "key": key, "at": now, "target": target, "channel": channel, "payload": payload,
+                "attempts": 1, "next_at": now + self.delay(1), "error": error, "ambiguous": ambiguous,
+                "destination": destination
+            })
+        return True
+
+    def pending(self):
+        with file_lock(self.path):
+            return list(self._load()[0].values())
+
+    def replay(self, send, force=False):
+        counts = {"sent": 0, "deduped": 0, "failed": 0, "dropped": 0, "waiting": 0}
+        with file_lock(f"{self.path}.replay", blocking=False) as acquired:
+            if not acquired:
+                logger.info("Another process is replaying the retry spool")
+                return counts
+            now = time.time()
+            for entry in sorted(self.pending(), key=lambda entry: entry["at"]):
+                if not force and entry["next_at"] > now:
+                    counts["waiting"] += 1
+                    continue
+                outcome, detail, ambiguous = send(entry)
+                if outcome in ("sent", "deduped"):
+                    record = {"op": "done", "key": entry["key"], "at": time.time(), "outcome": outcome}
+                elif outcome == "rejected" or entry["attempts"] >= self.max_attempts:
+                    logger.error(f"Dropping spooled notification {entry['key']} after {entry['attempts']} attempts: {detail}")
+                    record = {"op": "drop", "key": entry["key"], "at": time.time(), "error": detail}
+                    outcome = "dropped"
+                else:
+                    attempts = entry["attempts"] + 1
+                    record = {
+                        "op": "attempt", "key": entry["key"], "attempts": attempts, "next_at": time.time() + self.delay(attempts),
+                        "error": detail, "ambiguous": entry.get("ambiguous") or ambiguous
+                    }
+                counts[outcome] += 1
+                with file_lock(self.path):
+                    self._append(record)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.compact_bytes:
+                self.compact()
+        if any(counts[name] for name in ("sent", "deduped", "failed", "dropped")):
+            logger.info(f"Retry spool replay: {json.dumps(counts)}")
+        return counts
+
+    def compact(self):
+        with file_lock(self.path):
+            entries, done = self._load()
+            records = list(entries.values()) + [{"op": "done", "key": key, "at": at} for key, at in done.items()]
+            atomic_write_text(self.path, "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        return len(entries)
+
+
+def spool_from_env():
+    return RetrySpool.from_env() if get_env("RETRY_SPOOL").lower() == "true" else None
+
+
+def idempotency_key(*parts):
+    # Stable for one step of one run attempt, so a retried step finds the
+    # notification it spooled before. Outside Actions every send is unique
+    if not get_env("GITHUB_RUN_ID"):
+        return None
+    values = [get_env(name) for name in IDEMPOTENCY_CONTEXT_VARS] + [str(part) for part in parts]
+    return hashlib.sha256("\x1f".join(values).encode()).hexdigest()[:32]
+
+
+def slack_api_error(response, method):
+    if response.status_code != 200:
+        return f"{method} returned {response.status_code}: {response.text}"
+    response_data = response.json()
+    if not response_data.get("ok"):
+        return f"{method} failed: {response_data.get('error')}"
+    return None
+
+
+def upload_file(slack_token, path):
+    headers = {"Authorization": f"Bearer {slack_token}"}
+    response = http_request(
+        "POST", slack_api("files.getUploadURLExternal"),
+        data={"filename": os.path.basename(path), "length": os.path.getsize(path)},
+        headers=headers
+    )
+    error = slack_api_error(response, "files.getUploadURLExternal")
+    if error:
+        raise ValueError(error)
+    upload = response.json()
+
+    # Passing the open file lets the transport stream it in small blocks with
+    # a Content-Length from fstat, so memory stays flat for any file size
+    with open(path, "rb") as file:
+        response = http_request(
+            "POST", upload["upload_url"], data=file,
+            headers={"Content-Type": "application/octet-stream"}, idempotent=True
+        )
+    if response.status_code != 200:
+        raise ValueError(f"Upload of {path} returned {response.status_code}: {response.text}")
+    logger.info(f"Uploaded {path} as {upload['file_id']}")
+    return {"id": upload["file_id"], "title": os.path.basename(path)}
+
+
+def send_files(paths, slack_token, channel_id, thread_ts=None, initial_comment=None, concurrency=UPLOAD_CONCURRENCY):
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(paths)))) as executor:
+        files = list(executor.map(lambda path: upload_file(slack_token, path), paths))
+
+    data = {"files": json.dumps(files), "channel_id": channel_id}
+    if thread_ts:
+        data["thread_ts"] = thread_ts
+    if initial_comment:
+        data["initial_comment"] = initial_comment
+    response = http_request(
+        "POST", slack_api("files.completeUploadExternal"),
+        data=data, headers={"Authorization": f"Bearer {slack_token}"}
+    )
+    error = slack_api_error(response, "files.completeUploadExternal")
+    if error:
+        raise ValueError(error)
+    logger.info(f"Shared {len(files)} file(s) in {channel_id}")
+    return [file["id"] for file in files]
+
+
+class SlackDirectory:
+    # Channel name and user lookups for one workspace, served from a
+    # JsonStore that is filled in bulk from conversations.list and
+    # users.list. Misses are cached for a shorter time, so an unknown name
+    # costs at most one warm-up per DIRECTORY_NEGATIVE_TTL
+    def __init__(self, slack_token, store, negative_ttl=DIRECTORY_NEGATIVE_TTL, max_pages=DIRECTORY_MAX_PAGES):
+        self.slack_token = slack_token
+        self.store = store
+        self.negative_ttl = negative_ttl
+        self.max_pages = max_pages
+
+    @classmethod
+    def from_env(cls, slack_token):
+        # One file per workspace, keyed by a hash so the token is never stored
+        workspace = hashlib.sha256(slack_token.encode()).hexdigest()[:16]
+        directory = get_env("DIRECTORY_CACHE_DIR") or state_dir()
+        os.makedirs(directory, exist_ok=True)
+        ttl = int(get_env("DIRECTORY_CACHE_TTL", str(DIRECTORY_CACHE_TTL)))
+        return cls(slack_token, JsonStore(os.path.join(directory, f".good-comms-directory-{workspace}.json"), ttl))
+
+    def _cached(self, key):
+        # Returns (hit, id); a hit with no id is a remembered miss
+        entry = self.store.get(key)
+        if entry is None or (entry.get("id") is None and entry.get("at", 0) < time.time() - self.negative_ttl):
+            return False, None
+        return True, entry.get("id")
+
+    def _pages(self, method, field, params):
+        url = slack_api(method)
+        headers = {"Authorization": f"Bearer {self.slack_token}"}
+        params = dict(params, limit=DIRECTORY_PAGE_LIMIT)
+        for _ in range(self.max_pages):
+            response = http_request("GET", url, headers=headers, params=params)
+            error = slack_api_error(response, method)
+            if error:
+                raise ValueError(error)
+            response_data = response.json()
+            yield response_data.get(field, [])
+            cursor = (response_data.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return
+            params["cursor"] = cursor
+        logger.warning(f"Stopped paging {method} after {self.max_pages} pages")
+
+    def warm_channels(self):
+        entries = {}
+        for channels in self._pages("conversations.list", "channels", {"types": "public_channel,private_channel", "exclude_archived": "true"}):
+            entries.update((f"channel|{channel['name']}", {"id": channel["id"]}) for channel in channels if channel.get("name"))
+        self.store.update(dict(entries, **{"warm|channel": {"count": len(entries)}}))
+        logger.info(f"Cached {len(entries)} channel names")
+        return len(entries)
+
+    def warm_users(self):
+        entries, ambiguous = {}, set()
+        for members in self._pages("users.list", "members", {}):
+            for member in members:
+                if member.get("deleted") or member.get("is_bot"):
+                    continue
+                profile = member.get("profile") or {}
+                for name in {normalize_text(value) for value in (member.get("name"), profile.get("display_name"), profile.get("real_name"), profile.get("email"))}:
+                    key = f"user|{name}"
+                    if not name or key in ambiguous:
+                        continue
+                    if key in entries and entries[key]["id"] != member["id"]:
+                        # Two people share this name; neither gets it
+                        ambiguous.add(key)
+                        del entries[key]
+                        continue
+                    entries[key] = {"id": member["id"]}
+        self.store.update(dict(entries, **{"warm|user": {"count": len(entries)}}))
+        logger.info(f"Cached {len(entries)} user names")
+        return len(entries)
+
+    def _resolve(self, kind, name, warm):
+        key = f"{kind}|{name}"
+        hit, value = self._cached(key)
+        if hit:
+            return value
+        marker = self.store.get(f"warm|{kind}")
+        if not marker or marker.get("at", 0) < time.time() - self.negative_ttl:
+            try:
+                warm()
+            except (ValueError, TransportError) as err:
+                # Not cached: the name may well exist
+                logger.warning(f"Unable to list Slack {kind}s: {err}")
+                return None
+            hit, value = self._cached(key)
+            if hit:
+                return value
+        self.store.set(key, {"id": None})
+        return None
+
+    def channel_id(self, name):
+        return self._resolve("channel", name.lstrip("#").lower(), self.warm_channels)
+
+    def user_by_email(self, email):
+        key = f"user|{normalize_text(email)}"
+        hit, value = self._cached(key)
+        if hit:
+            return value
+        response = http_request("GET", slack_api("users.lookupByEmail"), headers={"Authorization": f"Bearer {self.slack_token}"}, params={"email": email})
+        error = slack_api_error(response, "users.lookupByEmail")
+        if error and "users_not_found" not in error:
+            logger.warning(f"Unable to look up a Slack user by email: {error}")
+            return None
+        value = None if error else response.json()["user"]["id"]
+        self.store.set(key, {"id": value})
+        return value
+
+    def user_id(self, name, email=None):
+        if email:
+            try:
+                value = self.user_by_email(email)
+            except (TransportError, ValueError) as err:
+                logger.warning(f"Unable to look up a Slack user by email: {err}")
+                value = None
+            if value:
+                return value
+        return self._resolve("user", normalize_text(name), self.warm_users)
+
+
+def resolve_channel(channel, slack_token):
+    # Names such as #deploys are looked up; IDs pass through untouched
+    if not channel or not slack_token or SLACK_ID.match(channel):
+        return channel
+    channel_id = SlackDirectory.from_env(slack_token).channel_id(channel)
+    if not channel_id:
+        raise ValueError(f"Unknown Slack channel {channel}")
+    return channel_id
+
+
+def user_map():
+    # SLACK_USER_MAP: login=U0123ABCD or login=someone@example.com, one per entry
+    mapping = {}
+    for entry in split_list(get_env("SLACK_USER_MAP")):
+        login, sep, value = entry.partition("=")
+        if sep:
+            mapping[normalize_text(login)] = value.strip()
+    return mapping
+
+
+def actor_email(actor):
+    # Push events name the pusher and the head commit author; other events
+    # carry no email for the actor
+    try:
+        with open(get_env("GITHUB_EVENT_PATH")) as event_file:
+            event = json.load(event_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(event, dict):
+        return None
+    for person in (event.get("pusher"), (event.get("head_commit") or {}).get("author")):
+        if not isinstance(person, dict):
+            continue
+        email = person.get("email") or ""
+        if normalize_text(person.get("username") or person.get("name")) == normalize_text(actor) and email and not email.endswith(GITHUB_NOREPLY_DOMAIN):
+            return email
+    return None
+
+
+def resolve_actor(slack_token, actor):
+    # SLACK_USER_MAP wins, then the actor's email, then a users.list name match
+    mapped = user_map().get(normalize_text(actor), "")
+    if SLACK_ID.match(mapped):
+        return mapped
+    if "@" in mapped:
+        name, email = actor, mapped
+    else:
+        name, email = mapped or actor, actor_email(actor)
+    return SlackDirectory.from_env(slack_token).user_id(name, email)
+
+
+def actor_mention(destinations):
+    actor = get_env("GITHUB_ACTOR")
+    tokens = {destination.slack_token for destination in destinations if destination.slack_token}
+    if not actor or len(tokens) != 1:
+        logger.warning("MENTION_ACTOR needs GITHUB_ACTOR and a single SLACK_TOKEN")
+        return ""
+    user = resolve_actor(tokens.pop(), actor)
+    if not user:
+        logger.warning(f"No Slack user found for {actor}")
+        return ""
+    return f"<@{user}>"
 
 
 def sanitize_value(value):
     return value.replace('\n', '').replace('\r', '').replace('=', '')
 
 
-def get_message_ts(slack_token, channel_id, message, author_name):
-    url = "https://slack.com/api/conversations.history"
+def normalize_text(text):
+    if not text:
+        return ""
+    return ''.join(c.lower() for c in text if not c.isspace())
+
+
+def hedged_request(method, url, hedge_after, **kwargs):
+    # Only for idempotent requests: when the first copy has not answered
+    # within `hedge_after` seconds a second one is sent, and the first
+    # answer wins. The slower copy finishes on its own daemon thread
+    results = queue.Queue()
+
+    def attempt():
+        try:
+            results.put((http_request(method, url, **kwargs), None))
+        except Exception as err:
+            results.put((None, err))
+
+    threading.Thread(target=attempt, daemon=True).start()
+    try:
+        response, error = results.get(timeout=hedge_after)
+    except queue.Empty:
+        logger.info(f"{slack_method(url)} has not answered in {hedge_after:.2f}s, sending a hedged request")
+        threading.Thread(target=attempt, daemon=True).start()
+        response, error = results.get()
+        if error:
+            response, error = results.get()
+    if error:
+        raise error
+    return response
+
+
+def iter_history_pages(slack_token, channel_id, oldest=None, latest=None, max_pages=HISTORY_MAX_PAGES, include_metadata=False):
+    url = slack_api("conversations.history")
     headers = {
         "Authorization": f"Bearer {slack_token}",
         "Content-Type": "application/json"
     }
-    params = {"channel": channel_id, "limit": 10}
+    params = {"channel": channel_id, "limit": HISTORY_PAGE_LIMIT}
+    if oldest:
+        params["oldest"] = oldest
+        params["inclusive"] = "true"
+    if latest:
+        params["latest"] = latest
+    if include_metadata:
+        params["include_all_metadata"] = "true"
 
-    response = requests.get(url, headers=headers, params=params)
-    logging.info(f"GET MSG TS Response status code: {response.status_code}")
-    if response.status_code != 200:
-        logging.error(f"Failed to retrieve messages: {response.status_code}")
-        logging.error(f"Response body: {response.text}")
-        raise ValueError(f"Failed to retrieve messages: {response.status_code}, {response.text}")
+    hedge_after = float(get_env("HISTORY_HEDGE_DELAY") or 0)
+    for page in range(max_pages):
+        if hedge_after > 0:
+            response = hedged_request("GET", url, hedge_after, headers=headers, params=dict(params))
+        else:
+            response = http_request("GET", url, headers=headers, params=params)
+        logger.info(f"GET MSG TS Response status code: {response.status_code} (page {page + 1})")
+        if response.status_code != 200:
+            logger.error(f"Failed to retrieve messages: {response.status_code}")
+            logger.error(f"Response body: {response.text}")
+            raise ValueError(f"Failed to retrieve messages: {response.status_code}, {response.text}")
 
-    response_data = response.json()
-    if not response_data.get("ok"):
-        raise ValueError(f"Error from Slack API: {response_data.get('error')}")
+        response_data = response.json()
+        if not response_data.get("ok"):
+            raise ValueError(f"Error from Slack API: {response_data.get('error')}")
 
-    messages = response_data.get("messages", [])
-    if not messages:
-        raise ValueError("No messages found in the channel.")
+        yield response_data.get("messages", [])
 
-    def normalize_text(text):
-        # return text.replace('\n', '').replace(' ', '').lower()
-        if not text:
-            return ""
-        return ''.join(c.lower() for c in text if not c.isspace())
+        cursor = (response_data.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            return
+        params["cursor"] = cursor
+
+    logger.warning(f"Stopped paging conversations.history after {max_pages} pages")
 
-    normalized_author = normalize_text(author_name)
-    logging.info(f"Looking for author: {author_name}")
-    logging.info(f"Normalized author: {normalized_author}")
 
+def metadata_nonce(msg):
+    metadata = msg.get("metadata") or {}
+    if metadata.get("event_type") != METADATA_EVENT_TYPE:
+        return None
+    return (metadata.get("event_payload") or {}).get("nonce")
+
+
+def match_history_page(messages, normalized_author, nonce=None, candidate=None):
+    # Returns (ts, candidate). A nonce match is final, and so is an author
+    # match when there is no nonce; with one, the newest untagged author
+    # match is only kept as a candidate
     for msg in messages:
+        if nonce:
+            tagged = metadata_nonce(msg)
+            if tagged == nonce:
+                logger.info(f"Found message by metadata! Thread TS: {msg.get('ts')}")
+                return msg.get('ts'), candidate
+            if tagged or candidate:
+                # Tagged by another notification, never ours
+                continue
+
         msg_username = normalize_text(msg.get('username', ''))
-        logging.info(f"Checking message with username: {msg.get('username', '')}")
+        logger.info(f"Checking message with username: {msg.get('username', '')}")
 
         if msg_username == normalized_author:
-            logging.info(f"Found matching author! Thread TS: {msg.get('ts')}")
-            return msg.get('ts')
+            if not nonce:
+                logger.info(f"Found matching author! Thread TS: {msg.get('ts')}")
+                return msg.get('ts'), candidate
+            candidate = msg.get('ts')
+    return None, candidate
+
+
+def get_message_ts(slack_token, channel_id, message, author_name, oldest=None, latest=None, max_pages=HISTORY_MAX_PAGES, max_polls=0, nonce=None):
+    normalized_author = normalize_text(author_name)
+    logger.info(f"Looking for author: {author_name}")
+    logger.info(f"Normalized author: {normalized_author}")
+
+    seen_messages = False
+    candidate = None
+    delay = HISTORY_POLL_BACKOFF
+    # `max_pages` bounds the conversations.history calls of the whole lookup,
+    # so every poll spends from the same budget
+    pages_left = max_pages
+    for poll in range(max_polls + 1):
+        for messages in iter_history_pages(slack_token, channel_id, oldest, latest, pages_left, include_metadata=bool(nonce)):
+            pages_left -= 1
+            seen_messages = seen_messages or bool(messages)
+            found, candidate = match_history_page(messages, normalized_author, nonce, candidate)
+            if found:
+                return found
 
+        if candidate:
+            # The message is visible but carries no metadata, so the author
+            # match is the best there is
+            logger.warning(f"Message metadata not found, matched by author instead. Thread TS: {candidate}")
+            return candidate
+
+        if pages_left <= 0:
+            logger.warning(f"Giving up on the message lookup after {max_pages} conversations.history calls")
+            break
+        if poll < max_polls:
+            if not deadline_allows(delay + DEADLINE_RESERVE):
+                logger.warning("Deadline is close, giving up on the message lookup")
+                break
+            logger.info(f"Message not visible yet, polling again in {delay:.2f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, HISTORY_POLL_BACKOFF_MAX)
+
+    if not seen_messages:
+        raise ValueError("No messages found in the channel.")
     raise ValueError(f"No message found with author: {author_name}")
 
 
-def send_slack_message(webhook_url, status, author_name, author_link, author_icon, title, title_link, message, color, slack_token, channel_id, thread_ts=None):
-    is_webhook = not webhook_url.startswith('https://slack.com/api/')
+def split_message(text, limit=MESSAGE_CHUNK_CHARS, first_limit=MESSAGE_FIRST_CHUNK_CHARS):
+    # Splits on line boundaries; a code block cut in two is closed at the end
+    # of one part and reopened at the start of the next
+    if len(text) <= first_limit:
+        return [text]
+    width = min(limit, first_limit) - 8
+    chunks, current, size, budget, fence = [], [], 0, first_limit, False
+    for line in text.split("\n"):
+        for piece in [line[i:i + width] for i in range(0, len(line), width)] or [""]:
+            if current and size + len(piece) + (4 if fence else 0) > budget:
+                chunks.append("\n".join(current + (["```"] if fence else [])))
+                current, size, budget = (["```"], 4, limit) if fence else ([], 0, limit)
+            current.append(piece)
+            size += len(piece) + 1
+            if piece.count("```") % 2:
+                fence = not fence
+    chunks.append("\n".join(current))
+    if len(chunks) > MESSAGE_MAX_CHUNKS:
+        skipped = len(chunks) - MESSAGE_MAX_CHUNKS
+        chunks = chunks[:MESSAGE_MAX_CHUNKS]
+        chunks[-1] += f"\n_({skipped} more parts not sent)_"
+    return chunks
+
+
+def read_log_tail(path, lines=LOG_TAIL_LINES, max_bytes=LOG_TAIL_KB * 1024):
+    # Reads backwards from the end in blocks, so the cost depends on the size
+    # of the tail and not on the size of the log
+    with open(path, "rb") as log_file:
+        end = position = log_file.seek(0, os.SEEK_END)
+        blocks, newlines = [], 0
+        while position > 0 and newlines <= lines and end - position < max_bytes:
+            size = min(LOG_TAIL_BLOCKSIZE, position, max_bytes - (end - position))
+            position -= size
+            log_file.seek(position)
+            block = log_file.read(size)
+            blocks.append(block)
+            newlines += block.count(b"\n")
+    tail = b"".join(reversed(blocks)).rstrip(b"\n").split(b"\n")
+    if position > 0 and len(tail) > 1:
+        # The read started inside the file, so the first line may be partial
+        tail = tail[1:]
+    tail = tail[-lines:]
+    return ANSI_ESCAPE.sub("", b"\n".join(tail).decode("utf-8", errors="replace"))
+
+
+def format_code_block(text):
+    text = text.replace("```", "`\u200b``")
+    return f"```\n{text}\n```"
+
+
+def log_tail_from_env():
+    path = get_env("LOG_TAIL_FILE")
+    if not path:
+        return ""
+    try:
+        tail = read_log_tail(path, int(get_env("LOG_TAIL_LINES", str(LOG_TAIL_LINES))), int(get_env("LOG_TAIL_KB", str(LOG_TAIL_KB))) * 1024)
+    except OSError as err:
+        logger.warning(f"Unable to read log tail from {path}: {err}")
+        return ""
+    return format_code_block(tail) if tail else ""
+
+
+def find_by_nonce(slack_token, channel_id, nonce, oldest=None, thread_ts=None):
+    if thread_ts:
+        # Replies only show up in conversations.replies
+        return posted_reply_nonces(slack_token, channel_id, thread_ts, oldest).get(nonce)
+    for messages in iter_history_pages(slack_token, channel_id, oldest, include_metadata=True):
+        for msg in messages:
+            if metadata_nonce(msg) == nonce:
+                return msg.get("ts")
+    return None
+
+
+class GitHubContext(namedtuple("GitHubContext", "server_url repository sha workflow ref event_name actor run_id run_attempt")):
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls):
+        return cls(*(get_env(name) for name in GITHUB_CONTEXT_VARS))
+
+    @property
+    def commit_url(self):
+        return f"{self.server_url}/{self.repository}/commit/{self.sha}"
+
+
+def block_field(field):
+    return {"type": "mrkdwn", "text": f"*{field['title']}*\n{field['value']}"}
+
+
+class PayloadTemplate:
+    # Everything that only depends on the GitHub context is built once here,
+    # so rendering a message only fills in the per-message values
+    __slots__ = ("style", "actor", "lead_fields", "trail_fields", "show_status", "footer", "context_block", "event_payload", "mention")
+
+    def __init__(self, context, style="attachment", minimal="", footer="", extra_fields=(), mention=""):
+        if style not in MSG_STYLES:
+            logger.warning(f"Unknown MSG_STYLE {style}, using attachment")
+            style = "attachment"
+        self.style = style
+        self.actor = (context.actor, f"{context.server_url}/{context.actor}", f"{context.server_url}/{context.actor}.png?size=32")
+
+        static_fields = {
+            "ref": Field("Ref", context.ref, True),
+            "event": Field("Event", context.event_name, True),
+            "actions url": Field("Actions URL", f"<{context.commit_url}/checks|{context.workflow}>", True),
+            "commit": Field("Commit", f"<{context.commit_url}|{context.sha[:6]}>", True)
+        }
+        minimal = minimal.lower()
+        if minimal == "true":
+            selected = []
+        elif minimal:
+            selected = [static_fields[name.strip()] for name in minimal.split(",") if name.strip() in static_fields]
+        else:
+            selected = list(static_fields.values())
+        self.lead_fields = tuple(field.to_dict() for field in selected)
+        self.trail_fields = tuple(Field(title, value, True).to_dict() for title, value in extra_fields)
+        self.show_status = not minimal
+        self.footer = footer
+        self.context_block = {"type": "context", "elements": [{"type": "mrkdwn", "text": f"<{self.actor[1]}|{self.actor[0]}>"}]}
+        self.event_payload = {"repository": context.repository, "run_id": context.run_id, "run_attempt": context.run_attempt, "sha": context.sha}
+        # Sent as top-level text, where Slack notifies the mentioned user
+        self.mention = mention
+
+    @classmethod
+    def from_env(cls, context=None):
+        extra_fields = ()
+        if get_env("HOST_NAME"):
+            extra_fields = ((get_env("SITE_TITLE"), get_env("SITE_NAME")), (get_env("HOST_TITLE"), get_env("HOST_NAME")))
+        return cls(
+            context or GitHubContext.from_env(),
+            style=get_env("MSG_STYLE", "attachment").lower(),
+            minimal=get_env("MSG_MINIMAL"),
+            footer=get_env("SLACK_FOOTER"),
+            extra_fields=extra_fields
+        )
+
+    def fields(self, status, title_link, message, extra_fields=()):
+        fields = list(self.lead_fields)
+        fields.append({"title": "Message", "value": message, "short": False})
+        if self.show_status:
+            fields.append({"title": "Status", "value": status, "short": True})
+            fields.append({"title": "Commit URL", "value": title_link, "short": True})
+        fields.extend(self.trail_fields)
+        fields.extend(extra_fields)
+        return fields
+
+    def attachment(self, status, title, title_link, message, color, extra_fields=()):
+        if self.style == "blocks":
+            heading = f"*<{title_link}|{title}>*" if title_link else f"*{title}*"
+            blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f"{heading}\n{message}"}}]
+            summary = [field for field in self.fields(status, title_link, message, extra_fields) if field["title"] != "Message"]
+            shown = summary[:BLOCK_SECTION_FIELDS * BLOCK_MAX_FIELD_SECTIONS]
+            for start in range(0, len(shown), BLOCK_SECTION_FIELDS):
+                blocks.append({"type": "section", "fields": [block_field(field) for field in shown[start:start + BLOCK_SECTION_FIELDS]]})
+            if len(summary) > len(shown):
+                blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"+{len(summary) - len(shown)} more"}]})
+            blocks.append(self.context_block)
+            return Attachment(fallback=message, color=color, footer=self.footer, blocks=blocks)
+        return Attachment(
+            fallback=message,
+            color=color,
+            author_name=self.actor[0],
+            author_link=self.actor[1],
+            author_icon=self.actor[2],
+            title=title,
+            title_link=title_link,
+            footer=self.footer,
+            fields=self.fields(status, title_link, message, extra_fields)
+        )
+
+    def metadata(self, nonce):
+        return {"event_type": METADATA_EVENT_TYPE, "event_payload": dict(self.event_payload, nonce=nonce)}
+
+    def render(self, status, author_name, author_icon, title, title_link, message, color, channel_id, thread_ts=None, extra_fields=(), nonce=None):
+        return Webhook(
+            text=self.mention,
+            username=author_name,
+            icon_url=author_icon,
+            icon_emoji=author_icon,
+            channel=channel_id,
+            attachments=[self.attachment(status, title, title_link, message, color, extra_fields)],
+            thread_ts=thread_ts,
+            metadata=self.metadata(nonce) if nonce else None
+        ).to_dict()
+
+    def render_bytes(self, *args, **kwargs):
+        return encode_payload(self.render(*args, **kwargs))
+
+
+def encode_payload(payload):
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def resolve_endpoint(webhook_url, slack_token, channel_id, mode="AUTO"):
+    # Returns the URL to post to and the webhook to fall back on
+    mode = (mode or "AUTO").upper()
+    if mode not in MSG_MODES:
+        logger.warning(f"Unknown MSG_MODE {mode}, using AUTO")
+        mode = "AUTO"
+    if mode == "TOKEN" or (mode == "AUTO" and slack_token and channel_id):
+        fallback_url = webhook_url if webhook_url and not webhook_url.startswith(slack_api('')) else None
+        return slack_api("chat.postMessage"), fallback_url if mode == "AUTO" else None
+    return webhook_url, None
+
+
+def post_message(url, body, headers, channel_id, slack_token, nonce, oldest, thread_ts=None, max_retries=HTTP_POST_MAX_RETRIES):
+    # http_request does not retry a POST that got a 5xx or lost its
+    # connection after sending, since Slack may have posted it anyway. With a
+    # token the metadata nonce tells: the post is only repeated when the
+    # message is not in the channel
+    for attempt in range(max_retries + 1):
+        error = None
+        try:
+            response = http_request("POST", url, data=body, headers=headers, channel=channel_id)
+            if response.status_code not in HTTP_RETRY_STATUSES:
+                return response
+            failure = f"returned {response.status_code}"
+        except TransportError as err:
+            if not err.sent:
+                raise
+            response, error, failure = None, err, f"failed ({err})"
+        if attempt == max_retries or not (slack_token and channel_id):
+            break
+        delay = max(retry_delay(response, attempt), POST_RECOVERY_DELAY)
+        if not deadline_allows(delay + DEADLINE_RESERVE):
+            break
+        # Give a post that did go through time to show up in the history
+        time.sleep(delay)
+        try:
+            posted_ts = find_by_nonce(slack_token, channel_id, nonce, oldest, thread_ts)
+        except (TransportError, ValueError) as err:
+            logger.warning(f"Message post {failure} and the check for it failed ({err}), not posting again")
+            break
+        if posted_ts:
+            logger.info(f"Message post {failure} but the message was posted: {posted_ts}")
+            if url.startswith(slack_api('')):
+                return Response(200, {}, encode_payload({"ok": True, "channel": channel_id, "ts": posted_ts}))
+            return Response(200, {}, b"ok")
+        logger.warning(f"Message post {failure} and the message is not in the channel, posting again")
+    if error:
+        raise error
+    return response
+
+
+def send_slack_message(webhook_url, status, author_name, author_link, author_icon, title, title_link, message, color, slack_token, channel_id, thread_ts=None, registry=None, write_env=True, template=None, extra_fields=(), fallback_url=None, spool=None, idempotency_key=None, rendered=None):
+    is_webhook = not webhook_url.startswith(slack_api(''))
+
+    is_reply = bool(thread_ts)
+    if not is_reply and registry:
+        with telemetry.span("registry_lookup"):
+            thread_ts = registry.lookup(channel_id, author_name)
+        if thread_ts:
+            is_reply = True
+            logger.info(f"Thread registry hit - Replying in thread: {thread_ts}")
 
     headers = {
         'Content-Type': 'application/json'
@@ -134,89 +1771,73 @@ def send_slack_message(webhook_url, status, author_name, author_link, author_ico
     if not is_webhook:
         headers['Authorization'] = f'Bearer {slack_token}'
 
-    payload = {
-        "username": author_name,
-        "icon_url": author_icon,
-        "icon_emoji": author_icon,
-        "channel": channel_id,
-        "attachments": [
-            {
-                "fallback": message,
-                "color": color,
-                "author_name": get_env("GITHUB_ACTOR", ""),
-                "author_link": f"{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_ACTOR')}",
-                "author_icon": f"{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_ACTOR')}.png?size=32",
-                "title": title,
-                "title_link": title_link,
-                "fields": [
-                    {
-                        "title": "Ref",
-                        "value": get_env("GITHUB_REF"),
-                        "short": True
-                    },
-                    {
-                        "title": "Event",
-                        "value": get_env("GITHUB_EVENT_NAME"),
-                        "short": True
-                    },
-                    {
-                        "title": "Actions URL",
-                        "value": f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}/checks|{get_env('GITHUB_WORKFLOW')}>",
-                        "short": True
-                    },
-                    {
-                        "title": "Commit",
-                        "value": f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}|{get_env('GITHUB_SHA')[:6]}>",
-                        "short": True
-                    },
-                    {
-                        "title": "Message",
-                        "value": message,
-                        "short": False
-                    },
-                    {
-                        "title": "Status",
-                        "value": status,
-                        "short": True
-                    },
-                    {
-                        "title": "Commit URL",
-                        "value": title_link,
-                        "short": True
-                    }
-                ]
-            }
-        ]
-    }
-
-    if thread_ts:
-        payload["thread_ts"] = thread_ts
+    with telemetry.span("payload_build"):
+        if template is None:
+            template = PayloadTemplate.from_env()
+        nonce = idempotency_key or os.urandom(8).hex()
+        chunks = split_message(message)
+        if rendered is None:
+            payload = template.render(status, author_name, author_icon, title, title_link, chunks[0], color, channel_id, thread_ts, extra_fields, nonce=nonce)
+        else:
+            # Rendered once for every destination; only the routing differs
+            payload = dict(rendered, channel=channel_id, metadata=template.metadata(nonce))
+            if thread_ts:
+                payload["thread_ts"] = thread_ts
+        body = encode_payload(payload)
 
-    response = requests.post(webhook_url, json=payload, headers=headers)
-    logging.info(f"Slack API Response Status: {response.status_code}")
-    logging.info(f"Slack API Response Body: {response.text}")
+    posted_at = time.time()
+    target = "webhook" if is_webhook else slack_method(webhook_url)
+    destination = destination_hash(webhook_url if is_webhook else slack_token)
+    with telemetry.span("send", mode="webhook" if is_webhook else "api", bytes=len(body)):
+        try:
+            response = post_message(
+                webhook_url, body, headers, channel_id, slack_token, nonce, f"{posted_at - HISTORY_WINDOW_SKEW:.6f}", thread_ts
+            )
+        except TransportError as err:
+            if not spool:
+                raise
+            return spool_message(spool, nonce, target, channel_id, payload, f"Request to Slack failed: {err}", err.sent, destination)
+    logger.info(f"Slack API Response Status: {response.status_code}")
+    logger.info(f"Slack API Response Body: {response.text}")
 
     if response.status_code != 200:
         error_msg = f"Request to Slack returned an error {response.status_code}, response: {response.text}"
-        logging.error(error_msg)
+        if spool and (response.status_code == 429 or response.status_code in HTTP_RETRY_STATUSES):
+            return spool_message(spool, nonce, target, channel_id, payload, error_msg, response.status_code != 429, destination)
+        logger.error(error_msg)
         return error_msg
 
     try:
         # WebHook
-        if is_webhook:
+        if is_webhook and is_reply:
+            channel = channel_id
+            message_id = thread_ts
+            logger.info(f"Webhook mode - Replied in thread: {thread_ts}")
+        elif is_webhook:
             try:
-                message_ts = get_message_ts(slack_token, channel_id, message, author_name)
+                with telemetry.span("ts_lookup"):
+                    message_ts = get_message_ts(
+                        slack_token, channel_id, message, author_name,
+                        oldest=f"{posted_at - HISTORY_WINDOW_SKEW:.6f}",
+                        max_polls=HISTORY_MAX_POLLS,
+                        nonce=nonce
+                    )
                 thread_ts = message_ts
                 channel = channel_id
                 message_id = message_ts
-                logging.info(f"Webhook mode - Retrieved timestamp: {thread_ts}")
+                logger.info(f"Webhook mode - Retrieved timestamp: {thread_ts}")
+                if registry:
+                    registry.record(channel_id, author_name, thread_ts, channel)
             except Exception as e:
-                logging.error(f"Failed to get message ts: {e}")
+                logger.error(f"Failed to get message ts: {e}")
                 current_ts = f"{time.time():.6f}"
+                if not thread_ts and len(chunks) > 1:
+                    logger.warning(f"Not sending {len(chunks) - 1} continuation parts without a thread to post them in")
+                    chunks = chunks[:1]
                 thread_ts = thread_ts or current_ts
                 channel = channel_id
                 message_id = thread_ts
-                logging.info(f"Webhook mode - Using fallback timestamp: {thread_ts}")
+                logger.info(f"Webhook mode - Using fallback timestamp: {thread_ts}")
         else:
             # API
             response_data = response.json()
@@ -224,122 +1845,1152 @@ def send_slack_message(webhook_url, status, author_name, author_link, author_ico
                 thread_ts = response_data.get('ts')
                 channel = response_data.get('channel')
                 message_id = thread_ts
-                logging.info(f"API mode - Message sent successfully. Thread TS: {thread_ts}")
+                logger.info(f"API mode - Message sent successfully. Thread TS: {thread_ts}")
+                if registry and not is_reply:
+                    registry.record(channel_id, author_name, thread_ts, channel)
+            elif fallback_url and response_data.get('error') in TOKEN_FALLBACK_ERRORS:
+                logger.warning(f"chat.postMessage failed with {response_data.get('error')}, sending through the webhook instead")
+                return send_slack_message(
+                    fallback_url, status, author_name, author_link, author_icon, title, title_link, message, color,
+                    slack_token, channel_id, thread_ts, registry, write_env, template, extra_fields,
+                    spool=spool, idempotency_key=idempotency_key, rendered=rendered
+                )
             else:
                 error_msg = f"Slack API error: {response_data.get('error')}"
-                logging.error(error_msg)
+                logger.error(error_msg)
                 return error_msg
     except json.JSONDecodeError:
         error_msg = f"Failed to parse JSON response: {response.text}"
-        logging.error(error_msg)
+        logger.error(error_msg)
         return error_msg
 
+    if len(chunks) > 1:
+        send_continuations(chunks, webhook_url, headers, author_name, author_icon, channel, thread_ts)
+
+    return format_result(thread_ts, channel, message_id, write_env)
+
+
+def send_continuations(chunks, url, headers, author_name, author_icon, channel_id, thread_ts):
+    # One at a time, so the parts keep their order in the thread
+    is_webhook = not url.startswith(slack_api(''))
+    for index, chunk in enumerate(chunks[1:], 2):
+        body = encode_payload(Webhook(
+            text=chunk, username=author_name, icon_url=author_icon, icon_emoji=author_icon, channel=channel_id, thread_ts=thread_ts
+        ).to_dict())
+        try:
+            response = http_request("POST", url, data=body, headers=headers, channel=channel_id)
+            if is_webhook:
+                error = f"webhook returned {response.status_code}" if response.status_code != 200 else None
+            else:
+                error = slack_api_error(response, slack_method(url))
+        except (TransportError, ValueError) as err:
+            error = str(err)
+        if error:
+            logger.warning(f"Unable to post part {index}/{len(chunks)} of the message: {error}")
+            return
+    logger.info(f"Posted {len(chunks) - 1} continuation parts in thread {thread_ts}")
+
+
+def spool_message(spool, key, target, channel_id, payload, error, ambiguous, destination=None):
+    # `ambiguous` marks failures after which Slack may still have posted the
+    # message; replay looks for it by its metadata nonce before reposting
+    logger.warning(f"{error}. Spooling notification {key} for retry")
+    spool.add(key, target, channel_id, payload, error, ambiguous, destination)
+    return f"Spooled {key}: {error}"
+
+
+def destination_hash(secret):
+    # Names a destination in the spool without storing its webhook or token
+    return hashlib.sha256((secret or "").encode()).hexdigest()[:16]
+
+
+def spooled_destination(entry):
+    # The destination the entry was spooled for, among the ones configured
+    # now. Entries from before fan-out have no hash and go to the first
+    field = "webhook_url" if entry["target"] == "webhook" else "slack_token"
+    for destination in destinations_from_env():
+        secret = getattr(destination, field)
+        if secret and (not entry.get("destination") or destination_hash(secret) == entry["destination"]):
+            return destination
+    return None
+
+
+def replay_entry(entry):
+    # Returns (outcome, detail, ambiguous) for RetrySpool.replay. Whatever
+    # goes wrong with one entry fails only that entry, never the run
+    try:
+        return replay_spooled(entry)
+    except Exception as err:
+        return "failed", f"Unable to replay {entry.get('key')}: {err}", False
+
+
+def replay_spooled(entry):
+    destination = spooled_destination(entry)
+    if not destination:
+        variable = "SLACK_WEBHOOK" if entry["target"] == "webhook" else "SLACK_TOKEN"
+        return "failed", f"{variable} for the spooled destination is not set", False
+    slack_token = destination.slack_token
+    if entry.get("ambiguous") and slack_token and entry.get("channel"):
+        try:
+            message_ts = find_by_nonce(slack_token, entry["channel"], entry["key"], oldest=f"{entry['at'] - HISTORY_WINDOW_SKEW:.6f}")
+            if message_ts:
+                logger.info(f"Spooled notification {entry['key']} was already posted as {message_ts}")
+                return "deduped", message_ts, False
+        except (ValueError, TransportError) as err:
+            logger.warning(f"Unable to check whether {entry['key']} was posted: {err}")
+
+    headers = {"Content-Type": "application/json"}
+    if entry["target"] == "webhook":
+        url = destination.webhook_url
+        if url.startswith(slack_api('')):
+            return "failed", "SLACK_WEBHOOK is not set", False
+    else:
+        url = slack_api(entry["target"])
+        headers["Authorization"] = f"Bearer {slack_token}"
+    try:
+        response = http_request("POST", url, data=encode_payload(entry["payload"]), headers=headers, channel=entry["channel"], max_retries=1)
+    except TransportError as err:
+        return "failed", str(err), err.sent
+
+    if response.status_code == 429 or response.status_code in HTTP_RETRY_STATUSES:
+        return "failed", f"Slack returned {response.status_code}", response.status_code != 429
+    if response.status_code != 200:
+        return "rejected", f"Slack returned {response.status_code}: {response.text}", False
+    if entry["target"] != "webhook":
+        error = slack_api_error(response, entry["target"])
+        if error:
+            return "rejected", error, False
+    return "sent", "", False
+
+
+def format_result(thread_ts, channel, message_id, write_env=True):
     # Sanitize
     thread_ts = sanitize_value(thread_ts)
     channel = sanitize_value(channel)
     message_id = sanitize_value(message_id)
 
+    result = f"SLACK_THREAD_TS={thread_ts}\nSLACK_CHANNEL={channel}\nSLACK_MESSAGE_ID={message_id}\n"
+    if write_env:
+        write_github_env(result)
+    return result
+
+
+def write_github_env(lines):
     github_env_path = os.getenv('GITHUB_ENV')
     if github_env_path:
-        with open(github_env_path, 'a') as env_file:
-            env_file.write(f"SLACK_THREAD_TS={thread_ts}\n")
-            env_file.write(f"SLACK_CHANNEL={channel}\n")
-            env_file.write(f"SLACK_MESSAGE_ID={message_id}\n")
-
-    return f"SLACK_THREAD_TS={thread_ts}\nSLACK_CHANNEL={channel}\nSLACK_MESSAGE_ID={message_id}\n"
-
-
-def build_fields(text, commit_sha):
-    minimal = get_env("MSG_MINIMAL")
-    fields = []
-    if minimal == "true":
-        fields.append(Field(get_env("SLACK_TITLE"), text, False))
-    elif minimal:
-        required_fields = minimal.split(",")
-        fields.append(Field(get_env("SLACK_TITLE"), text, False))
-        for required_field in required_fields:
-            if required_field.lower() == "ref":
-                fields.append(Field("Ref", get_env("GITHUB_REF"), True))
-            elif required_field.lower() == "event":
-                fields.append(Field("Event", get_env("GITHUB_EVENT_NAME"), True))
-            elif required_field.lower() == "actions url":
-                fields.append(Field("Actions URL", f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}/checks|{get_env('GITHUB_WORKFLOW')}>", True))
-            elif required_field.lower() == "commit":
-                fields.append(Field("Commit", f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}|{commit_sha}>", True))
+        with telemetry.span("env_write"), open(github_env_path, 'a') as env_file:
+            env_file.write(lines)
+
+
+def split_list(value):
+    return [item.strip() for item in value.replace(",", "\n").splitlines() if item.strip()]
+
+
+def split_positions(value):
+    # Like split_list, but an empty entry keeps its place: "ts1,,ts3" is
+    # three destinations, the second of them without a thread
+    value = value.strip()
+    return [item.strip() for item in value.replace(",", "\n").splitlines()] if value else []
+
+
+Destination = namedtuple("Destination", "webhook_url slack_token channel_id thread_ts")
+
+
+def destinations_from_env():
+    # Every variable takes one value or one per destination; a single value
+    # applies to all of them
+    columns = [(split_positions if name == "SLACK_THREAD_TS" else split_list)(get_env(name)) for name in DESTINATION_VARS]
+    count = max(len(column) for column in columns)
+    for name, column in zip(DESTINATION_VARS, columns):
+        if len(column) not in (0, 1, count):
+            raise ValueError(f"{name} has {len(column)} entries, expected 1 or {count}")
+    destinations = [
+        Destination(*(column[index] if len(column) == count else (column[0] if column else "") for column in columns))
+        for index in range(count)
+    ]
+    return [destination._replace(channel_id=resolve_channel(destination.channel_id, destination.slack_token)) for destination in destinations]
+
+
+def send_fan_out(destinations, message_kwargs, template, registry=None, spool=None, concurrency=FANOUT_CONCURRENCY):
+    # Each destination is sent on its own worker, so a slow workspace only
+    # holds up its own result
+    rendered = template.render(
+        message_kwargs["status"], message_kwargs["author_name"], message_kwargs["author_icon"], message_kwargs["title"],
+        message_kwargs["title_link"], split_message(message_kwargs["message"])[0], message_kwargs["color"], ""
+    )
+    mode = get_env("MSG_MODE", "AUTO")
+
+    def send(index, destination):
+        endpoint, fallback_url = resolve_endpoint(destination.webhook_url, destination.slack_token, destination.channel_id, mode)
+        with telemetry.span("destination", index=index):
+            return send_slack_message(
+                webhook_url=endpoint, slack_token=destination.slack_token, channel_id=destination.channel_id,
+                thread_ts=destination.thread_ts or None, registry=registry, write_env=False, template=template,
+                fallback_url=fallback_url, spool=spool, rendered=rendered,
+                idempotency_key=idempotency_key(index, destination.channel_id, destination.thread_ts, *message_kwargs.values()),
+                **message_kwargs
+            )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(destinations)))) as executor:
+        futures = [executor.submit(send, index, destination) for index, destination in enumerate(destinations, 1)]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:
+            results.append(f"Error sending message: {err}")
+    return results
+
+
+def aggregate_results(results, write_env=True):
+    # The unsuffixed keys list one value per destination in the order given,
+    # empty where a destination failed, so destinations_from_env maps a later
+    # step's SLACK_THREAD_TS back one to one. The numbered keys hold the same
+    # values one destination at a time
+    values = [parse_result(result) if result.startswith("SLACK_THREAD_TS=") else {} for result in results]
+    lines = [f"{key}={','.join(value.get(key, '') for value in values)}\n" for key in RESULT_KEYS]
+    for index, value in enumerate(values, 1):
+        lines.extend(f"{key}_{index}={value.get(key, '')}\n" for key in RESULT_KEYS)
+    output = "".join(lines)
+    if write_env:
+        write_github_env(output)
+    return output
+
+
+def status_store():
+    path = get_env("STATUS_MESSAGE_PATH") or os.path.join(state_dir(), STATUS_MESSAGE_FILE)
+    return JsonStore(path, THREAD_REGISTRY_TTL)
+
+
+class StatusMessage:
+    # One message per run that is edited in place. Updates arriving within
+    # `window` seconds are coalesced and only the latest one is sent
+    def __init__(self, slack_token, channel_id, store, key, window=STATUS_COALESCE_WINDOW, write_env=True):
+        self.slack_token = slack_token
+        self.channel_id = channel_id
+        self.store = store
+        self.key = key
+        self.window = window
+        self.write_env = write_env
+        self.pending = None
+        self.timer = None
+        self.result = None
+        self.lock = threading.Lock()
+        self.counts = {"updates": 0, "coalesced": 0, "unchanged": 0, "posted": 0, "edited": 0}
+
+    @classmethod
+    def from_env(cls, channel_id, author_name, window=STATUS_COALESCE_WINDOW, store=None, slack_token=None):
+        if store is None:
+            store = status_store()
+        return cls(slack_token or get_env("SLACK_TOKEN"), channel_id, store, thread_key(channel_id, author_name), window)
+
+    def update(self, payload):
+        with self.lock:
+            self.counts["updates"] += 1
+            if self.pending is not None:
+                self.counts["coalesced"] += 1
+            self.pending = payload
+            if self.window > 0 and self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if self.window <= 0:
+            return self.flush()
+
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+        return self.flush()
+
+    def flush(self):
+        with self.lock:
+            payload, self.pending, self.timer = self.pending, None, None
+            if payload is None:
+                return self.result
+            self.result = self._send(payload)
+            return self.result
+
+    def _send(self, payload):
+        body = encode_payload(payload)
+        digest = hashlib.sha256(body).hexdigest()
+        entry = self.store.get(self.key)
+        if entry and entry.get("hash") == digest:
+            self.counts["unchanged"] += 1
+            logger.info(f"Status message {entry['ts']} unchanged, skipping update")
+            return format_result(entry["ts"], entry["channel"], entry["ts"], self.write_env)
+
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.slack_token}"}
+        if entry:
+            update = {"channel": entry["channel"], "ts": entry["ts"], "attachments": payload["attachments"]}
+            response = http_request("POST", slack_api("chat.update"), data=encode_payload(update), headers=headers, channel=entry["channel"])
+            error = slack_api_error(response, "chat.update")
+            if not error:
+                self.counts["edited"] += 1
+                self.store.set(self.key, dict(entry, hash=digest))
+                logger.info(f"Status message {entry['ts']} updated")
+                return format_result(entry["ts"], entry["channel"], entry["ts"], self.write_env)
+            logger.warning(f"{error}, posting a new status message")
+
+        response = http_request("POST", slack_api("chat.postMessage"), data=body, headers=headers, channel=self.channel_id)
+        error = slack_api_error(response, "chat.postMessage")
+        if error:
+            logger.error(error)
+            return error
+        response_data = response.json()
+        self.counts["posted"] += 1
+        self.store.set(self.key, {"ts": response_data["ts"], "channel": response_data["channel"], "hash": digest})
+        logger.info(f"Status message posted: {response_data['ts']}")
+        return format_result(response_data["ts"], response_data["channel"], response_data["ts"], self.write_env)
+
+
+def content_hash(status, context, message):
+    text = VOLATILE_TEXT.sub("#", " ".join(ANSI_ESCAPE.sub("", message).lower().split()))
+    values = [status.strip().lower(), context.ref, context.sha, context.workflow, text]
+    return hashlib.sha256("\x1f".join(values).encode()).hexdigest()[:32]
+
+
+class Deduplicator:
+    # Remembers what every notification stream (repository, workflow, job,
+    # channels and author) already said. A payload sent within `window`
+    # seconds is not sent again, whether it is a re-run of the same failure or
+    # a flap back to a state that was already announced; in count mode the
+    # repeats are tallied in one reply under the original message
+    def __init__(self, store, window, mode="count"):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"DEDUP_MODE must be one of {', '.join(DEDUP_MODES)}, got {mode!r}")
+        self.store = store
+        self.window = window
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls):
+        window = float(get_env("DEDUP_WINDOW") or 0)
+        if window <= 0:
+            return None
+        path = get_env("DEDUP_PATH") or os.path.join(state_dir(), DEDUP_FILE)
+        if path.endswith(os.sep) or os.path.isdir(path):
+            # A directory, such as one restored by actions/cache, holds the
+            # store under its default name
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, DEDUP_FILE)
+        max_entries = int(get_env("DEDUP_MAX_ENTRIES", str(DEDUP_MAX_ENTRIES)))
+        return cls(JsonStore(path, window, max_entries), window, get_env("DEDUP_MODE", "count").lower())
+
+    @staticmethod
+    def key(channels, author_name, digest):
+        values = [get_env(name) for name in ("GITHUB_REPOSITORY", "GITHUB_WORKFLOW", "GITHUB_JOB")]
+        values += [",".join(channels), normalize_text(author_name), digest]
+        return hashlib.sha256("\x1f".join(values).encode()).hexdigest()[:32]
+
+    def seen(self, key):
+        try:
+            entry = self.store.get(key)
+        except OSError as err:
+            logger.warning(f"Dedup store unavailable: {err}")
+            return None
+        # The store keeps entries alive while they repeat; the window itself
+        # counts from the last notification that was actually sent
+        if entry and entry.get("sent_at", 0) >= time.time() - self.window:
+            return entry
+        return None
+
+    def record(self, key, output):
+        try:
+            self.store.set(key, {"output": output, "sent_at": time.time(), "count": 0})
+        except OSError as err:
+            logger.warning(f"Unable to update dedup store: {err}")
+
+    def repeat(self, key, entry, slack_token):
+        # Hands back the result of the original send, so later steps still
+        # reply in its thread
+        count = entry.get("count", 0) + 1
+        reply_ts = entry.get("reply_ts")
+        if self.mode == "count" and slack_token:
+            # After a fan-out the output lists every destination; the counter
+            # goes under the first one that was sent
+            columns = zip(*(split_positions(value) for value in (parse_result(entry["output"])[key] for key in RESULT_KEYS)))
+            values = dict(zip(RESULT_KEYS, next(column for column in columns if column[0])))
+            reply_ts = self._count_reply(slack_token, values["SLACK_CHANNEL"], values["SLACK_THREAD_TS"], reply_ts, count)
+        try:
+            self.store.set(key, dict(entry, count=count, reply_ts=reply_ts))
+        except OSError as err:
+            logger.warning(f"Unable to update dedup store: {err}")
+        write_github_env(entry["output"])
+        return entry["output"]
+
+    def _count_reply(self, slack_token, channel, thread_ts, reply_ts, count):
+        context = GitHubContext.from_env()
+        text = f":repeat: Repeated {count} time{'s' if count != 1 else ''}, last in run {context.run_id} attempt {context.run_attempt or 1}"
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {slack_token}"}
+        try:
+            if reply_ts:
+                update = {"channel": channel, "ts": reply_ts, "text": text}
+                response = http_request("POST", slack_api("chat.update"), data=encode_payload(update), headers=headers, channel=channel)
+                if not slack_api_error(response, "chat.update"):
+                    return reply_ts
+            reply = {"channel": channel, "thread_ts": thread_ts, "text": text}
+            response = http_request("POST", slack_api("chat.postMessage"), data=encode_payload(reply), headers=headers, channel=channel)
+        except TransportError as err:
+            logger.warning(f"Unable to update the repeat counter: {err}")
+            return reply_ts
+        error = slack_api_error(response, "chat.postMessage")
+        if error:
+            logger.warning(f"Unable to post the repeat counter: {error}")
+            return reply_ts
+        return response.json()["ts"]
+
+
+def digest_dir():
+    configured = get_env("DIGEST_DIR")
+    if configured:
+        return configured
+    return os.path.join(get_env("GITHUB_WORKSPACE") or state_dir(), ".good-comms-digest")
+
+
+def digest_status(*values):
+    for value in values:
+        status = DIGEST_STATUSES.get(value.strip().lower())
+        if status:
+            return status
+    return "success"
+
+
+def record_digest(directory, leg, status, message):
+    os.makedirs(directory, exist_ok=True)
+    safe_leg = "".join(c if c.isalnum() or c in "-_." else "_" for c in leg)
+    record = {"leg": leg, "status": status, "message": message, "at": time.time()}
+    path = os.path.join(directory, f"{safe_leg}.json")
+    atomic_write_json(path, record)
+    return path
+
+
+def read_digests(directory):
+    records = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as record_file:
+                records.append(json.load(record_file))
+        except (OSError, ValueError) as err:
+            logger.warning(f"Skipping unreadable digest record {name}: {err}")
+    return records
+
+
+def summarize_digests(records):
+    counts = {"success": 0, "failure": 0, "cancelled": 0}
+    for record in records:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    if counts["failure"]:
+        overall = "failure"
+    elif counts["cancelled"]:
+        overall = "cancelled"
     else:
-        fields.extend([
-            Field("Ref", get_env("GITHUB_REF"), True),
-            Field("Event", get_env("GITHUB_EVENT_NAME"), True),
-            Field("Actions URL", f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}/checks|{get_env('GITHUB_WORKFLOW')}>", True),
-            Field("Commit", f"<{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_REPOSITORY')}/commit/{get_env('GITHUB_SHA')}|{commit_sha}>", True),
-            Field(get_env("SLACK_TITLE"), text, False)
-        ])
-
-    host_name = get_env("HOST_NAME")
-    if host_name:
-        fields.extend([
-            Field(get_env("SITE_TITLE"), get_env("SITE_NAME"), True),
-            Field(get_env("HOST_TITLE"), get_env("HOST_NAME"), True)
-        ])
-    return fields
-
-
-def build_attachments(text, color, fields):
-    return [
-        Attachment(
-            fallback=get_env("SLACK_MESSAGE", f"GITHUB_ACTION={get_env('GITHUB_ACTION')} \n GITHUB_ACTOR={get_env('GITHUB_ACTOR')} \n GITHUB_EVENT_NAME={get_env('GITHUB_EVENT_NAME')} \n GITHUB_REF={get_env('GITHUB_REF')} \n GITHUB_REPOSITORY={get_env('GITHUB_REPOSITORY')} \n GITHUB_WORKFLOW={get_env('GITHUB_WORKFLOW')}"
-            ),
-            color=color,
-            author_name=get_env("GITHUB_ACTOR", ""),
-            author_link=f"{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_ACTOR')}",
-            author_icon=f"{get_env('GITHUB_SERVER_URL')}/{get_env('GITHUB_ACTOR')}.png?size=32",
-            footer=get_env("SLACK_FOOTER", f"<Powered by Good Comms GitHub Action|https://github.com/rennf93/good-comms>"),
-            fields=fields
-        )
+        overall = "success"
+    fields = [
+        {"title": record["leg"], "value": f"{DIGEST_ICONS.get(record['status'], '')} {record['status']}".strip(), "short": True}
+        for record in records
     ]
+    summary = f"{len(records)} jobs: {counts['success']} succeeded, {counts['failure']} failed, {counts['cancelled']} cancelled"
+    return overall, fields, summary
+
+
+def send_digest(directory, endpoint, template, registry=None, thread_ts=None, failure_details=False):
+    records = read_digests(directory) if os.path.isdir(directory) else []
+    if not records:
+        return f"Error: no digest records found in {directory}"
+    overall, fields, summary = summarize_digests(records)
+
+    kwargs = batch_defaults()
+    kwargs.update(webhook_url=endpoint, message=summary, color=STATUS_COLORS[overall], status=overall, thread_ts=thread_ts or None)
+    result = send_slack_message(registry=registry, template=template, extra_fields=fields, **kwargs)
+    if not result.startswith("SLACK_THREAD_TS=") or not failure_details:
+        return result
+
+    parent_ts = parse_result(result)["SLACK_THREAD_TS"]
+    for record in records:
+        if record["status"] != "failure":
+            continue
+        kwargs.update(
+            message=record.get("message") or "Failed", title=f"{record['leg']} failed",
+            color=STATUS_COLORS["failure"], status="failure", thread_ts=parent_ts
+        )
+        reply = send_slack_message(write_env=False, template=template, **kwargs)
+        if not reply.startswith("SLACK_THREAD_TS="):
+            logger.error(f"Unable to post details for {record['leg']}: {reply}")
+    return result
+
+
+def log_rate_limits():
+    for key, stats in rate_limiter.snapshot().items():
+        logger.info(
+            f"Rate limit {key}: {stats['requests']} requests, waited {stats['waited']:.2f}s "
+            f"(max {stats['max_wait']:.2f}s), throttled {stats['throttled']}x"
+        )
+
+
+def parse_result(result):
+    values = {}
+    for line in result.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            values[key] = value
+    return values
+
+
+def registry_from_env():
+    return ThreadRegistry.from_env() if get_env("THREAD_REGISTRY").lower() == "true" else None
+
+
+def batch_defaults():
+    first = (destinations_from_env() or [Destination("", "", "", "")])[0]
+    endpoint, fallback_url = resolve_endpoint(first.webhook_url, first.slack_token, first.channel_id, get_env("MSG_MODE", "AUTO"))
+    return {
+        "webhook_url": endpoint,
+        "fallback_url": fallback_url,
+        "status": get_env("STATUS"),
+        "author_name": get_env("AUTHOR_NAME"),
+        "author_link": get_env("AUTHOR_LINK"),
+        "author_icon": get_env("AUTHOR_ICON"),
+        "title": get_env("TITLE"),
+        "title_link": get_env("TITLE_LINK"),
+        "message": get_env("SLACK_MESSAGE"),
+        "color": get_env("COLOR", "good"),
+        "slack_token": first.slack_token,
+        "channel_id": first.channel_id,
+        "thread_ts": None
+    }
+
+
+def read_batch(path):
+    items = []
+    with open(path) as spool:
+        for line_number, line in enumerate(spool, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spec = json.loads(line)
+                if not isinstance(spec, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as err:
+                spec = {"error": f"Invalid spec on line {line_number}: {err}"}
+            items.append((line_number, spec))
+    return items
+
+
+def batch_lanes(items):
+    # Items sharing a thread go into one lane and are sent in spool order;
+    # every other item gets a lane of its own
+    lanes = {}
+    for index, (line_number, spec) in enumerate(items):
+        if spec.get("thread"):
+            key = ("thread", spec.get("channel_id"), spec["thread"])
+        elif spec.get("thread_ts"):
+            key = ("thread_ts", spec.get("channel_id"), spec["thread_ts"])
+        else:
+            key = ("item", index)
+        lanes.setdefault(key, []).append(index)
+    return list(lanes.values())
+
+
+def send_batch_item(line_number, spec, defaults, registry, template, thread_ts=None, spool=None):
+    if "error" in spec:
+        return {"line": line_number, "ok": False, "error": spec["error"]}
+    kwargs = dict(defaults)
+    kwargs.update((field, spec[field]) for field in SEND_FIELDS if spec.get(field) is not None)
+    kwargs["color"] = STATUS_COLORS.get(str(kwargs["color"]).lower(), kwargs["color"])
+    if thread_ts and not kwargs["thread_ts"]:
+        kwargs["thread_ts"] = thread_ts
+    if line_number is not None and not kwargs.get("idempotency_key"):
+        kwargs["idempotency_key"] = idempotency_key("batch", line_number, kwargs["channel_id"], kwargs["message"])
+    try:
+        kwargs["channel_id"] = resolve_channel(kwargs["channel_id"], kwargs["slack_token"])
+        result = send_slack_message(registry=registry, write_env=False, template=template, spool=spool, **kwargs)
+    except Exception as err:
+        result = f"Error sending message: {err}"
+    if result.startswith("Spooled"):
+        return {"line": line_number, "ok": False, "spooled": True, "error": result}
+    if not result.startswith("SLACK_THREAD_TS="):
+        return {"line": line_number, "ok": False, "error": result}
+    return dict({"line": line_number, "ok": True}, **parse_result(result))
+
+
+def run_batch(path, concurrency=BATCH_CONCURRENCY, output=None):
+    items = read_batch(path)
+    defaults = batch_defaults()
+    registry = registry_from_env()
+    template = PayloadTemplate.from_env()
+    spool = spool_from_env()
+    if spool:
+        spool.replay(replay_entry)
+    results = [None] * len(items)
+
+    def run_lane(lane):
+        thread_ts = None
+        for index in lane:
+            line_number, spec = items[index]
+            results[index] = send_batch_item(line_number, spec, defaults, registry, template, thread_ts, spool)
+            if spec.get("thread") and results[index]["ok"]:
+                thread_ts = thread_ts or results[index].get("SLACK_THREAD_TS")
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for future in [executor.submit(run_lane, lane) for lane in batch_lanes(items)]:
+            future.result()
+
+    lines = "".join(json.dumps(result) + "\n" for result in results)
+    if output:
+        with open(output, "w") as output_file:
+            output_file.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+    spooled = sum(1 for result in results if result.get("spooled"))
+    failed = sum(1 for result in results if not result["ok"]) - spooled
+    logger.info(f"Batch finished: {len(results) - failed - spooled} sent, {spooled} spooled, {failed} failed")
+    log_rate_limits()
+    return 1 if failed else 0
+
+
+def read_reply_items(stream):
+    # One JSON object per line, or plain text that becomes the reply message
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            spec = json.loads(line)
+        except ValueError:
+            spec = None
+        yield spec if isinstance(spec, dict) else {"message": line}
+
+
+def reply_nonce(channel_id, thread_ts, index):
+    # Stable across runs, so a resumed run can recognise replies it posted
+    return hashlib.sha256(f"{channel_id}|{thread_ts}|{index}".encode()).hexdigest()[:32]
+
+
+class ReplyProgress:
+    # Append-only log of the replies posted to one thread. The first line
+    # names the thread, every other line is one reply Slack accepted
+    def __init__(self, path, channel_id, thread_ts):
+        self.path = path
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+
+    def load(self):
+        # Returns (replies already posted, ts of the last one, resumed)
+        records = []
+        try:
+            with open(self.path) as progress_file:
+                for line in progress_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Torn tail of a write interrupted by a crash
+                        continue
+        except FileNotFoundError:
+            pass
+        header = records[0] if records else {}
+        if header.get("channel") != self.channel_id or header.get("thread_ts") != self.thread_ts:
+            if records:
+                logger.warning(f"{self.path} tracks another thread, starting over")
+            atomic_write_text(self.path, json.dumps({"channel": self.channel_id, "thread_ts": self.thread_ts}) + "\n")
+            return 0, None, False
+        sent, last_ts = 0, None
+        for record in records[1:]:
+            if record.get("index") == sent:
+                sent += 1
+                last_ts = record.get("ts")
+        return sent, last_ts, True
+
+    def record(self, index, ts):
+        with open(self.path, "a") as progress_file:
+            progress_file.write(json.dumps({"index": index, "ts": ts}, separators=(",", ":")) + "\n")
+            progress_file.flush()
+            os.fsync(progress_file.fileno())
+
+
+def posted_reply_nonces(slack_token, channel_id, thread_ts, oldest=None, max_pages=HISTORY_MAX_PAGES):
+    url = slack_api("conversations.replies")
+    headers = {"Authorization": f"Bearer {slack_token}"}
+    params = {"channel": channel_id, "ts": thread_ts, "limit": HISTORY_PAGE_LIMIT, "include_all_metadata": "true"}
+    if oldest:
+        params["oldest"] = oldest
+    nonces = {}
+    for _ in range(max_pages):
+        response = http_request("GET", url, headers=headers, params=params)
+        error = slack_api_error(response, "conversations.replies")
+        if error:
+            raise ValueError(error)
+        response_data = response.json()
+        for msg in response_data.get("messages", []):
+            nonce = metadata_nonce(msg)
+            if nonce:
+                nonces[nonce] = msg.get("ts")
+        cursor = (response_data.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+        params["cursor"] = cursor
+    return nonces
+
+
+def reply_template():
+    return PayloadTemplate(
+        GitHubContext.from_env(), style=get_env("MSG_STYLE", "attachment").lower(), minimal="true", footer=get_env("SLACK_FOOTER")
+    )
+
+
+def post_replies(items, slack_token, channel_id, thread_ts, progress_path=None, template=None, author_name="", author_icon="", queue_size=REPLY_QUEUE_SIZE):
+    # Replies are posted one at a time, so Slack hands out timestamps in
+    # submission order. The next items are read and rendered on another
+    # thread while a reply is in flight, and the channel limiter reserves
+    # slots ahead of time, so waiting for the next slot overlaps the request
+    if template is None:
+        template = reply_template()
+    progress = ReplyProgress(progress_path, channel_id, thread_ts) if progress_path else None
+    done, last_ts, resumed = progress.load() if progress else (0, None, False)
+    if resumed:
+        # A reply sent right before a crash may be missing from the log
+        try:
+            posted = posted_reply_nonces(slack_token, channel_id, thread_ts, oldest=last_ts)
+        except (ValueError, TransportError) as err:
+            logger.warning(f"Unable to check the thread for replies posted before the restart: {err}")
+            posted = {}
+        while reply_nonce(channel_id, thread_ts, done) in posted:
+            last_ts = posted[reply_nonce(channel_id, thread_ts, done)]
+            progress.record(done, last_ts)
+            done += 1
+        logger.info(f"Resuming thread {thread_ts} after {done} replies")
+
+    url = slack_api("chat.postMessage")
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {slack_token}"}
+    pending = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    default_color = get_env("COLOR", "good")
+    state = {"total": 0}
+
+    def offer(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def render():
+        try:
+            for index, spec in enumerate(items):
+                state["total"] = index + 1
+                if index < done:
+                    continue
+                with telemetry.span("payload_build"):
+                    color = spec.get("color") or spec.get("status") or default_color
+                    chunks = split_message(str(spec.get("message", "")))
+                    body = template.render_bytes(
+                        spec.get("status", ""), author_name, author_icon, spec.get("title", ""), spec.get("title_link", ""),
+                        chunks[0], STATUS_COLORS.get(str(color).lower(), color), channel_id, thread_ts,
+                        nonce=reply_nonce(channel_id, thread_ts, index)
+                    )
+                if not offer((index, body, chunks)):
+                    return
+            offer(None)
+        except Exception as err:
+            offer(err)
+
+    renderer = threading.Thread(target=render, daemon=True)
+    renderer.start()
+    posted, error = 0, None
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                error = f"Unable to read reply items: {item}"
+                break
+            index, body, chunks = item
+            try:
+                with telemetry.span("send", mode="api", bytes=len(body)):
+                    response = http_request("POST", url, data=body, headers=headers, channel=channel_id)
+                failure = slack_api_error(response, "chat.postMessage")
+            except (TransportError, ValueError) as err:
+                failure = str(err)
+            if failure:
+                error = f"Reply {index + 1} was not posted: {failure}"
+                break
+            last_ts = response.json().get("ts")
+            if progress:
+                progress.record(index, last_ts)
+            if len(chunks) > 1:
+                send_continuations(chunks, url, headers, author_name, author_icon, channel_id, thread_ts)
+            posted += 1
+            if posted % REPLY_PROGRESS_EVERY == 0:
+                logger.info(f"Posted {done + posted} replies so far in thread {thread_ts}")
+    finally:
+        stop.set()
+        renderer.join()
+
+    result = {"thread_ts": thread_ts, "channel": channel_id, "posted": posted, "skipped": done, "last_ts": last_ts}
+    if error:
+        logger.error(error)
+        result["error"] = error
+    else:
+        result["total"] = state["total"]
+    logger.info(f"Finished thread {thread_ts}: {posted} replies posted" + (f" after resuming at {done}" if done else ""))
+    return result
+
+
+def run_replies(path, thread_ts=None, progress_path=None, destination=None):
+    destination = destination or (destinations_from_env() or [Destination("", "", "", "")])[0]
+    if not destination.slack_token or not destination.channel_id:
+        logger.error("Threaded replies need SLACK_TOKEN and CHANNEL_ID")
+        return 2
+    author_name = get_env("AUTHOR_NAME")
+    thread_ts = thread_ts or destination.thread_ts or ThreadRegistry.from_env().lookup(destination.channel_id, author_name)
+    if not thread_ts:
+        logger.error("No parent message to reply to: set SLACK_THREAD_TS or post it with THREAD_REGISTRY enabled")
+        return 2
+    if progress_path is None and path != "-":
+        progress_path = f"{path}.progress.jsonl"
+
+    with (open(path) if path != "-" else nullcontext(sys.stdin)) as stream:
+        result = post_replies(
+            read_reply_items(stream), destination.slack_token, destination.channel_id, thread_ts,
+            progress_path, author_name=author_name, author_icon=get_env("AUTHOR_ICON")
+        )
+    sys.stdout.write(json.dumps(result) + "\n")
+    log_rate_limits()
+    return 1 if "error" in result else 0
+
+
+def run_resolve(names, warm=False):
+    slack_token = split_list(get_env("SLACK_TOKEN"))[:1]
+    if not slack_token:
+        logger.error("Resolving names needs SLACK_TOKEN")
+        return 2
+    directory = SlackDirectory.from_env(slack_token[0])
+    if warm:
+        try:
+            directory.warm_channels()
+            directory.warm_users()
+        except (ValueError, TransportError) as err:
+            logger.error(f"Unable to warm the directory cache: {err}")
+            return 1
+    resolved = {}
+    for name in names:
+        if name.startswith("#"):
+            resolved[name] = directory.channel_id(name)
+        else:
+            resolved[name] = resolve_actor(slack_token[0], name.lstrip("@"))
+    sys.stdout.write(json.dumps(resolved) + "\n")
+    return 1 if None in resolved.values() else 0
+
+
+def daemon_socket_path():
+    return get_env("GOOD_COMMS_SOCKET") or os.path.join(state_dir(), DAEMON_SOCKET_FILE)
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered with one JSON line
+    def handle(self):
+        while True:
+            line = self.rfile.readline(DAEMON_MAX_REQUEST + 1)
+            if not line:
+                return
+            try:
+                if len(line) > DAEMON_MAX_REQUEST:
+                    raise ValueError("request too large")
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+                response = self.server.notifier.handle(request)
+            except ValueError as err:
+                response = {"ok": False, "error": f"Invalid request: {err}"}
+            except Exception as err:
+                logger.exception("Notifier daemon request failed")
+                response = {"ok": False, "error": f"{type(err).__name__}: {err}"}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class UnixNotifierServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPNotifierServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class NotifierDaemon:
+    # Serves notifications for the rest of a job. The connection pool,
+    # thread labels and status messages stay warm between requests
+    def __init__(self, idle_timeout=DAEMON_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.defaults = batch_defaults()
+        self.template = PayloadTemplate.from_env()
+        registry = registry_from_env()
+        if registry:
+            registry.store = MemoryStore(registry.store, registry.store.ttl)
+        self.registry = registry
+        self.spool = spool_from_env()
+        self.status_store = MemoryStore(status_store(), THREAD_REGISTRY_TTL)
+        self.threads = {}
+        self.thread_locks = {}
+        self.status_messages = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.last_request = time.monotonic()
+        self.server = None
+
+    def handle(self, request):
+        self.last_request = time.monotonic()
+        op = request.get("op", "send")
+        spec = request.get("spec") or {}
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op == "shutdown":
+            self.stopping.set()
+            return {"ok": True}
+        if not isinstance(spec, dict):
+            return {"ok": False, "error": "spec must be a JSON object"}
+        if op == "send":
+            return self.send(spec)
+        if op == "status":
+            return self.status(spec)
+        return {"ok": False, "error": f"Unknown op: {op}"}
+
+    def send(self, spec):
+        label = spec.get("thread")
+        if not label:
+            return self._send(spec)
+        key = (spec.get("channel_id") or self.defaults["channel_id"], label)
+        with self.lock:
+            thread_lock = self.thread_locks.setdefault(key, threading.Lock())
+        # The first message with a label becomes the parent, so sends for
+        # one label are serialised
+        with thread_lock:
+            result = self._send(spec, self.threads.get(key))
+            if result["ok"] and key not in self.threads:
+                self.threads[key] = result.get("SLACK_THREAD_TS")
+        return result
+
+    def _send(self, spec, thread_ts=None):
+        result = send_batch_item(None, spec, self.defaults, self.registry, self.template, thread_ts, self.spool)
+        result.pop("line", None)
+        return result
+
+    def status(self, spec):
+        kwargs = dict(self.defaults)
+        kwargs.update((field, spec[field]) for field in SEND_FIELDS if spec.get(field) is not None)
+        key = (kwargs["channel_id"], kwargs["author_name"])
+        with self.lock:
+            if key not in self.status_messages:
+                self.status_messages[key] = StatusMessage.from_env(kwargs["channel_id"], kwargs["author_name"], store=self.status_store)
+                self.status_messages[key].write_env = False
+            status_message = self.status_messages[key]
+        color = STATUS_COLORS.get(str(kwargs["color"]).lower(), kwargs["color"])
+        status_message.update(self.template.render(
+            kwargs["status"], kwargs["author_name"], kwargs["author_icon"], kwargs["title"],
+            kwargs["title_link"], kwargs["message"], color, kwargs["channel_id"]
+        ))
+        entry = self.status_store.get(status_message.key)
+        if entry is None:
+            # Nothing to edit yet: post now so the caller gets a thread ts
+            result = status_message.flush()
+            if not result.startswith("SLACK_THREAD_TS="):
+                return {"ok": False, "error": result}
+            return dict({"ok": True}, **parse_result(result))
+        return {"ok": True, "queued": True, "SLACK_THREAD_TS": entry["ts"], "SLACK_CHANNEL": entry["channel"], "SLACK_MESSAGE_ID": entry["ts"]}
+
+    def watch_idle(self):
+        last_replay = time.monotonic()
+        while not self.stopping.wait(1.0):
+            if time.monotonic() - self.last_request > self.idle_timeout:
+                logger.info(f"No requests for {self.idle_timeout}s, shutting down")
+                self.stopping.set()
+            elif self.spool and time.monotonic() - last_replay > SPOOL_REPLAY_INTERVAL:
+                self.spool.replay(replay_entry)
+                last_replay = time.monotonic()
+
+    def serve(self, socket_path=None, port=None):
+        if port:
+            self.server = TCPNotifierServer(("127.0.0.1", port), DaemonRequestHandler)
+            address = f"127.0.0.1:{self.server.server_address[1]}"
+        else:
+            if os.path.exists(socket_path):
+                try:
+                    daemon_request({"op": "ping"}, socket_path=socket_path, timeout=1.0)
+                    raise RuntimeError(f"A daemon is already listening on {socket_path}")
+                except OSError:
+                    os.unlink(socket_path)
+            old_umask = os.umask(0o177)
+            try:
+                self.server = UnixNotifierServer(socket_path, DaemonRequestHandler)
+            finally:
+                os.umask(old_umask)
+            address = socket_path
+        self.server.notifier = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.watch_idle, daemon=True).start()
+        logger.info(f"Notifier daemon {os.getpid()} listening on {address}")
+        try:
+            self.stopping.wait()
+        finally:
+            self.close(socket_path if not port else None)
+
+    def close(self, socket_path=None):
+        self.server.shutdown()
+        self.server.server_close()
+        for status_message in list(self.status_messages.values()):
+            status_message.close()
+        if self.spool:
+            self.spool.replay(replay_entry)
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logger.info(f"Notifier daemon stopped, flushed {len(self.status_messages)} status messages")
+        log_rate_limits()
+
+
+def serve(socket_path=None, port=None, detach=False, idle_timeout=DAEMON_IDLE_TIMEOUT):
+    socket_path = None if port else (socket_path or daemon_socket_path())
+    if detach:
+        if os.fork():
+            # Parent: wait until the daemon answers, then hand back the step
+            deadline = time.monotonic() + DAEMON_START_TIMEOUT
+            while time.monotonic() < deadline:
+                try:
+                    daemon_request({"op": "ping"}, socket_path=socket_path, port=port, timeout=0.5)
+                    return 0
+                except OSError:
+                    time.sleep(0.05)
+            logger.error(f"Notifier daemon did not start, see {os.path.join(state_dir(), DAEMON_LOG_FILE)}")
+            return 1
+        os.setsid()
+        log_fd = os.open(os.path.join(state_dir(), DAEMON_LOG_FILE), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+
+    # The daemon outlives the step that started it, so it must not write to
+    # that step's env and output files
+    for name in ("GITHUB_ENV", "GITHUB_OUTPUT"):
+        os.environ.pop(name, None)
+    daemon = NotifierDaemon(idle_timeout)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: daemon.stopping.set())
+    daemon.serve(socket_path, port)
+    return 0
+
+
+def daemon_request(request, socket_path=None, port=None, timeout=DAEMON_REQUEST_TIMEOUT):
+    if port:
+        connection = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(socket_path or daemon_socket_path())
+        except OSError:
+            connection.close()
+            raise
+    with connection, connection.makefile("rwb") as stream:
+        stream.write((json.dumps(request) + "\n").encode())
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        raise ConnectionError("Notifier daemon closed the connection")
+    return json.loads(line)
+
+
+def client_spec(overrides=None):
+    spec = {field: get_env(name) for name, field in CLIENT_ENV_FIELDS.items() if get_env(name)}
+    spec.update((field, value) for field, value in (overrides or {}).items() if value is not None)
+    return spec
+
+
+def client(op="send", spec=None, socket_path=None, port=None):
+    try:
+        response = daemon_request({"op": op, "spec": spec or {}}, socket_path=socket_path, port=port)
+    except (FileNotFoundError, ConnectionRefusedError) as err:
+        # Nothing reached the daemon, so sending directly cannot duplicate
+        if op not in ("send", "status"):
+            logger.error(f"Notifier daemon unreachable: {err}")
+            return 1
+        logger.warning(f"Notifier daemon unreachable ({err}), sending directly")
+        os.environ.update({name: str(spec[field]) for name, field in CLIENT_ENV_FIELDS.items() if spec.get(field)})
+        if op == "status":
+            os.environ["STATUS_MESSAGE"] = "true"
+        main()
+        return 0
+    except OSError as err:
+        logger.error(f"Notifier daemon request failed: {err}")
+        return 1
+
+    if response.get("spooled"):
+        logger.warning(f"Slack is unavailable, the daemon spooled the message for retry: {response.get('error')}")
+        return 0
+    if not response.get("ok"):
+        logger.error(f"Error sending message: {response.get('error')}")
+        return 1
+    if "SLACK_THREAD_TS" in response:
+        print(format_result(response["SLACK_THREAD_TS"], response["SLACK_CHANNEL"], response["SLACK_MESSAGE_ID"]), end="")
+    return 0
 
 
 def main():
-    endpoint = get_env("SLACK_WEBHOOK")
-    logging.info(f"Using endpoint: {endpoint}")
-    logging.info(f"Message mode: {get_env('MSG_MODE')}")
+    try:
+        destinations = destinations_from_env()
+    except ValueError as err:
+        logger.error(str(err))
+        sys.exit(1)
+    endpoint = destinations[0].webhook_url if destinations else ""
+    logger.info(f"Message mode: {get_env('MSG_MODE', 'AUTO')}")
 
     custom_payload = get_env("SLACK_CUSTOM_PAYLOAD", "")
     if not endpoint:
         if not get_env("SLACK_CHANNEL"):
-            logging.error("Channel is required for sending message using a token")
+            logger.error("Channel is required for sending message using a token")
             sys.exit(1)
         if get_env("MSG_MODE") == "TOKEN":
-            endpoint = "https://slack.com/api/chat.postMessage"
+            endpoint = slack_api("chat.postMessage")
         else:
-            logging.error("URL is required")
+            logger.error("URL is required")
             sys.exit(2)
+    destinations = [destination._replace(webhook_url=destination.webhook_url or endpoint) for destination in destinations]
     if custom_payload:
-        response = requests.post(endpoint, data=custom_payload.encode(), headers={"Content-Type": "application/json"})
-        if response.status_code != 200:
-            logging.error(f"Error sending custom payload: {response.status_code}, {response.text}")
-            sys.exit(2)
+        try:
+            payload_channel = json.loads(custom_payload).get("channel")
+        except (ValueError, AttributeError):
+            payload_channel = None
+        channels = {}
+        for destination in destinations:
+            channels.setdefault(destination.webhook_url, destination.channel_id)
+        for url, channel_id in (channels or {endpoint: ""}).items():
+            response = http_request(
+                "POST", url, data=custom_payload.encode(), headers={"Content-Type": "application/json"},
+                channel=payload_channel or channel_id or None
+            )
+            if response.status_code != 200:
+                logger.error(f"Error sending custom payload: {response.status_code}, {response.text}")
+                sys.exit(2)
     else:
         text = get_env("SLACK_MESSAGE")
         if not text:
-            logging.error("Message is required")
+            logger.error("Message is required")
             sys.exit(3)
         if get_env("GITHUB_WORKFLOW").startswith(".github"):
             try:
                 os.environ["GITHUB_WORKFLOW"] = "Link to action run.yaml"
             except Exception as err:
-                logging.error(f"Unable to update the workflow's variables: {err}")
+                logger.error(f"Unable to update the workflow's variables: {err}")
                 sys.exit(4)
 
-        long_sha = get_env("GITHUB_SHA")
-        commit_sha = long_sha[:6]
-
         slack_color = get_env("COLOR").lower()
-        color = {
-            "success": "good",
-            "cancelled": "#808080",
-            "failure": "danger"
-        }.get(slack_color, get_env("COLOR", "good"))
+        color = STATUS_COLORS.get(slack_color, get_env("COLOR", "good"))
 
         if slack_color == "success":
             text = get_env("SLACK_MESSAGE_ON_SUCCESS", text)
@@ -351,31 +3002,216 @@ def main():
         if not text:
             text = "EOM"
 
-        # fields = build_fields(text, commit_sha)
-        thread_ts = get_env("SLACK_THREAD_TS")
-
-        result = send_slack_message(
-            webhook_url=endpoint,
-            status=get_env("STATUS"),
-            author_name=get_env("AUTHOR_NAME"),
-            author_link=get_env("AUTHOR_LINK"),
-            author_icon=get_env("AUTHOR_ICON"),
-            title=get_env("TITLE"),
-            title_link=get_env("TITLE_LINK"),
-            message=text,
-            color=color,
-            slack_token=get_env("SLACK_TOKEN"),
-            channel_id=get_env("CHANNEL_ID"),
-            thread_ts=thread_ts if thread_ts else None
-        )
+        log_tail = log_tail_from_env()
+        if log_tail:
+            text = f"{text}\n{log_tail}"
 
-        if result.startswith("Error"):
-            logging.error(f"Error sending message: {result}")
-            sys.exit(1)
+        digest_mode = get_env("DIGEST_MODE").lower()
+        if digest_mode == "record":
+            leg = get_env("DIGEST_LEG") or get_env("GITHUB_JOB")
+            if not get_env("DIGEST_LEG"):
+                logger.warning("DIGEST_LEG is not set; matrix legs will overwrite each other's records")
+            path = record_digest(digest_dir(), leg, digest_status(slack_color, get_env("STATUS")), text)
+            logger.info(f"Recorded digest status for {leg} in {path}")
+            return
+
+        first = destinations[0] if destinations else Destination(endpoint, get_env("SLACK_TOKEN"), get_env("CHANNEL_ID"), "")
+        thread_ts = first.thread_ts
+        registry = registry_from_env()
+        template = PayloadTemplate.from_env()
+        if get_env("MENTION_ACTOR").lower() == "true":
+            template.mention = actor_mention(destinations or [first])
+        endpoint, fallback_url = resolve_endpoint(first.webhook_url, first.slack_token, first.channel_id, get_env("MSG_MODE", "AUTO"))
+        status_message_mode = get_env("STATUS_MESSAGE").lower() == "true"
+        if len(destinations) > 1 and (digest_mode == "aggregate" or status_message_mode):
+            logger.warning("DIGEST_MODE and STATUS_MESSAGE only use the first destination")
+            destinations = destinations[:1]
+        spool = spool_from_env()
+        if spool:
+            # Older notifications go out before this one
+            spool.replay(replay_entry)
+
+        deduplicator = None
+        if digest_mode != "aggregate" and not status_message_mode:
+            deduplicator = Deduplicator.from_env()
+        if deduplicator:
+            dedup_key = Deduplicator.key(
+                [destination.channel_id for destination in destinations or [first]], get_env("AUTHOR_NAME"),
+                content_hash(get_env("STATUS"), GitHubContext.from_env(), text)
+            )
+            entry = deduplicator.seen(dedup_key)
+            if entry:
+                print(deduplicator.repeat(dedup_key, entry, first.slack_token))
+                logger.info(f"Same notification already sent within the last {deduplicator.window:g}s, not sending it again")
+                return
+
+        if digest_mode == "aggregate":
+            result = send_digest(
+                digest_dir(), endpoint, template, registry, thread_ts,
+                failure_details=get_env("DIGEST_FAILURE_DETAILS").lower() == "true"
+            )
+        elif status_message_mode:
+            status_message = StatusMessage.from_env(first.channel_id, get_env("AUTHOR_NAME"), window=0, slack_token=first.slack_token)
+            result = status_message.update(template.render(
+                get_env("STATUS"), get_env("AUTHOR_NAME"), get_env("AUTHOR_ICON"), get_env("TITLE"),
+                get_env("TITLE_LINK"), text, color, first.channel_id
+            ))
+        elif len(destinations) > 1:
+            results = send_fan_out(destinations, {
+                "status": get_env("STATUS"), "author_name": get_env("AUTHOR_NAME"), "author_link": get_env("AUTHOR_LINK"),
+                "author_icon": get_env("AUTHOR_ICON"), "title": get_env("TITLE"), "title_link": get_env("TITLE_LINK"),
+                "message": text, "color": color
+            }, template, registry, spool, int(get_env("FANOUT_CONCURRENCY", str(FANOUT_CONCURRENCY))))
         else:
-            print(result)
-            logging.info("Successfully sent the message!")
+            result = send_slack_message(
+                webhook_url=endpoint,
+                status=get_env("STATUS"),
+                author_name=get_env("AUTHOR_NAME"),
+                author_link=get_env("AUTHOR_LINK"),
+                author_icon=get_env("AUTHOR_ICON"),
+                title=get_env("TITLE"),
+                title_link=get_env("TITLE_LINK"),
+                message=text,
+                color=color,
+                slack_token=first.slack_token,
+                channel_id=first.channel_id,
+                thread_ts=thread_ts if thread_ts else None,
+                registry=registry,
+                template=template,
+                fallback_url=fallback_url,
+                spool=spool,
+                idempotency_key=idempotency_key(
+                    first.channel_id, thread_ts, get_env("AUTHOR_NAME"), get_env("STATUS"), get_env("TITLE"), text, color
+                )
+            )
+        if len(destinations) <= 1:
+            results = [result]
+
+        failed = 0
+        for index, result in enumerate(results, 1):
+            where = f" to destination {index}" if len(results) > 1 else ""
+            if result.startswith("Spooled"):
+                logger.warning(f"Slack is unavailable, the message{where} will be retried from the spool: {result}")
+            elif not result.startswith("SLACK_THREAD_TS="):
+                logger.error(f"Error sending message{where}: {result}")
+                failed += 1
+
+        sent = [(destination, parse_result(result)) for destination, result in zip(destinations or [first], results) if result.startswith("SLACK_THREAD_TS=")]
+        if sent:
+            output = results[0] if len(results) == 1 else aggregate_results(results)
+            print(output)
+            if deduplicator and len(sent) == len(results):
+                deduplicator.record(dedup_key, output)
+            logger.info("Successfully sent the message!" if len(results) == 1 else f"Sent the message to {len(sent)} of {len(results)} destinations")
+
+            uploads = split_list(get_env("SLACK_FILE_UPLOAD"))
+            if uploads:
+                for destination, values in sent:
+                    try:
+                        send_files(uploads, destination.slack_token, values["SLACK_CHANNEL"], values["SLACK_THREAD_TS"])
+                    except Exception as err:
+                        logger.error(f"Error uploading files: {err}")
+                        failed += 1
+
+            replies_file = get_env("REPLIES_FILE")
+            if replies_file:
+                destination, values = sent[0]
+                if not destination.slack_token:
+                    logger.error("REPLIES_FILE needs SLACK_TOKEN")
+                    failed += 1
+                else:
+                    try:
+                        with open(replies_file) as stream:
+                            replies = post_replies(
+                                read_reply_items(stream), destination.slack_token, values["SLACK_CHANNEL"], values["SLACK_THREAD_TS"],
+                                get_env("REPLIES_PROGRESS") or f"{replies_file}.progress.jsonl",
+                                author_name=get_env("AUTHOR_NAME"), author_icon=get_env("AUTHOR_ICON")
+                            )
+                    except OSError as err:
+                        replies = {"error": str(err)}
+                        logger.error(f"Unable to read {replies_file}: {err}")
+                    if "error" in replies:
+                        failed += 1
+        if failed:
+            sys.exit(1)
+    log_rate_limits()
+
+
+def cli(argv=None):
+    # Only the command line configures logging; importing run as a library
+    # leaves the host's logging setup alone
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(prog="run.py", description="Send GitHub Actions notifications to Slack.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="send every notification spec in a JSONL file")
+    batch_parser.add_argument("spool", help="JSONL file with one send_slack_message spec per line")
+    batch_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="maximum number of parallel sends")
+    batch_parser.add_argument("--output", help="write result lines to this file instead of stdout")
+
+    serve_parser = subparsers.add_parser("serve", help="run a notifier daemon for the rest of the job")
+    serve_parser.add_argument("--socket", help="Unix socket path (defaults to GOOD_COMMS_SOCKET or the runner temp directory)")
+    serve_parser.add_argument("--port", type=int, help="listen on this localhost TCP port instead of a Unix socket")
+    serve_parser.add_argument("--detach", action="store_true", help="return once the daemon is ready and keep it running in the background")
+    serve_parser.add_argument("--idle-timeout", type=float, default=DAEMON_IDLE_TIMEOUT, help="stop after this many seconds without requests")
+
+    replies_parser = subparsers.add_parser("replies", help="post one reply per item in a thread, in order")
+    replies_parser.add_argument("items", help="file with one JSON object or line of text per reply, - for stdin")
+    replies_parser.add_argument("--thread-ts", help="parent message (defaults to SLACK_THREAD_TS or the thread registry)")
+    replies_parser.add_argument("--progress", help="progress log to resume from (defaults to ITEMS.progress.jsonl)")
+
+    resolve_parser = subparsers.add_parser("resolve", help="look up channel and user IDs through the directory cache")
+    resolve_parser.add_argument("names", nargs="*", help="#channel or GitHub login (a leading @ is optional)")
+    resolve_parser.add_argument("--warm", action="store_true", help="refresh the cached channel and user lists first")
+
+    replay_parser = subparsers.add_parser("replay", help="resend notifications waiting in the retry spool")
+    replay_parser.add_argument("--force", action="store_true", help="ignore the backoff schedule and retry every entry now")
+
+    client_parser = subparsers.add_parser("client", help="send a notification through a running daemon")
+    client_parser.add_argument("--socket", help="Unix socket path of the daemon")
+    client_parser.add_argument("--port", type=int, help="localhost TCP port of the daemon")
+    client_parser.add_argument("--message", help="message text (defaults to SLACK_MESSAGE)")
+    client_parser.add_argument("--status", help="job status (defaults to STATUS)")
+    client_parser.add_argument("--title", help="message title (defaults to TITLE)")
+    client_parser.add_argument("--color", help="message color (defaults to COLOR)")
+    client_parser.add_argument("--thread", help="reply in the thread started by the first message with this label")
+    client_op = client_parser.add_mutually_exclusive_group()
+    client_op.add_argument("--status-message", dest="op", action="store_const", const="status", default="send", help="update the run's status message instead of posting")
+    client_op.add_argument("--ping", dest="op", action="store_const", const="ping", help="check that the daemon is running")
+    client_op.add_argument("--shutdown", dest="op", action="store_const", const="shutdown", help="flush pending updates and stop the daemon")
+
+    args = parser.parse_args(argv)
+    if args.command != "serve":
+        deadline.start(float(get_env("DEADLINE_SECONDS") or 0))
+    try:
+        with telemetry.span("run", command=args.command or "send"):
+            if args.command == "batch":
+                sys.exit(run_batch(args.spool, args.concurrency, args.output))
+            if args.command == "serve":
+                sys.exit(serve(args.socket, args.port, args.detach, args.idle_timeout))
+            if args.command == "replies":
+                sys.exit(run_replies(args.items, args.thread_ts, args.progress))
+            if args.command == "resolve":
+                sys.exit(run_resolve(args.names, args.warm))
+            if args.command == "replay":
+                counts = RetrySpool.from_env().replay(replay_entry, args.force)
+                print(json.dumps(counts))
+                sys.exit(0)
+            if args.command == "client":
+                spec = client_spec({"message": args.message, "status": args.status, "title": args.title, "color": args.color, "thread": args.thread})
+                if args.op == "send":
+                    spec["idempotency_key"] = idempotency_key("client", json.dumps(spec, sort_keys=True))
+                sys.exit(client(args.op, spec, args.socket, args.port))
+            main()
+    finally:
+        emit_telemetry()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if get_env("GOOD_COMMS_PROFILE"):
+        profiled(cli)
+    else:
+        cli()
\ No newline at end of file
@@ -0,0 +1,390 @@
+import asyncio
+import http.client
+import json
+import logging
+import os
+import ssl
+import time
+import urllib.parse
+
+import run
+
+
+logger = logging.getLogger("good_comms.async")
+
+# Kept out of run.py so the action's cold start never imports asyncio
+ASYNC_MAX_CONNECTIONS = 64
+ASYNC_CONNECT_TIMEOUT = 10.0
+ASYNC_READ_TIMEOUT = 30.0
+
+
+class AsyncTransport:
+    # HTTP/1.1 on asyncio streams with keep-alive connections pooled per
+    # host. A semaphore caps the sockets in use, so thousands of concurrent
+    # sends queue for a connection instead of each needing a thread. Use
+    # one transport per event loop
+    def __init__(self, max_connections=ASYNC_MAX_CONNECTIONS, timeout=(ASYNC_CONNECT_TIMEOUT, ASYNC_READ_TIMEOUT)):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = {}
+        self.connections = 0
+        self.ssl_context = None
+
+    async def _connect(self, parts, connect_timeout):
+        ssl_context = None
+        if parts.scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            conn = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=ssl_context), connect_timeout)
+        except (OSError, asyncio.TimeoutError) as err:
+            raise run.TransportError(f"Unable to connect to {parts.netloc}: {str(err) or 'timed out'}", sent=False) from err
+        self.connections += 1
+        return conn
+
+    async def _checkout(self, parts, connect_timeout):
+        idle = self.idle.get((parts.scheme, parts.netloc))
+        while idle:
+            conn = idle.pop()
+            if not conn[0].at_eof():
+                return conn, True
+            conn[1].close()
+        return await self._connect(parts, connect_timeout), False
+
+    def _checkin(self, parts, conn):
+        idle = self.idle.setdefault((parts.scheme, parts.netloc), [])
+        if len(idle) < self.max_connections:
+            idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _exchange(self, conn, method, parts, path, headers, body, read_timeout, progress):
+        # The read timeout applies to every write and read on its own, as
+        # socket.settimeout does for the sync transport, so a large upload is
+        # not cut off while data is still moving
+        reader, writer = conn
+        if body is None:
+            headers.setdefault("Content-Length", "0")
+        elif isinstance(body, bytes):
+            headers.setdefault("Content-Length", str(len(body)))
+        head = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}"] + [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, bytes):
+            writer.write(body)
+        elif body is not None:
+            # Files are streamed in blocks, so memory stays flat
+            while True:
+                block = body.read(run.HTTP_BLOCKSIZE)
+                if not block:
+                    break
+                writer.write(block)
+                await asyncio.wait_for(writer.drain(), read_timeout)
+        await asyncio.wait_for(writer.drain(), read_timeout)
+
+        status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+        if not status_line:
+            raise ConnectionAbortedError("connection closed by server")
+        progress["response"] = True
+        version, status = status_line.decode("latin-1").split(None, 2)[:2]
+        message = http.client.HTTPMessage()
+        while True:
+            line = await asyncio.wait_for(reader.readline(), read_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            message[name.strip()] = value.strip()
+
+        keep = version == "HTTP/1.1" and message.get("Connection", "").lower() != "close"
+        if message.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await asyncio.wait_for(reader.readline(), read_timeout)).split(b";")[0], 16)
+                if not size:
+                    while (await asyncio.wait_for(reader.readline(), read_timeout)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await asyncio.wait_for(reader.readexactly(size), read_timeout))
+                await asyncio.wait_for(reader.readline(), read_timeout)
+            content = b"".join(chunks)
+        elif message.get("Content-Length") is not None:
+            content = await asyncio.wait_for(reader.readexactly(int(message["Content-Length"])), read_timeout)
+        elif method == "HEAD" or status in ("204", "304"):
+            content = b""
+        else:
+            content = await asyncio.wait_for(reader.read(), read_timeout)
+            keep = False
+        return run.Response(int(status), message, content), keep
+
+    async def request(self, method, url, params=None, headers=None, timeout=None, **kwargs):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        query = "&".join(q for q in (parts.query, urllib.parse.urlencode(params or {})) if q)
+        if query:
+            path = f"{path}?{query}"
+        headers = dict(headers or {})
+        body = run.encode_body(kwargs, headers)
+        start = body.tell() if hasattr(body, "tell") else None
+        connect_timeout, read_timeout = run.split_timeout(timeout or self.timeout)
+
+        async with self.slots:
+            conn, reused = await self._checkout(parts, connect_timeout)
+            while True:
+                progress = {"response": False}
+                try:
+                    response, keep = await self._exchange(conn, method, parts, path, headers, body, read_timeout, progress)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError) as err:
+                    conn[1].close()
+                    if not reused:
+                        # A reset before any response on a fresh connection is the
+                        # server refusing it, e.g. a full listen backlog, like a
+                        # failed connect: the request was not processed
+                        refused = isinstance(err, (ConnectionResetError, BrokenPipeError)) and not progress["response"]
+                        raise run.TransportError(f"{method} {parts.netloc} failed: {err}", sent=not refused) from err
+                    # The server dropped an idle keep-alive connection; resend on a fresh one
+                    if start is not None:
+                        body.seek(start)
+                    conn, reused = await self._connect(parts, connect_timeout), False
+                except (OSError, ValueError, asyncio.TimeoutError) as err:
+                    conn[1].close()
+                    raise run.TransportError(f"{method} {parts.netloc} failed: {str(err) or 'timed out'}") from err
+            if keep:
+                self._checkin(parts, conn)
+            else:
+                conn[1].close()
+        return response
+
+    async def aclose(self):
+        idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for _, writer in conns:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+
+class AsyncSlackClient:
+    # send_slack_message, get_message_ts, chat.update and send_files for
+    # asyncio services. Everything comes from the arguments, never from the
+    # environment, and every call shares one connection pool. Rate limits are
+    # booked in run.rate_limiter, so sync and async senders share the buckets
+    def __init__(self, slack_token="", webhook_url="", mode="AUTO", api_url=run.SLACK_API_URL, template=None, transport=None, rate_limiter=None, max_retries=run.HTTP_MAX_RETRIES):
+        self.slack_token = slack_token
+        self.webhook_url = webhook_url
+        self.mode = (mode or "AUTO").upper()
+        self.api_url = api_url.rstrip("/")
+        self.template = template or run.PayloadTemplate(run.GitHubContext(*[""] * len(run.GitHubContext._fields)), minimal="true")
+        self.transport = transport or AsyncTransport()
+        self.rate_limiter = rate_limiter or run.rate_limiter
+        self.max_retries = max_retries
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def api(self, method):
+        return f"{self.api_url}/{method}"
+
+    def headers(self, content_type="application/json"):
+        headers = {"Authorization": f"Bearer {self.slack_token}"}
+        if content_type:
+            headers["Content-Type"] = content_type
+        return headers
+
+    async def request(self, method, url, idempotent=None, channel=None, **kwargs):
+        # run.http_request on the event loop: the same retry and rate limit rules
+        if idempotent is None:
+            idempotent = method.upper() in ("GET", "HEAD")
+        body = kwargs.get("data")
+        rate_keys = run.RateLimiter.keys_for(run.slack_method(url), channel or run.request_channel(url, kwargs))
+        api_method = run.slack_method(url) or urllib.parse.urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            if attempt and hasattr(body, "seek"):
+                body.seek(0)
+            wait = self.rate_limiter.reserve(rate_keys)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await self.transport.request(method, url, **kwargs)
+            except run.TransportError as err:
+                if (err.sent and not idempotent) or attempt == self.max_retries:
+                    raise
+                delay = run.retry_delay(None, attempt)
+                logger.warning(f"{method} {api_method} failed ({err}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            retryable = response.status_code == 429 or (idempotent and response.status_code in run.HTTP_RETRY_STATUSES)
+            if not retryable or attempt == self.max_retries:
+                return response
+            delay = run.retry_delay(response, attempt)
+            logger.warning(f"{method} {api_method} returned {response.status_code}, retrying in {delay:.2f}s")
+            if response.status_code == 429 and rate_keys:
+                # The next reserve() waits out the pause for every sender
+                self.rate_limiter.penalize(rate_keys, delay)
+            else:
+                await asyncio.sleep(delay)
+
+    async def send(self, channel_id, message, status="", title="", title_link="", color="good", author_name="", author_icon="", thread_ts=None, nonce=None):
+        # Returns thread_ts, channel and message_id like send_slack_message.
+        # thread_ts is None when a webhook post could not be found in history
+        nonce = nonce or os.urandom(8).hex()
+        chunks = run.split_message(message)
+        color = run.STATUS_COLORS.get(str(color).lower(), color)
+        body = self.template.render_bytes(status, author_name, author_icon, title, title_link, chunks[0], color, channel_id, thread_ts, nonce=nonce)
+
+        use_token = self.mode == "TOKEN" or (self.mode == "AUTO" and self.slack_token and channel_id)
+        if use_token:
+            url = self.api("chat.postMessage")
+            response = await self.request("POST", url, data=body, headers=self.headers(), channel=channel_id)
+            error = run.slack_api_error(response, "chat.postMessage")
+            if not error:
+                response_data = response.json()
+                result = {"thread_ts": response_data["ts"], "channel": response_data["channel"], "message_id": response_data["ts"]}
+            elif self.mode == "AUTO" and self.webhook_url and response.status_code == 200 and response.json().get("error") in run.TOKEN_FALLBACK_ERRORS:
+                logger.warning(f"{error}, sending through the webhook instead")
+                use_token = False
+            else:
+                raise ValueError(error)
+        if not use_token:
+            if not self.webhook_url:
+                raise ValueError("No webhook URL to send to")
+            url = self.webhook_url
+            posted_at = time.time()
+            response = await self.request("POST", url, data=body, headers={"Content-Type": "application/json"}, channel=channel_id)
+            if response.status_code != 200:
+                raise ValueError(f"Request to Slack returned an error {response.status_code}, response: {response.text}")
+            message_ts = thread_ts
+            if not thread_ts and self.slack_token:
+                try:
+                    message_ts = await self.get_message_ts(
+                        channel_id, author_name, oldest=f"{posted_at - run.HISTORY_WINDOW_SKEW:.6f}", max_polls=run.HISTORY_MAX_POLLS, nonce=nonce
+                    )
+                except (ValueError, run.TransportError) as err:
+                    logger.error(f"Failed to get message ts: {err}")
+            result = {"thread_ts": message_ts, "channel": channel_id, "message_id": message_ts}
+
+        if len(chunks) > 1 and result["thread_ts"]:
+            headers = self.headers() if use_token else {"Content-Type": "application/json"}
+            await self.send_continuations(chunks, url, headers, author_name, author_icon, channel_id, result["thread_ts"], webhook=not use_token)
+        return result
+
+    async def send_continuations(self, chunks, url, headers, author_name, author_icon, channel_id, thread_ts, webhook=False):
+        # One at a time, so the parts keep their order in the thread
+        for index, chunk in enumerate(chunks[1:], 2):
+            body = run.encode_payload(run.Webhook(
+                text=chunk, username=author_name, icon_url=author_icon, icon_emoji=author_icon, channel=channel_id, thread_ts=thread_ts
+            ).to_dict())
+            try:
+                response = await self.request("POST", url, data=body, headers=headers, channel=channel_id)
+                if webhook:
+                    error = f"webhook returned {response.status_code}" if response.status_code != 200 else None
+                else:
+                    error = run.slack_api_error(response, "chat.postMessage")
+            except (run.TransportError, ValueError) as err:
+                error = str(err)
+            if error:
+                logger.warning(f"Unable to post part {index}/{len(chunks)} of the message: {error}")
+                return
+
+    async def history_pages(self, channel_id, oldest=None, latest=None, max_pages=run.HISTORY_MAX_PAGES, include_metadata=False):
+        params = {"channel": channel_id, "limit": run.HISTORY_PAGE_LIMIT}
+        if oldest:
+            params["oldest"] = oldest
+            params["inclusive"] = "true"
+        if latest:
+            params["latest"] = latest
+        if include_metadata:
+            params["include_all_metadata"] = "true"
+        pages = []
+        for _ in range(max_pages):
+            response = await self.request("GET", self.api("conversations.history"), headers=self.headers(None), params=params)
+            error = run.slack_api_error(response, "conversations.history")
+            if error:
+                raise ValueError(error)
+            response_data = response.json()
+            pages.append(response_data.get("messages", []))
+            cursor = (response_data.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+            params["cursor"] = cursor
+        return pages
+
+    async def get_message_ts(self, channel_id, author_name, oldest=None, latest=None, max_pages=run.HISTORY_MAX_PAGES, max_polls=0, nonce=None):
+        normalized_author = run.normalize_text(author_name)
+        seen_messages = False
+        candidate = None
+        delay = run.HISTORY_POLL_BACKOFF
+        pages_left = max_pages
+        for poll in range(max_polls + 1):
+            pages = await self.history_pages(channel_id, oldest, latest, pages_left, include_metadata=bool(nonce))
+            pages_left -= len(pages)
+            for messages in pages:
+                seen_messages = seen_messages or bool(messages)
+                found, candidate = run.match_history_page(messages, normalized_author, nonce, candidate)
+                if found:
+                    return found
+            if candidate:
+                logger.warning(f"Message metadata not found, matched by author instead. Thread TS: {candidate}")
+                return candidate
+            if pages_left <= 0:
+                break
+            if poll < max_polls:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, run.HISTORY_POLL_BACKOFF_MAX)
+
+        if not seen_messages:
+            raise ValueError("No messages found in the channel.")
+        raise ValueError(f"No message found with author: {author_name}")
+
+    async def update(self, channel_id, ts, message, status="", title="", title_link="", color="good", author_name="", author_icon=""):
+        color = run.STATUS_COLORS.get(str(color).lower(), color)
+        payload = self.template.render(status, author_name, author_icon, title, title_link, message, color, channel_id)
+        update = {"channel": channel_id, "ts": ts, "attachments": payload["attachments"]}
+        if payload.get("text"):
+            update["text"] = payload["text"]
+        response = await self.request("POST", self.api("chat.update"), data=run.encode_payload(update), headers=self.headers(), channel=channel_id)
+        error = run.slack_api_error(response, "chat.update")
+        if error:
+            raise ValueError(error)
+        return {"thread_ts": ts, "channel": channel_id, "message_id": ts}
+
+    async def upload_file(self, path):
+        response = await self.request(
+            "POST", self.api("files.getUploadURLExternal"),
+            data={"filename": os.path.basename(path), "length": os.path.getsize(path)}, headers=self.headers(None)
+        )
+        error = run.slack_api_error(response, "files.getUploadURLExternal")
+        if error:
+            raise ValueError(error)
+        upload = response.json()
+        with open(path, "rb") as file:
+            response = await self.request(
+                "POST", upload["upload_url"], data=file, headers={"Content-Type": "application/octet-stream"}, idempotent=True
+            )
+        if response.status_code != 200:
+            raise ValueError(f"Upload of {path} returned {response.status_code}: {response.text}")
+        return {"id": upload["file_id"], "title": os.path.basename(path)}
+
+    async def upload(self, paths, channel_id, thread_ts=None, initial_comment=None):
+        files = await asyncio.gather(*(self.upload_file(path) for path in paths))
+        data = {"files": json.dumps(files), "channel_id": channel_id}
+        if thread_ts:
+            data["thread_ts"] = thread_ts
+        if initial_comment:
+            data["initial_comment"] = initial_comment
+        response = await self.request("POST", self.api("files.completeUploadExternal"), data=data, headers=self.headers(None))
+        error = run.slack_api_error(response, "files.completeUploadExternal")
+        if error:
+            raise ValueError(error)
+        return [file["id"] for file in files]
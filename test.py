@@ -1,14 +1,61 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import run
+import bench
+import run_async
+import asyncio
+import io
 import json
 import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Startup budgets for the notification step, in seconds. They are generous
+# enough for a loaded CI runner and still catch an accidental heavy import
+IMPORT_BUDGET = 0.5
+FIRST_REQUEST_BUDGET = 1.0
+
+
+class LocalSlackHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        LocalSlackHandler.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        body = json.dumps({"ok": True, "channel": payload.get("channel"), "ts": "1234567890.123456"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def local_slack_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalSlackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
 
 
 class TestRun(unittest.TestCase):
 
     @patch('run.get_message_ts')
-    @patch('run.requests.post')
+    @patch('run.http_request')
     def test_send_slack_message(self, mock_post, mock_get_message_ts):
         # Setup mocks
         mock_post.return_value.status_code = 200
@@ -35,7 +82,7 @@ class TestRun(unittest.TestCase):
         self.assertIn("SLACK_CHANNEL=", result)
         self.assertIn("SLACK_MESSAGE_ID=", result)
 
-    @patch('run.requests.post')
+    @patch('run.http_request')
     def test_send_reply_message(self, mock_post):
         mock_post.return_value.status_code = 200
         mock_post.return_value.text = 'ok'
@@ -58,7 +105,7 @@ class TestRun(unittest.TestCase):
         # Verify the result contains the thread_ts
         self.assertIn("SLACK_THREAD_TS=1234567890.123456", result)
 
-    @patch('run.requests.get')
+    @patch('run.http_request')
     def test_get_message_ts(self, mock_get):
         author_name = "GitHub Action"
         mock_get.return_value.status_code = 200
@@ -101,7 +148,7 @@ class TestRun(unittest.TestCase):
 
         self.assertEqual(ts, "1234567890.123456")
 
-    @patch('run.requests.get')
+    @patch('run.http_request')
     def test_get_message_ts_no_match(self, mock_get):
         author_name = "GitHub Action"
         mock_get.return_value.status_code = 200
@@ -133,6 +180,1043 @@ class TestRun(unittest.TestCase):
 
         self.assertEqual(str(context.exception), f"No message found with author: {author_name}")
 
+    @patch('run.http_request')
+    def test_get_message_ts_pages_until_match(self, mock_get):
+        first_page = MagicMock(status_code=200)
+        first_page.json.return_value = {
+            "ok": True,
+            "messages": [{"username": "Someone Else", "ts": "1234567890.222222"}],
+            "response_metadata": {"next_cursor": "dXNlcjpVMDYxTkZUVDI="}
+        }
+        second_page = MagicMock(status_code=200)
+        second_page.json.return_value = {
+            "ok": True,
+            "messages": [{"username": "GitHub Action", "ts": "1234567890.123456"}],
+            "response_metadata": {"next_cursor": "bmV4dA=="}
+        }
+        mock_get.side_effect = [first_page, second_page]
+
+        ts = run.get_message_ts(
+            slack_token="xoxb-1234",
+            channel_id="C12345678",
+            message="Notification from GitHub Action",
+            author_name="GitHub Action",
+            oldest="1234567800.000000"
+        )
+
+        self.assertEqual(ts, "1234567890.123456")
+        self.assertEqual(mock_get.call_count, 2)
+        params = mock_get.call_args.kwargs["params"]
+        self.assertEqual(params["cursor"], "dXNlcjpVMDYxTkZUVDI=")
+        self.assertEqual(params["oldest"], "1234567800.000000")
+
+    @patch('run.time.sleep')
+    @patch('run.http_request')
+    def test_get_message_ts_polls_until_visible(self, mock_get, mock_sleep):
+        empty = MagicMock(status_code=200)
+        empty.json.return_value = {"ok": True, "messages": []}
+        visible = MagicMock(status_code=200)
+        visible.json.return_value = {
+            "ok": True,
+            "messages": [{"username": "GitHub Action", "ts": "1234567890.123456"}]
+        }
+        mock_get.side_effect = [empty, empty, visible]
+
+        ts = run.get_message_ts(
+            slack_token="xoxb-1234",
+            channel_id="C12345678",
+            message="Notification from GitHub Action",
+            author_name="GitHub Action",
+            max_polls=3
+        )
+
+        self.assertEqual(ts, "1234567890.123456")
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [0.25, 0.5])
+
+    @patch('run.http_request')
+    def test_get_message_ts_stops_at_page_cap(self, mock_get):
+        page = MagicMock(status_code=200)
+        page.json.return_value = {
+            "ok": True,
+            "messages": [{"username": "Someone Else", "ts": "1234567890.222222"}],
+            "response_metadata": {"next_cursor": "bmV4dA=="}
+        }
+        mock_get.return_value = page
+
+        with self.assertRaises(ValueError):
+            run.get_message_ts(
+                slack_token="xoxb-1234",
+                channel_id="C12345678",
+                message="Notification from GitHub Action",
+                author_name="GitHub Action",
+                max_pages=3
+            )
+
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('run.time.sleep')
+    @patch('run.http_request')
+    def test_get_message_ts_page_cap_spans_polls(self, mock_get, mock_sleep):
+        first_page = MagicMock(status_code=200)
+        first_page.json.return_value = {
+            "ok": True,
+            "messages": [{"username": "Someone Else", "ts": "1234567890.222222"}],
+            "response_metadata": {"next_cursor": "bmV4dA=="}
+        }
+        last_page = MagicMock(status_code=200)
+        last_page.json.return_value = {"ok": True, "messages": [{"username": "Someone Else", "ts": "1234567890.111111"}]}
+        mock_get.side_effect = [first_page, last_page] * 10
+
+        with self.assertRaises(ValueError):
+            run.get_message_ts(
+                slack_token="xoxb-1234",
+                channel_id="C12345678",
+                message="Notification from GitHub Action",
+                author_name="GitHub Action",
+                max_pages=5,
+                max_polls=4
+            )
+
+        self.assertEqual(mock_get.call_count, 5)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('run.time.sleep')
+    @patch('run.http_request')
+    def test_post_message_checks_nonce_before_posting_again(self, mock_request, mock_sleep):
+        unavailable = MagicMock(status_code=503, text="unavailable", headers={})
+        empty = MagicMock(status_code=200)
+        empty.json.return_value = {"ok": True, "messages": []}
+        posted = MagicMock(status_code=200)
+        posted.json.return_value = {"ok": True, "messages": [{
+            "ts": "1234567890.123456", "metadata": {"event_type": run.METADATA_EVENT_TYPE, "event_payload": {"nonce": "abc"}}
+        }]}
+        mock_request.side_effect = [unavailable, empty, unavailable, posted]
+
+        response = run.post_message(run.slack_api("chat.postMessage"), b"{}", {}, "C12345678", "xoxb-1234", "abc", None)
+
+        self.assertEqual(response.json()["ts"], "1234567890.123456")
+        self.assertEqual([c.args[0] for c in mock_request.call_args_list], ["POST", "GET", "POST", "GET"])
+
+        # Without a token there is no way to tell, so the post is not repeated
+        mock_request.side_effect = [unavailable]
+        self.assertEqual(run.post_message(run.slack_api("chat.postMessage"), b"{}", {}, "C12345678", "", "abc", None).status_code, 503)
+
+    def test_thread_registry_round_trip_and_ttl(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "threads.json")
+            with patch.dict('os.environ', {'GITHUB_REPOSITORY': 'rennf93/good-comms', 'GITHUB_RUN_ID': '42'}):
+                registry = run.ThreadRegistry(path, ttl=60)
+                self.assertIsNone(registry.lookup("C12345678", "GitHub Action"))
+
+                registry.record("C12345678", "GitHub Action", "1234567890.123456", "C12345678")
+                self.assertEqual(registry.lookup("C12345678", "github action"), "1234567890.123456")
+                self.assertIsNone(registry.lookup("C87654321", "GitHub Action"))
+
+                with patch('run.time.time', return_value=time.time() + 120):
+                    self.assertIsNone(registry.lookup("C12345678", "GitHub Action"))
+
+    @patch('run.get_message_ts')
+    @patch('run.http_request')
+    def test_send_slack_message_uses_thread_registry(self, mock_post, mock_get_message_ts):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.text = 'ok'
+        mock_get_message_ts.return_value = "1234567890.123456"
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            registry = run.ThreadRegistry(os.path.join(tmp_dir, "threads.json"))
+            kwargs = dict(
+                webhook_url="http://example.com",
+                status="success",
+                author_name="GitHub Action",
+                author_link="",
+                author_icon="",
+                title="Build Notification",
+                title_link="",
+                message="Notification from GitHub Action",
+                color="#36a64f",
+                slack_token="xoxb-1234",
+                channel_id="C12345678",
+                registry=registry
+            )
+            run.send_slack_message(**kwargs)
+            result = run.send_slack_message(**kwargs)
+
+        # Second message threads under the first without another history lookup
+        mock_get_message_ts.assert_called_once()
+        self.assertEqual(json.loads(mock_post.call_args.kwargs["data"])["thread_ts"], "1234567890.123456")
+        self.assertIn("SLACK_THREAD_TS=1234567890.123456", result)
+
+    @patch('run.time.sleep')
+    @patch('run.get_transport')
+    def test_http_request_honours_retry_after(self, mock_get_transport, mock_sleep):
+        limited = MagicMock(status_code=429, headers={"Retry-After": "3"})
+        ok = MagicMock(status_code=200, headers={})
+        mock_get_transport.return_value.request.side_effect = [limited, ok]
+
+        response = run.http_request("POST", "https://slack.com/api/chat.postMessage", json={})
+
+        self.assertIs(response, ok)
+        # The retry waits in the rate limiter, which parks the channel bucket
+        mock_sleep.assert_called_once()
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 3.0, places=1)
+
+    @patch('run.time.sleep')
+    @patch('run.get_transport')
+    def test_http_request_retries_server_errors_only_when_idempotent(self, mock_get_transport, mock_sleep):
+        unavailable = MagicMock(status_code=503, headers={})
+        ok = MagicMock(status_code=200, headers={})
+        session = mock_get_transport.return_value
+
+        session.request.side_effect = [unavailable, ok]
+        self.assertIs(run.http_request("POST", "https://slack.com/api/chat.postMessage", json={}), unavailable)
+
+        session.request.side_effect = [unavailable, ok]
+        self.assertIs(run.http_request("GET", "https://slack.com/api/conversations.history"), ok)
+        self.assertEqual(session.request.call_count, 3)
+
+    @patch('run.time.sleep')
+    def test_rate_limiter_queues_per_channel_and_tier(self, mock_sleep):
+        clock = MagicMock(return_value=100.0)
+        limiter = run.RateLimiter(clock=clock)
+        channel_keys = run.RateLimiter.keys_for("chat.postMessage", "C12345678")
+
+        waits = [limiter.acquire(channel_keys) for _ in range(5)]
+        self.assertEqual(waits, [0.0, 0.0, 0.0, 1.0, 2.0])
+        self.assertEqual(limiter.acquire(run.RateLimiter.keys_for("chat.postMessage", "C87654321")), 0.0)
+
+        history_keys = run.RateLimiter.keys_for("conversations.history", "C12345678")
+        limiter.penalize(history_keys, 30)
+        self.assertEqual(limiter.acquire(history_keys), 30.0)
+
+        stats = limiter.snapshot()
+        self.assertEqual(stats["chat.postMessage:C12345678"]["requests"], 5)
+        self.assertEqual(stats["chat.postMessage:C12345678"]["waited"], 3.0)
+        self.assertEqual(stats["conversations.history"]["throttled"], 1)
+        self.assertEqual(run.RateLimiter.keys_for("", "C12345678"), [])
+
+    def test_custom_payload_keeps_webhook_url_out_of_rate_limit_keys(self):
+        webhook = "https://hooks.slack.com/services/T000/B000/SECRET"
+        self.assertNotIn("SECRET", run.request_channel(webhook, {"data": b"{}"}))
+        with patch.dict('os.environ', {'SLACK_WEBHOOK': webhook, 'CHANNEL_ID': 'C12345678', 'SLACK_CUSTOM_PAYLOAD': '{"text": "hi"}'}), \
+                patch('run.http_request', return_value=MagicMock(status_code=200)) as mock_request:
+            run.main()
+        self.assertEqual(mock_request.call_args.kwargs["channel"], "C12345678")
+
+    def test_get_transport_is_shared(self):
+        self.assertIs(run.get_transport(), run.get_transport())
+
+    @patch('run.send_slack_message')
+    def test_run_batch_keeps_thread_order(self, mock_send_slack_message):
+        def fake_send(**kwargs):
+            ts = kwargs["thread_ts"] or "1111111111.000000"
+            if kwargs["message"] == "broken":
+                return "Request to Slack returned an error 400, response: invalid_payload"
+            return f"SLACK_THREAD_TS={ts}\nSLACK_CHANNEL={kwargs['channel_id']}\nSLACK_MESSAGE_ID={ts}\n"
+
+        mock_send_slack_message.side_effect = fake_send
+        specs = [
+            {"message": "deploy started", "thread": "deploy"},
+            {"message": "api deployed", "thread": "deploy"},
+            {"message": "broken"},
+            {"message": "web deployed", "thread": "deploy"},
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = os.path.join(tmp_dir, "spool.jsonl")
+            output = os.path.join(tmp_dir, "results.jsonl")
+            with open(spool, "w") as f:
+                f.write("\n".join(json.dumps(spec) for spec in specs) + "\nnot json\n")
+            with patch.dict('os.environ', {'SLACK_WEBHOOK': 'http://example.com', 'CHANNEL_ID': 'C12345678'}):
+                exit_code = run.run_batch(spool, concurrency=3, output=output)
+            with open(output) as f:
+                results = [json.loads(line) for line in f]
+
+        self.assertEqual(exit_code, 1)
+        self.assertEqual([r["line"] for r in results], [1, 2, 3, 4, 5])
+        self.assertEqual([r["ok"] for r in results], [True, True, False, True, False])
+        self.assertEqual(results[1]["SLACK_CHANNEL"], "C12345678")
+
+        deploy_calls = [c.kwargs for c in mock_send_slack_message.call_args_list if c.kwargs["message"] != "broken"]
+        self.assertEqual([c["message"] for c in deploy_calls], ["deploy started", "api deployed", "web deployed"])
+        self.assertEqual([c["thread_ts"] for c in deploy_calls], [None, "1111111111.000000", "1111111111.000000"])
+        self.assertFalse(any(c.kwargs["write_env"] for c in mock_send_slack_message.call_args_list))
+
+    @patch('run.http_request')
+    def test_send_files_streams_uploads_and_completes_once(self, mock_request):
+        uploaded = {}
+
+        def fake_request(method, url, **kwargs):
+            response = MagicMock(status_code=200)
+            if url.endswith("files.getUploadURLExternal"):
+                name = kwargs["data"]["filename"]
+                response.json.return_value = {"ok": True, "upload_url": f"https://files.example.com/{name}", "file_id": f"F_{name}"}
+            elif url.startswith("https://files.example.com/"):
+                # The file handle is passed through, not its contents
+                self.assertTrue(hasattr(kwargs["data"], "read"))
+                uploaded[url] = kwargs["data"].read()
+            else:
+                response.json.return_value = {"ok": True, "files": []}
+            return response
+
+        mock_request.side_effect = fake_request
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for name in ("build.log", "report.xml"):
+                paths.append(os.path.join(tmp_dir, name))
+                with open(paths[-1], "wb") as f:
+                    f.write(name.encode() * 100)
+
+            file_ids = run.send_files(paths, "xoxb-1234", "C12345678", thread_ts="1234567890.123456")
+
+        self.assertEqual(file_ids, ["F_build.log", "F_report.xml"])
+        self.assertEqual(uploaded["https://files.example.com/report.xml"], b"report.xml" * 100)
+        complete_calls = [c for c in mock_request.call_args_list if c.args[1].endswith("files.completeUploadExternal")]
+        self.assertEqual(len(complete_calls), 1)
+        data = complete_calls[0].kwargs["data"]
+        self.assertEqual(data["thread_ts"], "1234567890.123456")
+        self.assertEqual([f["id"] for f in json.loads(data["files"])], ["F_build.log", "F_report.xml"])
+
+    def test_stdlib_transport_reuses_connection(self):
+        server = local_slack_server()
+        try:
+            LocalSlackHandler.connections = 0
+            transport = run.StdlibTransport()
+            url = f"http://127.0.0.1:{server.server_port}/api/chat.postMessage"
+            for _ in range(3):
+                response = transport.request("POST", url, json={"channel": "C12345678"}, headers={})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["channel"], "C12345678")
+            self.assertEqual(LocalSlackHandler.connections, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_startup_budget(self):
+        server = local_slack_server()
+        script = (
+            "import logging, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import run\n"
+            "imported = time.perf_counter() - start\n"
+            "response = run.http_request('POST', sys.argv[1], json={'channel': 'C12345678'})\n"
+            "assert response.status_code == 200\n"
+            "print(imported, time.perf_counter() - start, 'requests' in sys.modules, bool(logging.getLogger().handlers))\n"
+        )
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/api/chat.postMessage"
+            env = dict(os.environ, HTTP_BACKEND="auto")
+            for proxy in ("HTTPS_PROXY", "https_proxy", "HTTP_PROXY", "http_proxy"):
+                env.pop(proxy, None)
+            output = subprocess.run(
+                [sys.executable, "-c", script, url], cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.split()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        import_time, first_request_time, requests_imported = float(output[0]), float(output[1]), output[2]
+        self.assertEqual(requests_imported, "False")
+        # Importing run must not configure the host's logging
+        self.assertEqual(output[3], "False")
+        self.assertLess(import_time, IMPORT_BUDGET)
+        self.assertLess(first_request_time, FIRST_REQUEST_BUDGET)
+
+    def test_payload_template_renders_from_one_context_snapshot(self):
+        env = {
+            'GITHUB_SERVER_URL': 'https://github.com',
+            'GITHUB_REPOSITORY': 'rennf93/good-comms',
+            'GITHUB_SHA': 'abcdef1234567890',
+            'GITHUB_WORKFLOW': 'CI',
+            'GITHUB_REF': 'refs/heads/master',
+            'GITHUB_EVENT_NAME': 'push',
+            'GITHUB_ACTOR': 'octocat'
+        }
+        with patch.dict('os.environ', env):
+            template = run.PayloadTemplate.from_env()
+        with patch('run.get_env') as mock_get_env:
+            first = template.render("success", "GitHub Action", "", "Build", "", "first", "good", "C12345678")
+            second = json.loads(template.render_bytes("failure", "GitHub Action", "", "Build", "", "second", "danger", "C12345678", "1234567890.123456"))
+            mock_get_env.assert_not_called()
+
+        fields = {field["title"]: field["value"] for field in first["attachments"][0]["fields"]}
+        self.assertEqual(fields["Commit"], "<https://github.com/rennf93/good-comms/commit/abcdef1234567890|abcdef>")
+        self.assertEqual(fields["Message"], "first")
+        self.assertEqual(first["attachments"][0]["author_icon"], "https://github.com/octocat.png?size=32")
+        self.assertNotIn("thread_ts", first)
+        self.assertEqual(second["thread_ts"], "1234567890.123456")
+        self.assertEqual(second["attachments"][0]["color"], "danger")
+
+    def test_payload_template_minimal_and_blocks(self):
+        context = run.GitHubContext("https://github.com", "o/r", "abcdef123456", "CI", "refs/heads/main", "push", "octocat", "1", "1")
+
+        minimal = run.PayloadTemplate(context, minimal="ref,commit").render("success", "A", "", "T", "", "hello", "good", "C1")
+        self.assertEqual([f["title"] for f in minimal["attachments"][0]["fields"]], ["Ref", "Commit", "Message"])
+
+        blocks = run.PayloadTemplate(context, style="blocks").render("success", "A", "", "T", "https://x", "hello", "good", "C1")
+        attachment = blocks["attachments"][0]
+        self.assertEqual(attachment["color"], "good")
+        self.assertEqual(attachment["blocks"][0]["text"]["text"], "*<https://x|T>*\nhello")
+        self.assertLessEqual(len(attachment["blocks"][1]["fields"]), 10)
+        self.assertFalse(hasattr(run.Field(), "__dict__"))
+
+    @patch('run.http_request')
+    def test_status_message_edits_in_place(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {"ok": True, "ts": "1234567890.123456", "channel": "C12345678"}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = run.JsonStore(os.path.join(tmp_dir, "status.json"))
+
+            def stage(text):
+                status = run.StatusMessage("xoxb-1234", "C12345678", store, "key", window=0, write_env=False)
+                return status.update({"channel": "C12345678", "attachments": [{"text": text}]})
+
+            first = stage("building")
+            stage("building")
+            third = stage("deployed")
+
+        urls = [c.args[1] for c in mock_request.call_args_list]
+        self.assertEqual(urls, ["https://slack.com/api/chat.postMessage", "https://slack.com/api/chat.update"])
+        update = json.loads(mock_request.call_args.kwargs["data"])
+        self.assertEqual(update["ts"], "1234567890.123456")
+        self.assertEqual(update["attachments"], [{"text": "deployed"}])
+        self.assertEqual(first, third)
+
+    @patch('run.http_request')
+    def test_status_message_coalesces_updates(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {"ok": True, "ts": "1234567890.123456", "channel": "C12345678"}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = run.JsonStore(os.path.join(tmp_dir, "status.json"))
+            status = run.StatusMessage("xoxb-1234", "C12345678", store, "key", window=60, write_env=False)
+            for text in ("start", "build", "test"):
+                self.assertIsNone(status.update({"channel": "C12345678", "attachments": [{"text": text}]}))
+            result = status.close()
+
+        mock_request.assert_called_once()
+        self.assertEqual(json.loads(mock_request.call_args.kwargs["data"])["attachments"], [{"text": "test"}])
+        self.assertIn("SLACK_MESSAGE_ID=1234567890.123456", result)
+        self.assertEqual(status.counts["coalesced"], 2)
+
+    @patch('run.send_slack_message')
+    def test_digest_aggregates_matrix_legs(self, mock_send_slack_message):
+        mock_send_slack_message.return_value = "SLACK_THREAD_TS=1234567890.123456\nSLACK_CHANNEL=C12345678\nSLACK_MESSAGE_ID=1234567890.123456\n"
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run.record_digest(tmp_dir, "linux-3.12", run.digest_status("success"), "ok")
+            run.record_digest(tmp_dir, "macos/3.12", run.digest_status("#36a64f", "Failed"), "3 tests failed")
+            run.record_digest(tmp_dir, "windows-3.12", run.digest_status("cancelled"), "")
+            with patch.dict('os.environ', {'CHANNEL_ID': 'C12345678'}):
+                template = run.PayloadTemplate(run.GitHubContext.from_env())
+                result = run.send_digest(tmp_dir, "http://example.com", template, failure_details=True)
+
+        self.assertIn("SLACK_THREAD_TS=1234567890.123456", result)
+        self.assertEqual(mock_send_slack_message.call_count, 2)
+        digest = mock_send_slack_message.call_args_list[0].kwargs
+        self.assertEqual(digest["color"], "danger")
+        self.assertEqual(digest["message"], "3 jobs: 1 succeeded, 1 failed, 1 cancelled")
+        self.assertEqual([f["title"] for f in digest["extra_fields"]], ["linux-3.12", "macos/3.12", "windows-3.12"])
+        details = mock_send_slack_message.call_args_list[1].kwargs
+        self.assertEqual(details["thread_ts"], "1234567890.123456")
+        self.assertEqual(details["message"], "3 tests failed")
+
+    def test_digest_blocks_show_every_leg(self):
+        records = [{"leg": f"leg-{i}", "status": "failure" if i == 39 else "success"} for i in range(40)]
+        overall, fields, summary = run.summarize_digests(records)
+        template = run.PayloadTemplate(run.GitHubContext.from_env(), style="blocks")
+        blocks = template.render(overall, "A", "", "Digest", "", summary, "danger", "C1", extra_fields=fields)["attachments"][0]["blocks"]
+        sections = [block["fields"] for block in blocks if "fields" in block]
+        self.assertTrue(all(len(section) <= 10 for section in sections))
+        legs = [field["text"] for section in sections for field in section if field["text"].startswith("*leg-")]
+        self.assertEqual(len(legs), 40)
+        self.assertIn("*leg-39*\n:x: failure", legs)
+
+    def test_send_slack_message_against_local_stand_in(self):
+        with bench.FakeSlack(visibility_delay=0.1) as fake, patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api"}):
+            fake.seed("C12345678", 150)
+            kwargs = bench.send_kwargs(f"{fake.url}/services/T000/B000/XXXX", "C12345678")
+            result = run.send_slack_message(**kwargs)
+
+            posted = [m for m in fake.messages if m["username"] == "Benchmark"]
+            self.assertIn(f"SLACK_THREAD_TS={posted[0]['ts']}", result)
+            self.assertGreater(fake.requests["conversations.history"], 1)
+
+            kwargs["webhook_url"] = run.slack_api("chat.postMessage")
+            result = run.send_slack_message(**kwargs)
+            self.assertIn(f"SLACK_THREAD_TS={fake.messages[-1]['ts']}", result)
+
+    def test_hybrid_mode_posts_with_token_and_tags_metadata(self):
+        with bench.FakeSlack() as fake, patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api", 'GITHUB_RUN_ID': '42', 'GITHUB_SHA': 'abc123'}):
+            webhook_url = f"{fake.url}/services/T000/B000/XXXX"
+            endpoint, fallback_url = run.resolve_endpoint(webhook_url, "xoxb-1234", "C12345678")
+            self.assertEqual((endpoint, fallback_url), (run.slack_api("chat.postMessage"), webhook_url))
+            self.assertEqual(run.resolve_endpoint(webhook_url, "", "C12345678"), (webhook_url, None))
+            self.assertEqual(run.resolve_endpoint(webhook_url, "xoxb-1234", "C12345678", "WEBHOOK"), (webhook_url, None))
+
+            kwargs = bench.send_kwargs(endpoint, "C12345678")
+            result = run.send_slack_message(fallback_url=fallback_url, **kwargs)
+
+            self.assertIn(f"SLACK_THREAD_TS={fake.messages[-1]['ts']}", result)
+            self.assertEqual(fake.requests, {"chat.postMessage": 1})
+            metadata = fake.messages[-1]["metadata"]
+            self.assertEqual(metadata["event_type"], run.METADATA_EVENT_TYPE)
+            self.assertEqual((metadata["event_payload"]["run_id"], metadata["event_payload"]["sha"]), ("42", "abc123"))
+
+    @patch('run.get_message_ts', return_value="1234567890.123456")
+    @patch('run.http_request')
+    def test_hybrid_mode_falls_back_to_webhook(self, mock_request, mock_get_message_ts):
+        mock_request.side_effect = [
+            MagicMock(status_code=200, text='{"ok":false,"error":"not_in_channel"}', json=lambda: {"ok": False, "error": "not_in_channel"}),
+            MagicMock(status_code=200, text="ok")
+        ]
+        kwargs = bench.send_kwargs(run.slack_api("chat.postMessage"), "C12345678")
+        result = run.send_slack_message(fallback_url="https://hooks.slack.com/services/T000/B000/XXXX", **kwargs)
+
+        self.assertIn("SLACK_THREAD_TS=1234567890.123456", result)
+        self.assertEqual(mock_request.call_args_list[1].args[1], "https://hooks.slack.com/services/T000/B000/XXXX")
+        self.assertNotIn("Authorization", mock_request.call_args_list[1].kwargs["headers"])
+
+    @patch('run.http_request')
+    def test_get_message_ts_matches_metadata_nonce(self, mock_get):
+        def tagged(ts, nonce):
+            return {"ts": ts, "username": "GitHub Action", "metadata": {"event_type": run.METADATA_EVENT_TYPE, "event_payload": {"nonce": nonce}}}
+
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: {"ok": True, "messages": [
+            tagged("3.000000", "other"), {"ts": "2.000000", "username": "GitHub Action"}, tagged("1.000000", "mine")
+        ]})
+        self.assertEqual(run.get_message_ts("xoxb", "C1", "", "GitHub Action", nonce="mine"), "1.000000")
+        self.assertEqual(mock_get.call_args.kwargs["params"]["include_all_metadata"], "true")
+        # Without our tag in the window the untagged author match is used
+        self.assertEqual(run.get_message_ts("xoxb", "C1", "", "GitHub Action", nonce="missing"), "2.000000")
+
+    def test_notifier_daemon_keeps_threads_and_flushes_on_shutdown(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake.url}/api",
+            'SLACK_WEBHOOK': f"{fake.url}/services/T000/B000/XXXX",
+            'GOOD_COMMS_STATE_DIR': tmp_dir,
+            'SLACK_TOKEN': 'xoxb-1234',
+            'CHANNEL_ID': 'C12345678',
+            'AUTHOR_NAME': 'Daemon',
+            'SLACK_MESSAGE': 'Notification from GitHub Action'
+        }):
+            socket_path = os.path.join(tmp_dir, 'notifier.sock')
+            daemon = run.NotifierDaemon()
+            server = threading.Thread(target=daemon.serve, args=(socket_path,))
+            server.start()
+            deadline = time.monotonic() + 5
+            while not os.path.exists(socket_path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            first = run.daemon_request({"op": "send", "spec": {"thread": "deploy", "message": "started"}}, socket_path=socket_path)
+            second = run.daemon_request({"op": "send", "spec": {"thread": "deploy", "message": "finished"}}, socket_path=socket_path)
+            self.assertTrue(first["ok"] and second["ok"])
+            self.assertEqual(fake.messages[-1]["thread_ts"], first["SLACK_THREAD_TS"])
+
+            posted = run.daemon_request({"op": "status", "spec": {"message": "running"}}, socket_path=socket_path)
+            queued = run.daemon_request({"op": "status", "spec": {"message": "done"}}, socket_path=socket_path)
+            self.assertTrue(queued["queued"])
+            self.assertEqual(queued["SLACK_THREAD_TS"], posted["SLACK_THREAD_TS"])
+            self.assertNotIn("chat.update", fake.requests)
+
+            self.assertTrue(run.daemon_request({"op": "shutdown"}, socket_path=socket_path)["ok"])
+            server.join(5)
+            self.assertFalse(server.is_alive())
+            self.assertEqual(fake.requests["chat.update"], 1)
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_retry_spool_backoff_dedupe_and_compaction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool = run.RetrySpool(os.path.join(tmp_dir, 'spool.jsonl'), max_attempts=3, backoff=60, compact_bytes=0)
+            payload = {"channel": "C1", "attachments": []}
+            self.assertTrue(spool.add("key-1", "webhook", "C1", payload, "503"))
+            self.assertFalse(spool.add("key-1", "webhook", "C1", payload, "503"))
+            self.assertTrue(spool.add("key-2", "chat.postMessage", "C1", payload, "503"))
+
+            send = MagicMock(return_value=("failed", "503", True))
+            self.assertEqual(spool.replay(send)["waiting"], 2)
+            send.assert_not_called()
+
+            counts = spool.replay(send, force=True)
+            self.assertEqual(counts["failed"], 2)
+            entry = {e["key"]: e for e in spool.pending()}["key-1"]
+            self.assertEqual(entry["attempts"], 2)
+            self.assertGreater(entry["next_at"], time.time() + 50)
+
+            send.side_effect = lambda entry: ("sent", "", False) if entry["key"] == "key-1" else ("failed", "503", True)
+            spool.replay(send, force=True)
+            counts = spool.replay(send, force=True)
+            self.assertEqual(counts["dropped"], 1)
+            self.assertEqual(spool.pending(), [])
+            # Tombstones survive compaction, so a replayed duplicate stays out
+            self.assertFalse(spool.add("key-1", "webhook", "C1", payload, "503"))
+
+            with open(spool.path) as spool_file:
+                self.assertEqual(len(spool_file.readlines()), 2)
+            with open(spool.path, "a") as spool_file:
+                spool_file.write('{"op": "add", "key": "torn"')
+            self.assertEqual(spool.pending(), [])
+
+    def test_spooled_message_replays_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake.url}/api",
+            'SLACK_WEBHOOK': f"{fake.url}/services/T000/B000/XXXX",
+            'SLACK_TOKEN': 'xoxb-1234',
+            'CHANNEL_ID': 'C12345678',
+            'STATUS': 'success',
+            'AUTHOR_NAME': 'Spool',
+            'SLACK_MESSAGE': 'Deployed',
+            'MSG_MODE': 'WEBHOOK',
+            'RETRY_SPOOL': 'true',
+            'RETRY_SPOOL_PATH': os.path.join(tmp_dir, 'spool.jsonl'),
+            'GITHUB_RUN_ID': '42'
+        }):
+            with patch('run.http_request', return_value=MagicMock(status_code=503, text="unavailable")):
+                run.main()
+            entry = run.RetrySpool.from_env().pending()[0]
+            self.assertTrue(entry["ambiguous"])
+            self.assertNotIn("xoxb-1234", json.dumps(entry))
+
+            # Slack did post it before failing: replay finds it by nonce
+            fake.post("C12345678", "Spool", metadata=entry["payload"]["metadata"])
+            counts = run.RetrySpool.from_env().replay(run.replay_entry, force=True)
+            self.assertEqual(counts["deduped"], 1)
+            self.assertNotIn("webhook", fake.requests)
+
+            with patch.dict('os.environ', {'RETRY_SPOOL': 'false'}), \
+                    patch('run.http_request', return_value=MagicMock(status_code=503, text="unavailable")):
+                with self.assertRaises(SystemExit) as exit_info:
+                    run.main()
+                self.assertEqual(exit_info.exception.code, 1)
+
+    def test_spooled_fan_out_replays_to_each_destination(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake_a, bench.FakeSlack() as fake_b, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake_a.url}/api",
+            'SLACK_WEBHOOK': f"{fake_a.url}/services/T000/B000/AAAA\n{fake_b.url}/services/T000/B000/BBBB",
+            'SLACK_TOKEN': 'xoxb-a\nxoxb-b',
+            'CHANNEL_ID': 'C00000001\nC00000002',
+            'STATUS': 'success',
+            'AUTHOR_NAME': 'Spool',
+            'SLACK_MESSAGE': 'Deployed',
+            'MSG_MODE': 'WEBHOOK',
+            'RETRY_SPOOL': 'true',
+            'RETRY_SPOOL_PATH': os.path.join(tmp_dir, 'spool.jsonl'),
+            'GITHUB_RUN_ID': '42'
+        }):
+            with patch('run.http_request', return_value=MagicMock(status_code=503, text="unavailable")):
+                run.main()
+            pending = run.RetrySpool.from_env().pending()
+            self.assertEqual(len(pending), 2)
+            self.assertNotIn("xoxb-", json.dumps(pending))
+            self.assertNotIn("/services/", json.dumps(pending))
+
+            counts = run.RetrySpool.from_env().replay(run.replay_entry, force=True)
+            self.assertEqual(counts["sent"], 2)
+            self.assertEqual([m["channel"] for m in fake_a.messages], ["C00000001"])
+            self.assertEqual([m["channel"] for m in fake_b.messages], ["C00000002"])
+
+            # A destination that is no longer configured fails its entry only
+            with patch.dict('os.environ', {'GITHUB_RUN_ID': '43'}), \
+                    patch('run.http_request', return_value=MagicMock(status_code=503, text="unavailable")):
+                run.main()
+            with patch.dict('os.environ', {'SLACK_WEBHOOK': f"{fake_a.url}/services/T000/B000/AAAA", 'CHANNEL_ID': 'C00000001,C00000002'}):
+                counts = run.RetrySpool.from_env().replay(run.replay_entry, force=True)
+            self.assertEqual((counts["sent"], counts["failed"]), (1, 1))
+
+    def test_split_message_keeps_code_blocks_balanced(self):
+        self.assertEqual(run.split_message("short"), ["short"])
+        lines = [f"step {i} " + "x" * 80 for i in range(200)]
+        text = "Build failed\n" + run.format_code_block("\n".join(lines)) + "\ndone"
+        chunks = run.split_message(text)
+
+        self.assertLessEqual(len(chunks[0]), run.MESSAGE_FIRST_CHUNK_CHARS)
+        self.assertTrue(all(len(chunk) <= run.MESSAGE_CHUNK_CHARS for chunk in chunks))
+        self.assertTrue(all(chunk.count("```") % 2 == 0 for chunk in chunks))
+        body = [line for chunk in chunks for line in chunk.split("\n") if line.startswith("step")]
+        self.assertEqual(body, lines)
+
+    def test_read_log_tail_reads_from_the_end(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'build.log')
+            with open(path, 'wb') as log_file:
+                # Mostly a sparse hole: reading it all would take seconds
+                log_file.truncate(2 * 1024 ** 3)
+                log_file.seek(0, os.SEEK_END)
+                log_file.write(b"".join(b"\x1b[31mline %d\x1b[0m\n" % i for i in range(1000)))
+
+            with patch('builtins.open', wraps=open) as mock_open:
+                self.assertEqual(run.read_log_tail(path, lines=3), "line 997\nline 998\nline 999")
+            tail = run.read_log_tail(path, lines=1000, max_bytes=64)
+            self.assertTrue(tail.startswith("line 99") and tail.endswith("line 999"))
+            self.assertLessEqual(len(tail), 64)
+            mock_open.assert_called_once()
+
+            # A log that fits in one read is still cut to the last lines
+            small = os.path.join(tmp_dir, 'small.log')
+            with open(small, 'wb') as log_file:
+                log_file.write(b"".join(b"line %d\n" % i for i in range(200)))
+            self.assertEqual(run.read_log_tail(small, lines=5), "\n".join(f"line {i}" for i in range(195, 200)))
+            self.assertEqual(run.read_log_tail(small, lines=500), "\n".join(f"line {i}" for i in range(200)))
+
+    def test_long_message_continues_in_thread(self):
+        with bench.FakeSlack() as fake, patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api"}):
+            # Three parts fit in the per-channel burst, so the test never waits
+            message = "\n".join(f"test {i} failed: " + "y" * 100 for i in range(55))
+            kwargs = bench.send_kwargs(run.slack_api("chat.postMessage"), "C12345678", message=message)
+            result = run.send_slack_message(**kwargs)
+
+            parent = fake.messages[0]["ts"]
+            self.assertIn(f"SLACK_THREAD_TS={parent}", result)
+            self.assertEqual(len(fake.messages), len(run.split_message(message)))
+            self.assertTrue(all(m["thread_ts"] == parent for m in fake.messages[1:]))
+
+    def test_fan_out_sends_to_every_destination_concurrently(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack(latency=0.3) as fake, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake.url}/api",
+            'SLACK_WEBHOOK': f"{fake.url}/services/T000/B000/XXXX",
+            'SLACK_TOKEN': 'xoxb-1234',
+            'CHANNEL_ID': 'C00000001\nC00000002, C00000003',
+            'STATUS': 'success',
+            'AUTHOR_NAME': 'Release',
+            'SLACK_MESSAGE': 'v1.2.3 deployed',
+            'GITHUB_ENV': os.path.join(tmp_dir, 'env')
+        }), patch('sys.stdout.write') as mock_write:
+            start = time.perf_counter()
+            run.main()
+            elapsed = time.perf_counter() - start
+
+            self.assertLess(elapsed, 0.8)
+            self.assertEqual(sorted(m["channel"] for m in fake.messages), ["C00000001", "C00000002", "C00000003"])
+            output = "".join(call.args[0] for call in mock_write.call_args_list)
+            values = run.parse_result(output)
+            for index, channel in enumerate(["C00000001", "C00000002", "C00000003"], 1):
+                self.assertEqual(values[f"SLACK_CHANNEL_{index}"], channel)
+                self.assertEqual(values[f"SLACK_THREAD_TS_{index}"], next(m["ts"] for m in fake.messages if m["channel"] == channel))
+            self.assertEqual(values["SLACK_CHANNEL"], "C00000001,C00000002,C00000003")
+            with open(os.path.join(tmp_dir, 'env')) as env_file:
+                self.assertEqual(env_file.read(), output.rstrip("\n") + "\n")
+
+            with patch.dict('os.environ', {'SLACK_TOKEN': 'xoxb-1,xoxb-2'}):
+                with self.assertRaises(ValueError):
+                    run.destinations_from_env()
+
+    def test_fan_out_threads_follow_up_step_per_destination(self):
+        channels = ["C00000001", "C00000002"]
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake.url}/api",
+            'SLACK_WEBHOOK': f"{fake.url}/services/T000/B000/XXXX",
+            'SLACK_TOKEN': 'xoxb-1234',
+            'CHANNEL_ID': ",".join(channels),
+            'STATUS': 'success',
+            'SLACK_MESSAGE': 'deploying',
+            'GITHUB_ENV': os.path.join(tmp_dir, 'env')
+        }), patch('sys.stdout.write'):
+            run.main()
+            with open(os.path.join(tmp_dir, 'env')) as env_file:
+                values = run.parse_result(env_file.read())
+            parents = {m["channel"]: m["ts"] for m in fake.messages}
+            self.assertEqual(values["SLACK_CHANNEL"], ",".join(channels))
+            self.assertEqual(values["SLACK_THREAD_TS"], ",".join(parents[channel] for channel in channels))
+
+            with patch.dict('os.environ', {'SLACK_THREAD_TS': values["SLACK_THREAD_TS"], 'SLACK_MESSAGE': 'deployed'}):
+                run.main()
+            replies = {m["channel"]: m["thread_ts"] for m in fake.messages if m["thread_ts"]}
+            self.assertEqual(replies, parents)
+
+    def test_post_replies_keeps_order_and_resumes(self):
+        def crashing(count):
+            for i in range(count):
+                yield {"message": f"item {i}"}
+            raise OSError("runner lost")
+
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, \
+                patch.object(run.rate_limiter, 'enabled', False), patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api"}):
+            parent = fake.post("C12345678", "CI")["ts"]
+            progress = os.path.join(tmp_dir, 'progress.jsonl')
+
+            result = run.post_replies(crashing(3), "xoxb-1234", "C12345678", parent, progress)
+            self.assertEqual(result["posted"], 3)
+            self.assertIn("runner lost", result["error"])
+
+            # Posted right before the crash, but never written to the log
+            fake.post("C12345678", "CI", thread_ts=parent, text="item 3", metadata={
+                "event_type": run.METADATA_EVENT_TYPE, "event_payload": {"nonce": run.reply_nonce("C12345678", parent, 3)}
+            })
+            lines = [json.dumps({"message": "item 0"}), "item 1", "", "item 2", "item 3", "item 4", '{"message": "item 5", "status": "failure"}']
+            result = run.post_replies(run.read_reply_items(lines), "xoxb-1234", "C12345678", parent, progress)
+
+            self.assertEqual((result["skipped"], result["posted"], result["total"]), (4, 2, 6))
+            self.assertNotIn("error", result)
+            texts = [m["text"] for m in fake.messages if m["thread_ts"] == parent]
+            self.assertEqual(texts, [f"item {i}" for i in range(6)])
+            self.assertEqual(result["last_ts"], fake.messages[-1]["ts"])
+
+    def test_directory_resolves_names_from_one_warm_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack(page_limit=2) as fake, \
+                patch.object(run.rate_limiter, 'enabled', False), patch.dict('os.environ', {
+                    'SLACK_API_URL': f"{fake.url}/api", 'DIRECTORY_CACHE_DIR': tmp_dir,
+                    'SLACK_USER_MAP': 'hubot=robot@example.com', 'GITHUB_ACTOR': 'octocat'
+                }):
+            fake.channels = [{"id": f"C0000000{i}", "name": name} for i, name in enumerate(["general", "deploys", "releases"])]
+            fake.users = [
+                {"id": "U00000001", "name": "octocat", "profile": {"real_name": "Mona Octocat"}},
+                {"id": "U00000002", "name": "alex.a", "profile": {"real_name": "Alex"}},
+                {"id": "U00000003", "name": "alex.b", "profile": {"real_name": "Alex"}},
+                {"id": "U00000004", "name": "robot", "profile": {"email": "robot@example.com"}},
+                {"id": "U00000005", "name": "gone", "deleted": True, "profile": {}}
+            ]
+            directory = run.SlackDirectory.from_env("xoxb-1234")
+
+            self.assertEqual(directory.channel_id("#deploys"), "C00000001")
+            self.assertEqual(fake.requests["conversations.list"], 2)
+            self.assertEqual(directory.channel_id("releases"), "C00000002")
+            self.assertIsNone(directory.channel_id("#missing"))
+            self.assertIsNone(directory.channel_id("#missing"))
+            self.assertEqual(fake.requests["conversations.list"], 2)
+
+            self.assertEqual(run.actor_mention([run.Destination("", "xoxb-1234", "C00000001", "")]), "<@U00000001>")
+            self.assertEqual(run.resolve_actor("xoxb-1234", "hubot"), "U00000004")
+            self.assertIsNone(run.resolve_actor("xoxb-1234", "alex"))
+            self.assertIsNone(run.resolve_actor("xoxb-1234", "gone"))
+            # The warm-up cached emails too, so no users.lookupByEmail call
+            self.assertEqual(fake.requests["users.list"], 3)
+            self.assertNotIn("users.lookupByEmail", fake.requests)
+
+            # A later step reads the same cache file and makes no calls
+            with patch.dict('os.environ', {'SLACK_TOKEN': 'xoxb-1234', 'CHANNEL_ID': '#deploys'}):
+                self.assertEqual(run.destinations_from_env()[0].channel_id, "C00000001")
+                with patch.dict('os.environ', {'CHANNEL_ID': '#nowhere'}), self.assertRaises(ValueError):
+                    run.destinations_from_env()
+            self.assertEqual(fake.requests["conversations.list"], 2)
+            self.assertNotIn("xoxb-1234", "".join(open(os.path.join(tmp_dir, name)).read() for name in os.listdir(tmp_dir)))
+
+    def test_async_client_shares_one_pool(self):
+        async def exercise(fake):
+            transport = run_async.AsyncTransport(max_connections=4)
+            async with run_async.AsyncSlackClient("xoxb-1234", f"{fake.url}/services/T000/B000/XXXX", api_url=f"{fake.url}/api", transport=transport) as client:
+                results = await asyncio.gather(*(client.send(f"C{i:08d}", f"item {i}", author_name="Deploys") for i in range(200)))
+                webhook = run_async.AsyncSlackClient("xoxb-1234", client.webhook_url, mode="WEBHOOK", api_url=client.api_url, transport=transport)
+                posted = await webhook.send("C12345678", "via webhook", author_name="Deploys")
+                updated = await client.update("C12345678", posted["thread_ts"], "edited")
+                with tempfile.NamedTemporaryFile() as artifact:
+                    artifact.write(b"x" * 100000)
+                    artifact.flush()
+                    files = await client.upload([artifact.name], "C12345678", posted["thread_ts"])
+                with self.assertRaises(ValueError):
+                    await client.get_message_ts("C12345678", "Nobody")
+            return results, posted, updated, files, transport
+
+        with bench.FakeSlack(latency=0.01) as fake:
+            results, posted, updated, files, transport = asyncio.run(exercise(fake))
+
+        self.assertEqual([result["channel"] for result in results], [f"C{i:08d}" for i in range(200)])
+        self.assertEqual(len({result["thread_ts"] for result in results}), 200)
+        self.assertLessEqual(transport.connections, 4)
+        self.assertEqual(posted["thread_ts"], next(m["ts"] for m in fake.messages if m["channel"] == "C12345678"))
+        self.assertEqual(updated["thread_ts"], posted["thread_ts"])
+        self.assertEqual(list(fake.uploads.values()), [100000])
+        self.assertEqual(files, list(fake.uploads))
+
+    def test_async_read_timeout_applies_per_operation(self):
+        size = 16 * 1024 * 1024
+
+        async def slow_reader(reader, writer):
+            # Reads steadily but takes over a second for the whole body
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(next(line for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")).split(b":")[1])
+            while length:
+                length -= len(await reader.read(min(length, 128 * 1024)))
+                await asyncio.sleep(0.005)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        async def upload(path):
+            server = await asyncio.start_server(slow_reader, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            transport = run_async.AsyncTransport(timeout=(1.0, 0.5))
+            try:
+                with open(path, "rb") as body:
+                    start = time.perf_counter()
+                    response = await transport.request("POST", f"http://127.0.0.1:{port}/upload", data=body)
+                    return response, time.perf_counter() - start
+            finally:
+                await transport.aclose()
+                server.close()
+
+        with tempfile.NamedTemporaryFile() as artifact:
+            artifact.truncate(size)
+            response, elapsed = asyncio.run(upload(artifact.name))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(elapsed, 0.5)
+
+    def test_async_reset_before_response_is_not_sent(self):
+        async def reset(reader, writer):
+            # Linger 0 makes close() send a RST instead of a FIN
+            writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            writer.transport.abort()
+
+        async def post():
+            server = await asyncio.start_server(reset, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            transport = run_async.AsyncTransport()
+            try:
+                with self.assertRaises(run.TransportError) as error:
+                    await transport.request("POST", f"http://127.0.0.1:{port}/api/chat.postMessage", data=b"{}")
+                return error.exception
+            finally:
+                await transport.aclose()
+                server.close()
+
+        self.assertFalse(asyncio.run(post()).sent)
+
+    def test_deadline_bounds_requests_and_lookups(self):
+        # Sleeping moves the clock forward, so the budget is spent without
+        # waiting for it in real time
+        clock = MagicMock(return_value=100.0)
+        budget = run.Deadline(clock=clock)
+
+        def sleep(seconds):
+            clock.return_value += seconds
+
+        budget.expires = clock() + 3.0
+        with bench.FakeSlack(visibility_delay=30) as fake, patch('run.deadline', budget), \
+                patch('run.time.sleep', side_effect=sleep) as mock_sleep, \
+                patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api"}):
+            result = run.send_slack_message(**bench.send_kwargs(f"{fake.url}/services/T000/B000/XXXX", "C12345678"))
+            # Four polls would take about four seconds; the lookup stops early
+            # and the fallback ts is used
+            self.assertLess(sum(call.args[0] for call in mock_sleep.call_args_list), 3.0)
+            self.assertLess(fake.requests["conversations.history"], 4)
+            self.assertTrue(result.startswith("SLACK_THREAD_TS="))
+
+        budget.expires = clock() + 0.5
+        with patch('run.deadline', budget), patch('run.get_transport') as mock_get_transport:
+            session = mock_get_transport.return_value
+            session.request.side_effect = run.TransportError("timed out")
+            with self.assertRaises(run.TransportError):
+                run.http_request("POST", "https://slack.com/api/chat.postMessage", data=b"{}", headers={"Content-Type": "application/json"})
+            self.assertEqual(session.request.call_args.kwargs["timeout"], (0.5, 0.5))
+
+            clock.return_value += 1.0
+            with self.assertRaises(run.TransportError) as context:
+                run.http_request("GET", "https://slack.com/api/conversations.history")
+            self.assertFalse(context.exception.sent)
+            self.assertEqual(session.request.call_count, 1)
+
+        # The watchdog needs a real process and a real timer
+        script = "import run, time\nrun.deadline.start(0.2, grace=0.2)\ntime.sleep(10)\n"
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True)
+        self.assertEqual(process.returncode, run.DEADLINE_EXIT_CODE)
+        self.assertLess(time.perf_counter() - start, 8.0)
+
+    def test_hedged_request_takes_the_first_answer(self):
+        calls = []
+
+        def slow_then_fast(method, url, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(1.0)
+                return "slow"
+            return "fast"
+
+        with patch('run.http_request', side_effect=slow_then_fast):
+            start = time.perf_counter()
+            self.assertEqual(run.hedged_request("GET", "https://slack.com/api/conversations.history", 0.1), "fast")
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(len(calls), 2)
+
+            # A quick answer never sends the second copy
+            self.assertEqual(run.hedged_request("GET", "https://slack.com/api/conversations.history", 0.5), "fast")
+            self.assertEqual(len(calls), 3)
+
+    def test_dedup_suppresses_repeats_and_flaps(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, patch.dict('os.environ', {
+            'SLACK_API_URL': f"{fake.url}/api",
+            'SLACK_WEBHOOK': f"{fake.url}/services/T000/B000/XXXX",
+            'SLACK_TOKEN': 'xoxb-1234',
+            'CHANNEL_ID': 'C12345678',
+            'MSG_MODE': 'TOKEN',
+            'AUTHOR_NAME': 'Dedup',
+            'STATUS': 'failure',
+            'SLACK_MESSAGE': 'Tests failed after 12.5s',
+            'GITHUB_SHA': 'abc123',
+            'GITHUB_RUN_ID': '42',
+            'DEDUP_WINDOW': '3600',
+            'DEDUP_PATH': os.path.join(tmp_dir, 'dedup.json')
+        }), patch('run.get_message_ts') as mock_get_message_ts, patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            run.main()
+            first_ts = fake.messages[0]["ts"]
+            for attempt, took in (("2", "13.1s"), ("3", "9s")):
+                with patch.dict('os.environ', {'GITHUB_RUN_ATTEMPT': attempt, 'SLACK_MESSAGE': f'Tests failed after {took}'}):
+                    run.main()
+            with patch.dict('os.environ', {'STATUS': 'success', 'SLACK_MESSAGE': 'Tests passed'}):
+                run.main()
+            # Flapping back to the failure that was already announced
+            run.main()
+
+            top_level = [message for message in fake.messages if not message["thread_ts"]]
+            replies = [message for message in fake.messages if message["thread_ts"]]
+            self.assertEqual(len(top_level), 2)
+            self.assertEqual(len(replies), 1)
+            self.assertEqual(replies[0]["thread_ts"], first_ts)
+            self.assertIn("Repeated 3 times, last in run 42", replies[0]["text"])
+            self.assertEqual(fake.requests["chat.update"], 2)
+            self.assertEqual(stdout.getvalue().count(f"SLACK_THREAD_TS={first_ts}\n"), 4)
+            mock_get_message_ts.assert_not_called()
+
+            with patch.dict('os.environ', {'DEDUP_MODE': 'suppress'}):
+                run.main()
+            self.assertEqual(len(fake.messages), 3)
+            with open(os.path.join(tmp_dir, 'dedup.json')) as store_file:
+                self.assertNotIn("xoxb-1234", store_file.read())
+
+    def test_dedup_path_accepts_a_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.dict('os.environ', {'DEDUP_WINDOW': '60'}):
+            for value, expected in (
+                (os.path.join(tmp_dir, 'dedup.json'), os.path.join(tmp_dir, 'dedup.json')),
+                (tmp_dir, os.path.join(tmp_dir, run.DEDUP_FILE)),
+                (os.path.join(tmp_dir, 'cache') + os.sep, os.path.join(tmp_dir, 'cache', run.DEDUP_FILE))
+            ):
+                with patch.dict('os.environ', {'DEDUP_PATH': value}):
+                    deduplicator = run.Deduplicator.from_env()
+                    deduplicator.store.set("key", {"output": ""})
+                    self.assertEqual(deduplicator.store.path, expected)
+                    self.assertTrue(os.path.isfile(expected))
+
+    def test_json_store_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = run.JsonStore(os.path.join(tmp_dir, 'store.json'), max_entries=2)
+            store.set("a", {"n": 1})
+            store.set("b", {"n": 2})
+            store.set("a", {"n": 3})
+            store.set("c", {"n": 4})
+            self.assertIsNone(store.get("b"))
+            self.assertEqual(store.get("a")["n"], 3)
+            self.assertEqual(store.get("c")["n"], 4)
+
+    def test_telemetry_records_phases_without_secrets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, bench.FakeSlack() as fake, \
+                patch('run.telemetry', run.Telemetry()), patch('run.get_transport', return_value=run.StdlibTransport()), \
+                patch.dict('os.environ', {'SLACK_API_URL': f"{fake.url}/api", 'GITHUB_OUTPUT': os.path.join(tmp_dir, 'output')}):
+            run.send_slack_message(**bench.send_kwargs(f"{fake.url}/services/T000/B000/SECRET", "C12345678"))
+            summary = run.emit_telemetry()
+
+            for phase in ("payload_build", "send", "ts_lookup", "http", "dns", "tcp_connect", "connect"):
+                self.assertIn(phase, summary["phases"])
+            self.assertEqual(summary["phases"]["http"]["count"], 2)
+            with open(os.path.join(tmp_dir, 'output')) as output_file:
+                output = output_file.read()
+            self.assertTrue(output.startswith("TIMINGS={"))
+            self.assertNotIn("SECRET", output)
+
+            otlp = run.telemetry.otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+            ids = {span["spanId"] for span in otlp}
+            self.assertTrue(all(span.get("parentSpanId", next(iter(ids))) in ids for span in otlp))
+            self.assertNotIn("SECRET", json.dumps(otlp))
+
     @patch('run.send_slack_message')
     def test_main_with_thread_ts(self, mock_send_slack_message):
         mock_send_slack_message.return_value = "SLACK_THREAD_TS=1234567890.123456\nSLACK_CHANNEL=C12345678\nSLACK_MESSAGE_ID=1234567890.123456"